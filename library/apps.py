@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class LibraryConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'library'
+
+    def ready(self):
+        # instrumentation hooks database connections as they are created;
+        # checks registers the deployment checks
+        from . import checks, instrumentation, signals  # noqa: F401
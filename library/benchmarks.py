@@ -0,0 +1,195 @@
+"""
+View benchmarks and query budgets.
+
+``run()`` seeds synthetic catalogs of increasing size (see
+``library.synthetic``) and requests each view in ``view_urls()`` against them,
+recording SQL query count, wall time and peak Python memory. Each view has a
+query budget in ``QUERY_BUDGETS``; the budget must hold at every catalog
+size, so a view whose query count grows with the catalog (an N+1) fails
+as soon as the catalog is large enough. ``library.tests`` asserts the same
+budgets on every test run.
+
+Results are plain JSON so a later run can be compared with ``compare()``
+against a saved baseline; the ``benchmark_views`` command does both.
+
+Query counts are taken from the first, uncached request. Times are the median
+of the repeated requests that follow, which may be served from the search
+cache like production traffic.
+"""
+import io
+import platform
+import statistics as stats
+import time
+import tracemalloc
+
+import django
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, reset_queries
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+
+from . import synthetic
+from .bulk_import import CatalogImporter
+from .models import Keyword, LibraryResource, UserFavorite
+from .suggest import suggester
+
+
+BENCHMARK_USERNAME = 'benchmark'
+FAVORITES_COUNT = 50
+
+# Maximum queries per request, whatever the catalog size. Requests are made
+# logged in, so each includes the session and user lookups, and writes that
+# are normally buffered (search log, view counter) are counted too.
+QUERY_BUDGETS = {
+    'search': 13,
+    'search_filtered': 14,
+    'search_cursor': 13,
+    'search_browse': 12,
+    'search_api': 5,
+    'resource_lookup': 3,
+    'resource_detail': 12,
+    'favorites': 4,
+    'statistics': 4,
+    'keyword_autocomplete': 0,
+}
+
+# Buffered writers flush from background threads; benchmarks and tests write
+# synchronously so every query is counted against the request
+SETTINGS = {
+    'LIBRARY_SEARCH_LOG_BUFFERED': False,
+    'LIBRARY_COUNTERS_BUFFERED': False,
+    'LIBRARY_COFAVORITE_UPDATE_DELAY': None,
+}
+
+
+def seed_catalog(count, seed=1):
+    """Bring the catalog up to ``count`` synthetic resources and a benchmark user"""
+    importer = CatalogImporter(count_keywords=False)
+    importer.run(synthetic.generate(seed, count))
+    # Same as populate_sample_data --synthetic: one recompute at the end
+    call_command('recompute_keyword_frequencies', stdout=io.StringIO())
+    CatalogImporter.finish()
+
+    user, created = User.objects.get_or_create(username=BENCHMARK_USERNAME)
+    if created:
+        resources = LibraryResource.objects.order_by('pk')[:FAVORITES_COUNT]
+        UserFavorite.objects.bulk_create([
+            UserFavorite(user=user, resource=resource, date_added=timezone.now())
+            for resource in resources
+        ])
+    suggester.build()
+    cache.clear()
+    return user
+
+
+def view_urls():
+    """``{view name: URL}`` for the current catalog"""
+    resource = LibraryResource.objects.order_by('-view_count', 'pk').first()
+    keyword = Keyword.objects.order_by('-frequency', 'word').first()
+    word = keyword.word if keyword else 'research'
+    type_id = resource.resource_type_id if resource else ''
+    ids = ','.join(str(pk) for pk in LibraryResource.objects.order_by('pk').values_list('pk', flat=True)[:20])
+    return {
+        'search': f'/?query={word}',
+        'search_filtered': f'/?query={word}&resource_type={type_id}&sort_by=-publication_year',
+        'search_cursor': f'/?query={word}&paginate=cursor',
+        'search_browse': '/?sort_by=title&page=2',
+        'search_api': f'/api/search/?query={word}',
+        'resource_lookup': f'/api/resources/?ids={ids or 1}&fields=id,title,authors,keywords',
+        'resource_detail': f'/resource/{resource.pk}/' if resource else '/resource/1/',
+        'favorites': '/favorites/',
+        'statistics': '/statistics/',
+        'keyword_autocomplete': f'/api/keywords/?term={word[:3]}',
+    }
+
+
+def measure(client, url, repeat=5):
+    """Query count, cold time and peak memory of the first request, median warm time"""
+    cache.clear()
+    reset_queries()
+    tracemalloc.start()
+    started = time.perf_counter()
+    with CaptureQueriesContext(connection) as queries:
+        response = client.get(url)
+    cold = time.perf_counter() - started
+    # Later requests reset the query log, so count now
+    query_count = len(queries)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    if response.status_code != 200:
+        raise AssertionError(f'{url} returned {response.status_code}')
+
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        client.get(url)
+        times.append(time.perf_counter() - started)
+    return {
+        'queries': query_count,
+        'cold_ms': round(cold * 1000, 2),
+        'time_ms': round(stats.median(times) * 1000, 2) if times else round(cold * 1000, 2),
+        'peak_kb': round(peak / 1024, 1),
+    }
+
+
+def run(sizes, seed=1, repeat=5, progress=None):
+    """Benchmark every view at each catalog size; returns a JSON-ready dict"""
+    results = {
+        'meta': {
+            'sizes': list(sizes),
+            'seed': seed,
+            'repeat': repeat,
+            'database': connection.vendor,
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'date': timezone.now().isoformat(),
+        },
+        'budgets': QUERY_BUDGETS,
+        'results': {},
+    }
+    with override_settings(**SETTINGS):
+        for size in sizes:
+            user = seed_catalog(size, seed)
+            client = Client()
+            client.force_login(user)
+            size_results = results['results'][str(size)] = {}
+            for name, url in view_urls().items():
+                size_results[name] = measure(client, url, repeat)
+                if progress:
+                    progress(size, name, size_results[name])
+    return results
+
+
+def compare(current, baseline, tolerance=0.25, min_ms=2.0):
+    """
+    Regressions in ``current`` against the budgets and ``baseline``.
+
+    A view regresses if it runs more queries than its budget or than the
+    baseline, or if its time or peak memory grew by more than ``tolerance``
+    (times within ``min_ms`` of the baseline are treated as noise).
+    """
+    problems = []
+    for size, views in current['results'].items():
+        for name, result in views.items():
+            budget = QUERY_BUDGETS.get(name)
+            if budget is not None and result['queries'] > budget:
+                problems.append(f'{name} @ {size}: {result["queries"]} queries, budget is {budget}')
+            before = (baseline or {}).get('results', {}).get(size, {}).get(name)
+            if not before:
+                continue
+            if result['queries'] > before['queries']:
+                problems.append(
+                    f'{name} @ {size}: {result["queries"]} queries, baseline {before["queries"]}'
+                )
+            if result['time_ms'] > before['time_ms'] * (1 + tolerance) + min_ms:
+                problems.append(
+                    f'{name} @ {size}: {result["time_ms"]}ms, baseline {before["time_ms"]}ms'
+                )
+            if result['peak_kb'] > before['peak_kb'] * (1 + tolerance):
+                problems.append(
+                    f'{name} @ {size}: peak {result["peak_kb"]}KB, baseline {before["peak_kb"]}KB'
+                )
+    return problems
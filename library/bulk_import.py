@@ -0,0 +1,472 @@
+"""
+Bulk catalog loading.
+
+``CatalogImporter`` takes a stream of catalog records (plain dicts, see
+``RECORD_FIELDS``) and writes them in chunks: authors, subjects and keywords
+are resolved through in-memory maps (new ones are created with one
+``bulk_create`` per chunk), resources are inserted with ``bulk_create`` and
+their author, subject and keyword links with multi-row INSERTs into the
+through tables. Memory is bounded by the chunk size and the vocabulary, never by the
+size of the input.
+
+Records are keyed on ISBN and DOI: a record whose ISBN or DOI is already in
+the catalog is skipped, so re-running an import is a no-op. Records with
+neither are skipped unless ``allow_unkeyed`` is set, since there is no way
+to recognise them on the next run.
+
+``bulk_create`` sends no signals, so the importer keeps derived data in sync
+itself: the full-text index and keyword frequencies per chunk, and the
+catalog version, statistics snapshot and related resources in ``finish()``.
+
+Readers for CSV, JSON Lines and MARCXML turn files into records one at a
+time.
+"""
+import csv
+import json
+import re
+import sys
+import time
+import xml.etree.ElementTree as ET
+from collections import Counter, defaultdict
+
+from django.db import connection, transaction
+from django.db.models import F
+
+from . import cards, related, statistics
+from .models import Author, Keyword, LibraryResource, ResourceType, Subject
+from .search_backends import get_search_backend
+from .search_cache import bump_catalog_version
+
+
+# LibraryResource fields a record may carry, besides the relations
+RESOURCE_FIELDS = (
+    'title', 'description', 'abstract', 'publication_year', 'publisher',
+    'isbn', 'doi', 'call_number', 'location', 'availability', 'url', 'pages',
+    'language', 'view_count', 'download_count',
+)
+
+NUMBER_FIELDS = {'publication_year', 'pages', 'view_count', 'download_count'}
+
+# Multi-valued record fields; strings are split on ';'
+RECORD_FIELDS = RESOURCE_FIELDS + ('resource_type', 'authors', 'subjects', 'keywords')
+
+DEFAULT_CHUNK_SIZE = 1000
+
+AVAILABILITY_VALUES = {value for value, _ in LibraryResource.AVAILABILITY_CHOICES}
+
+
+class InvalidRecord(ValueError):
+    pass
+
+
+def _split(value):
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = value.split(';')
+    return [str(item).strip() for item in value if item and str(item).strip()]
+
+
+def _first_number(value):
+    if isinstance(value, int):
+        return value
+    match = re.search(r'\d+', str(value or ''))
+    return int(match.group()) if match else None
+
+
+def split_author_name(name):
+    """``'Last, First'`` or ``'First Last'`` -> ``(first, last)``"""
+    name = ' '.join(name.strip(' .,').split())
+    if ',' in name:
+        last, first = name.split(',', 1)
+        return first.strip(' .'), last.strip()
+    if ' ' in name:
+        first, last = name.rsplit(' ', 1)
+        return first, last
+    return '', name
+
+
+def _max_lengths(model):
+    return {
+        field.name: field.max_length
+        for field in model._meta.get_fields()
+        if getattr(field, 'max_length', None)
+    }
+
+
+# Readers ---------------------------------------------------------------
+
+def read_csv(path):
+    """One record per row; multi-valued columns are ';'-separated"""
+    csv.field_size_limit(sys.maxsize)
+    with open(path, newline='', encoding='utf-8') as f:
+        yield from csv.DictReader(f)
+
+
+def read_jsonl(path):
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+MARC_LANGUAGES = {
+    'eng': 'English', 'fre': 'French', 'ger': 'German', 'spa': 'Spanish',
+    'ita': 'Italian', 'por': 'Portuguese', 'rus': 'Russian', 'chi': 'Chinese',
+    'jpn': 'Japanese', 'ara': 'Arabic',
+}
+
+
+def _local(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def _clean(value):
+    return value.strip(' /:;,.') if value else ''
+
+
+def _marc_record(element):
+    leader = ''
+    control = {}
+    data = defaultdict(list)
+    for field in element:
+        tag = _local(field.tag)
+        if tag == 'leader':
+            leader = field.text or ''
+        elif tag == 'controlfield':
+            control[field.get('tag')] = field.text or ''
+        elif tag == 'datafield':
+            subfields = defaultdict(list)
+            for subfield in field:
+                subfields[subfield.get('code')].append((subfield.text or '').strip())
+            data[field.get('tag')].append((field.get('ind1', ' '), subfields))
+
+    def values(tag, code):
+        return [value for _, subfields in data[tag] for value in subfields[code] if value]
+
+    def first(*specs):
+        for tag, code in specs:
+            found = values(tag, code)
+            if found:
+                return found[0]
+        return ''
+
+    title = ' '.join(_clean(value) for value in values('245', 'a')[:1] + values('245', 'b')[:1])
+    record = {
+        'title': title,
+        'authors': [_clean(name) for name in values('100', 'a') + values('700', 'a')],
+        'subjects': [_clean(name) for name in values('650', 'a') + values('651', 'a')],
+        'keywords': [_clean(word) for word in values('653', 'a')],
+        'isbn': first(('020', 'a')).split(' ')[0],
+        'publisher': _clean(first(('264', 'b'), ('260', 'b'))),
+        'publication_year': first(('264', 'c'), ('260', 'c')) or control.get('008', '')[7:11],
+        'pages': first(('300', 'a')),
+        'url': first(('856', 'u')),
+        'call_number': ' '.join(filter(None, [first(('050', 'a'), ('090', 'a')), first(('050', 'b'), ('090', 'b'))])),
+    }
+    for ind1, subfields in data['024']:
+        if ind1 == '7' and 'doi' in [source.lower() for source in subfields['2']] and subfields['a']:
+            record['doi'] = subfields['a'][0]
+    for ind1, subfields in data['520']:
+        key = 'abstract' if ind1 == '3' else 'description'
+        if subfields['a'] and not record.get(key):
+            record[key] = subfields['a'][0]
+    language = control.get('008', '')[35:38]
+    if language.strip():
+        record['language'] = MARC_LANGUAGES.get(language, language)
+
+    # Leader/06-07: type of record and bibliographic level
+    record_type, level = (leader[6:8] + '  ')[:2]
+    if data['502']:
+        record['resource_type'] = 'thesis'
+    elif record_type in 'at' and level in 'sb':
+        record['resource_type'] = 'journal'
+    elif record_type == 'm':
+        record['resource_type'] = 'digital'
+    elif record_type in 'gijk':
+        record['resource_type'] = 'multimedia'
+    else:
+        record['resource_type'] = 'book'
+    return record
+
+
+def read_marcxml(path):
+    root = None
+    for event, element in ET.iterparse(path, events=('start', 'end')):
+        if root is None:
+            root = element
+        if event == 'end' and _local(element.tag) == 'record':
+            yield _marc_record(element)
+            # Drop parsed records so memory stays flat
+            root.clear()
+
+
+READERS = {
+    'csv': read_csv,
+    'jsonl': read_jsonl,
+    'marcxml': read_marcxml,
+}
+
+EXTENSIONS = {
+    '.csv': 'csv',
+    '.jsonl': 'jsonl',
+    '.ndjson': 'jsonl',
+    '.xml': 'marcxml',
+    '.marcxml': 'marcxml',
+}
+
+
+def detect_format(path):
+    for extension, name in EXTENSIONS.items():
+        if path.lower().endswith(extension):
+            return name
+    return None
+
+
+def insert_links(through, column, pairs, batch_size=500):
+    """
+    Insert ``(resource_id, other_id)`` rows into an m2m through table with
+    multi-row INSERTs, without building a model instance per link.
+    """
+    quote = connection.ops.quote_name
+    prefix = 'INSERT INTO {} ({}, {}) VALUES '.format(
+        quote(through._meta.db_table), quote('libraryresource_id'), quote(column)
+    )
+    with connection.cursor() as cursor:
+        for start in range(0, len(pairs), batch_size):
+            batch = pairs[start:start + batch_size]
+            cursor.execute(
+                prefix + ', '.join(['(%s, %s)'] * len(batch)),
+                [value for pair in batch for value in pair]
+            )
+
+
+# Importer --------------------------------------------------------------
+
+class ImportStats:
+    def __init__(self):
+        self.started = time.monotonic()
+        self.read = 0
+        self.created = 0
+        self.existing = 0
+        self.unkeyed = 0
+        self.invalid = 0
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    @property
+    def rate(self):
+        return self.read / self.elapsed if self.elapsed else 0.0
+
+
+class CatalogImporter:
+    def __init__(self, chunk_size=DEFAULT_CHUNK_SIZE, allow_unkeyed=False, default_type='book',
+                 count_keywords=True):
+        if not connection.features.can_return_rows_from_bulk_insert:
+            raise NotImplementedError('Bulk import needs a database that returns ids from bulk inserts')
+        self.chunk_size = chunk_size
+        self.allow_unkeyed = allow_unkeyed
+        self.default_type = default_type
+        # Parallel importers should leave Keyword.frequency to a recompute
+        # afterwards rather than contend for the same keyword rows
+        self.count_keywords = count_keywords
+        self.stats = ImportStats()
+        self.errors = []
+
+        self.resource_lengths = _max_lengths(LibraryResource)
+        self.authors = {
+            (first, last): pk
+            for pk, first, last in Author.objects.values_list('pk', 'first_name', 'last_name').iterator()
+        }
+        self.subjects = dict(Subject.objects.values_list('name', 'pk'))
+        self.keywords = {word: pk for word, pk in Keyword.objects.values_list('word', 'pk').iterator()}
+        self.types = {}
+        for rtype in ResourceType.objects.all():
+            self.types[rtype.name] = rtype.pk
+            self.types[str(rtype).lower()] = rtype.pk
+
+    def run(self, records, progress=None):
+        """Import an iterable of records; ``progress(stats)`` is called per chunk"""
+        chunk = []
+        for record in records:
+            chunk.append(record)
+            if len(chunk) >= self.chunk_size:
+                self.import_chunk(chunk)
+                chunk = []
+                if progress:
+                    progress(self.stats)
+        if chunk:
+            self.import_chunk(chunk)
+            if progress:
+                progress(self.stats)
+        return self.stats
+
+    @staticmethod
+    def finish(rebuild_related=True):
+        """Refresh catalog-wide derived data once the import is done"""
+        bump_catalog_version()
+        with transaction.atomic():
+            statistics.rebuild()
+        if rebuild_related:
+            related.build()
+
+    # Records -----------------------------------------------------------
+
+    def _resource_type(self, value):
+        value = (value or self.default_type).strip()
+        pk = self.types.get(value) or self.types.get(value.lower())
+        if pk is None:
+            names = dict(ResourceType.TYPE_CHOICES)
+            if value.lower() not in names:
+                raise InvalidRecord(f'unknown resource type {value!r}')
+            rtype, _ = ResourceType.objects.get_or_create(name=value.lower())
+            pk = self.types[rtype.name] = self.types[str(rtype).lower()] = rtype.pk
+        return pk
+
+    def _parse(self, record):
+        fields = {}
+        for name in RESOURCE_FIELDS:
+            value = record.get(name)
+            if value is None or value == '':
+                continue
+            if name in NUMBER_FIELDS:
+                value = _first_number(value)
+            elif name in ('description', 'abstract'):
+                value = str(value).strip()
+            else:
+                value = ' '.join(str(value).split())[:self.resource_lengths.get(name)]
+            if value is not None:
+                fields[name] = value
+
+        if not fields.get('title'):
+            raise InvalidRecord('missing title')
+        if fields.get('publication_year') is None:
+            raise InvalidRecord('missing publication year')
+        if fields.get('availability', 'available') not in AVAILABILITY_VALUES:
+            raise InvalidRecord(f"unknown availability {fields['availability']!r}")
+        fields.setdefault('description', '')
+        fields['resource_type_id'] = self._resource_type(record.get('resource_type'))
+
+        authors = []
+        for name in _split(record.get('authors')):
+            first, last = split_author_name(name)
+            if last:
+                authors.append((first[:100], last[:100]))
+        subjects = [name[:100] for name in _split(record.get('subjects'))]
+        keywords = [word.lower()[:100] for word in _split(record.get('keywords'))]
+        return fields, authors, subjects, keywords
+
+    # Chunks ------------------------------------------------------------
+
+    def import_chunk(self, records):
+        parsed = []
+        for record in records:
+            self.stats.read += 1
+            try:
+                parsed.append(self._parse(record))
+            except (InvalidRecord, TypeError, ValueError) as e:
+                self.stats.invalid += 1
+                if len(self.errors) < 100:
+                    self.errors.append(f'record {self.stats.read}: {e}')
+
+        parsed = self._drop_existing(parsed)
+        if not parsed:
+            return
+
+        with transaction.atomic():
+            self._resolve(Author, self.authors, {a for _, authors, _, _ in parsed for a in authors})
+            self._resolve(Subject, self.subjects, {s for _, _, subjects, _ in parsed for s in subjects})
+            self._resolve(Keyword, self.keywords, {k for _, _, _, keywords in parsed for k in keywords})
+
+            # Card fields are filled in here rather than re-read after linking
+            frequencies = dict(Keyword.objects.filter(
+                pk__in={self.keywords[k] for _, _, _, keywords in parsed for k in keywords}
+            ).values_list('pk', 'frequency'))
+            for fields, authors, _, keywords in parsed:
+                fields.update(cards.card_fields(
+                    authors, [(k, frequencies[self.keywords[k]]) for k in keywords]
+                ))
+            
+            resources = LibraryResource.objects.bulk_create(
+                [LibraryResource(**fields) for fields, _, _, _ in parsed]
+            )
+            author_links, subject_links, keyword_links = [], [], []
+            keyword_counts = Counter()
+            for resource, (_, authors, subjects, keywords) in zip(resources, parsed):
+                author_links.extend((resource.pk, author_id) for author_id in {self.authors[a] for a in authors})
+                subject_links.extend((resource.pk, subject_id) for subject_id in {self.subjects[s] for s in subjects})
+                for keyword_id in {self.keywords[keyword] for keyword in keywords}:
+                    keyword_links.append((resource.pk, keyword_id))
+                    keyword_counts[keyword_id] += 1
+            insert_links(LibraryResource.authors.through, 'author_id', author_links)
+            insert_links(LibraryResource.subjects.through, 'subject_id', subject_links)
+            insert_links(Keyword.resources.through, 'keyword_id', keyword_links)
+
+            if self.count_keywords:
+                self._count_keywords(keyword_counts)
+
+            get_search_backend().index_resources([resource.pk for resource in resources])
+
+        self.stats.created += len(resources)
+
+    def _count_keywords(self, keyword_counts):
+        """Keyword.frequency, one UPDATE per distinct increment"""
+        by_count = defaultdict(list)
+        for keyword_id, count in keyword_counts.items():
+            by_count[count].append(keyword_id)
+        for count, keyword_ids in by_count.items():
+            Keyword.objects.filter(pk__in=keyword_ids).update(frequency=F('frequency') + count)
+
+    def _drop_existing(self, parsed):
+        """Skip records whose ISBN or DOI is already in the catalog or chunk"""
+        isbns = {fields['isbn'] for fields, _, _, _ in parsed if fields.get('isbn')}
+        dois = {fields['doi'] for fields, _, _, _ in parsed if fields.get('doi')}
+        seen_isbns = set(
+            LibraryResource.objects.filter(isbn__in=isbns).values_list('isbn', flat=True)
+        ) if isbns else set()
+        seen_dois = set(
+            LibraryResource.objects.filter(doi__in=dois).values_list('doi', flat=True)
+        ) if dois else set()
+
+        kept = []
+        for item in parsed:
+            isbn, doi = item[0].get('isbn'), item[0].get('doi')
+            if not isbn and not doi and not self.allow_unkeyed:
+                self.stats.unkeyed += 1
+                continue
+            if (isbn and isbn in seen_isbns) or (doi and doi in seen_dois):
+                self.stats.existing += 1
+                continue
+            if isbn:
+                seen_isbns.add(isbn)
+            if doi:
+                seen_dois.add(doi)
+            kept.append(item)
+        return kept
+
+    def _resolve(self, model, lookup, keys):
+        """Create the ``keys`` missing from ``lookup`` and record their ids"""
+        missing = keys - lookup.keys()
+        if not missing:
+            return
+        if model is Author:
+            objects = [Author(first_name=first, last_name=last) for first, last in missing]
+            created = Author.objects.filter(
+                last_name__in={last for _, last in missing}
+            ).values_list('first_name', 'last_name', 'pk')
+            key = lambda row: (row[0], row[1])
+        elif model is Subject:
+            objects = [Subject(name=name) for name in missing]
+            created = Subject.objects.filter(name__in=missing).values_list('name', 'pk')
+            key = lambda row: row[0]
+        else:
+            objects = [Keyword(word=word) for word in missing]
+            created = Keyword.objects.filter(word__in=missing).values_list('word', 'pk')
+            key = lambda row: row[0]
+        # ignore_conflicts: another import may have created some meanwhile
+        model.objects.bulk_create(objects, batch_size=self.chunk_size, ignore_conflicts=True)
+        for row in created:
+            if key(row) in missing:
+                lookup[key(row)] = row[-1]
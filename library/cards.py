@@ -0,0 +1,87 @@
+"""
+Denormalized search-card fields.
+
+Result cards show each resource's authors and first few keywords. Rather
+than prefetching every author and keyword of every result, the display
+values are stored on ``LibraryResource`` itself -- ``author_names``,
+``top_keywords`` and ``keyword_count`` -- so a page of cards is one query
+on one table (plus the resource type join).
+
+``library.signals`` calls ``refresh_on_commit()`` when a resource's authors
+or keywords change, or an author or keyword is renamed or deleted.
+``top_keywords`` lists the resource's most frequent keywords as of that
+refresh; ``rebuild()`` (the ``rebuild_search_cards`` command, also run by
+``recompute_keyword_frequencies``) brings every resource up to date.
+"""
+from django.db import transaction
+
+from .models import Keyword, LibraryResource
+
+
+CARD_KEYWORDS = 5
+CARD_FIELDS = ['author_names', 'top_keywords', 'keyword_count']
+
+# Resources per query / bulk_update
+CHUNK_SIZE = 500
+
+
+def card_fields(authors, keywords):
+    """
+    Card fields from ``(first name, last name)`` author pairs and
+    ``(word, frequency)`` keyword pairs, ordered as the model orders them.
+    """
+    authors = sorted(set(authors), key=lambda name: (name[1], name[0]))
+    keywords = sorted(set(keywords), key=lambda keyword: (-keyword[1], keyword[0]))
+    return {
+        'author_names': ', '.join(f'{first} {last}' for first, last in authors)[:500],
+        'top_keywords': [word for word, _ in keywords[:CARD_KEYWORDS]],
+        'keyword_count': len(keywords),
+    }
+
+
+def card_values(resource_ids):
+    """``{resource id: {field: value}}`` computed from the link tables"""
+    authors = {pk: [] for pk in resource_ids}
+    keywords = {pk: [] for pk in resource_ids}
+    author_rows = LibraryResource.authors.through.objects.filter(
+        libraryresource_id__in=resource_ids
+    ).values_list('libraryresource_id', 'author__first_name', 'author__last_name')
+    for pk, first_name, last_name in author_rows:
+        authors[pk].append((first_name, last_name))
+    keyword_rows = Keyword.resources.through.objects.filter(
+        libraryresource_id__in=resource_ids
+    ).values_list('libraryresource_id', 'keyword__word', 'keyword__frequency')
+    for pk, word, frequency in keyword_rows:
+        keywords[pk].append((word, frequency))
+    return {pk: card_fields(authors[pk], keywords[pk]) for pk in resource_ids}
+
+
+def refresh(resource_ids):
+    """Recompute the card fields of ``resource_ids``, writing only changes"""
+    resource_ids = sorted(set(resource_ids or ()))
+    updated = 0
+    for start in range(0, len(resource_ids), CHUNK_SIZE):
+        chunk = resource_ids[start:start + CHUNK_SIZE]
+        values = card_values(chunk)
+        changed = []
+        for resource in LibraryResource.objects.filter(pk__in=chunk).only('pk', *CARD_FIELDS):
+            card = values[resource.pk]
+            if any(getattr(resource, field) != card[field] for field in CARD_FIELDS):
+                for field in CARD_FIELDS:
+                    setattr(resource, field, card[field])
+                changed.append(resource)
+        # bulk_update sends no post_save, so nothing else is re-derived
+        LibraryResource.objects.bulk_update(changed, CARD_FIELDS)
+        updated += len(changed)
+    return updated
+
+
+def refresh_on_commit(resource_ids):
+    resource_ids = set(resource_ids or ())
+    if resource_ids:
+        transaction.on_commit(lambda: refresh(resource_ids))
+
+
+def rebuild():
+    """Recompute every resource's card fields; returns how many changed"""
+    return refresh(LibraryResource.objects.values_list('pk', flat=True))
@@ -0,0 +1,63 @@
+"""
+System checks for the deployment settings the library's caches rely on.
+
+The search result cache is invalidated by moving a catalog version kept in
+Django's cache (``library.search_cache``); so are the favorites and
+recommendation versions. With a per-process cache (``LocMemCache``) a bump
+only reaches the worker that made the write, and every other worker keeps
+serving pages cached against the old catalog. ``check_shared_cache`` warns
+when more than one worker process is configured without a shared cache, and
+``library.search_cache`` stops caching search results in that case.
+
+Application servers do not run system checks, so ``wsgi.py`` and
+``asgi.py`` call ``check_cache_at_startup()``, which logs the same warning,
+or refuses to start if ``LIBRARY_REQUIRE_SHARED_CACHE`` is set.
+
+Settings:
+
+* ``LIBRARY_WORKER_PROCESSES`` -- worker processes serving the site
+  (settings.py reads ``WEB_CONCURRENCY``, which gunicorn also uses)
+* ``LIBRARY_REQUIRE_SHARED_CACHE`` -- raise ImproperlyConfigured at startup
+  instead of warning (default False)
+"""
+import logging
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+
+logger = logging.getLogger(__name__)
+
+
+def worker_processes():
+    return getattr(settings, 'LIBRARY_WORKER_PROCESSES', 1)
+
+
+def per_process_cache():
+    """Whether several workers would each keep their own default cache"""
+    return worker_processes() > 1 and isinstance(caches['default'], LocMemCache)
+
+
+@checks.register(checks.Tags.caches)
+def check_shared_cache(app_configs=None, **kwargs):
+    if per_process_cache():
+        workers = worker_processes()
+        return [checks.Warning(
+            f'The default cache is local to each process, but {workers} worker processes are '
+            f'configured; catalog changes would only invalidate the cache of one of them.',
+            hint='Search results are not cached until a shared cache is configured '
+                 '(set REDIS_URL) or a single worker is run.',
+            id='library.E001',
+        )]
+    return []
+
+
+def check_cache_at_startup():
+    """Log ``check_shared_cache`` warnings, or raise if a shared cache is required"""
+    for warning in check_shared_cache():
+        message = f'{warning.msg} {warning.hint}'
+        if getattr(settings, 'LIBRARY_REQUIRE_SHARED_CACHE', False):
+            raise ImproperlyConfigured(message)
+        logger.warning('%s (%s)', message, warning.id)
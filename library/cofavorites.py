@@ -0,0 +1,350 @@
+"""
+Precomputed "patrons who favorited this also favorited" recommendations.
+
+Two resources are similar when the same patrons favorited both. Each shared
+patron counts ``1 / log(1 + f)``, where ``f`` is how many resources the
+patron has favorited, so a patron with a few favorites says more than one
+who favorites everything. The sum is divided by ``sqrt(n_a * n_b)``, the
+geometric mean of how many patrons favorited each resource (the cosine of
+their patron vectors), so popular resources do not turn up next to
+everything. The top ``LIBRARY_COFAVORITE_COUNT`` (default 5) of every
+resource are stored in ``CoFavorite``; the detail page reads them with one
+indexed lookup, and the profile page sums them over the user's recent
+favorites with one aggregate query.
+
+Scores are computed as a sparse product of the user/resource favorites
+matrix with its transpose: ``UserFavorite`` is read once into posting lists
+(the patrons of each resource and the favorites of each patron), and each
+resource accumulates scores over the favorites of its own patrons only.
+``build()`` does every resource (``rebuild_cofavorites`` command);
+``update()`` recomputes the resources whose favorites changed and the
+neighbours they can affect.
+
+A recompute takes far longer than a favorite toggle, so it is kept off the
+request path: ``library.signals`` and ``library.favorites.apply()`` only
+queue the resources whose favorites changed (``CoFavoriteUpdate``, one
+INSERT per transaction however many favorites it touched, cascades
+included). A background thread in each process drains the queue
+``LIBRARY_COFAVORITE_UPDATE_DELAY`` seconds after the first change, so a
+burst of toggles shares one recompute; the ``update_cofavorites`` command
+drains it too, e.g. from cron when the delay is set to None.
+
+A pair is only stored when at least ``LIBRARY_COFAVORITE_MIN_USERS``
+patrons favorited both, so a recommendation never reveals what a single
+patron favorited.
+
+``version(resource_id)`` changes whenever the stored rows of that resource
+do (or everything is rebuilt); its detail page ETag includes it
+(``library.conditional``), so a favorite only revalidates the pages whose
+recommendations it changed.
+
+Settings:
+
+* ``LIBRARY_COFAVORITE_COUNT`` -- recommendations kept per resource
+  (default 5)
+* ``LIBRARY_COFAVORITE_MIN_USERS`` -- patrons a pair must share (default 2)
+* ``LIBRARY_COFAVORITE_MAX_USER_FAVORITES`` -- patrons with more favorites
+  than this are ignored as too indiscriminate to mean anything
+  (default 500)
+* ``LIBRARY_COFAVORITE_PROFILE_SOURCES`` -- recent favorites the profile
+  page's recommendations are drawn from (default 20)
+* ``LIBRARY_COFAVORITE_AUTO_UPDATE`` -- set False to skip incremental
+  updates, e.g. during bulk imports followed by a rebuild
+* ``LIBRARY_COFAVORITE_UPDATE_DELAY`` -- seconds the background thread
+  waits before draining the queue (default 5); None leaves the queue to
+  the ``update_cofavorites`` command
+"""
+import datetime
+import heapq
+import itertools
+import logging
+import math
+import os
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Count, Sum
+
+from .deferred import on_commit_batch
+from .models import CoFavorite, CoFavoriteUpdate, LibraryResource, UserFavorite
+
+
+logger = logging.getLogger(__name__)
+
+# Changes on every build(); each resource's key when update() rewrites its rows
+GENERATION_KEY = 'library:cofavorites:generation'
+RESOURCE_VERSION_KEY = 'library:cofavorites:resource:%s'
+
+# Ids per query / rows per INSERT
+CHUNK_SIZE = 500
+
+
+def recommendation_count():
+    return getattr(settings, 'LIBRARY_COFAVORITE_COUNT', 5)
+
+
+def _chunks(items, size=CHUNK_SIZE):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def version(resource_id):
+    """Token (a time in ns) that changes whenever the stored rows of ``resource_id`` do"""
+    resource_key = RESOURCE_VERSION_KEY % resource_id
+    stamps = cache.get_many([GENERATION_KEY, resource_key])
+    generation = stamps.get(GENERATION_KEY)
+    if generation is None:
+        cache.add(GENERATION_KEY, time.time_ns(), timeout=None)
+        generation = cache.get(GENERATION_KEY)
+    return max(generation, stamps.get(resource_key, 0))
+
+
+def changed_at(resource_id):
+    """When the stored rows of ``resource_id`` last changed (or the version was first read)"""
+    return datetime.datetime.fromtimestamp(version(resource_id) / 1e9, tz=datetime.timezone.utc)
+
+
+def _rebuilt():
+    cache.set(GENERATION_KEY, time.time_ns(), timeout=None)
+
+
+def _changed(resource_ids):
+    now = time.time_ns()
+    cache.set_many({RESOURCE_VERSION_KEY % pk: now for pk in resource_ids}, timeout=None)
+
+
+def _load(resource_ids=None):
+    """
+    Patrons of ``resource_ids`` (all resources when None), every favorite of
+    those patrons, and how many patrons favorited each resource reached.
+    """
+    patrons = defaultdict(list)
+    favorites = defaultdict(list)
+    if resource_ids is None:
+        rows = UserFavorite.objects.values_list('user_id', 'resource_id')
+        for user_id, resource_id in rows.iterator():
+            patrons[resource_id].append(user_id)
+            favorites[user_id].append(resource_id)
+        popularity = {resource_id: len(users) for resource_id, users in patrons.items()}
+        return patrons, favorites, popularity
+
+    for chunk in _chunks(resource_ids):
+        rows = UserFavorite.objects.filter(resource_id__in=chunk).values_list('resource_id', 'user_id')
+        for resource_id, user_id in rows.iterator():
+            patrons[resource_id].append(user_id)
+    user_ids = {user_id for users in patrons.values() for user_id in users}
+    for chunk in _chunks(user_ids):
+        rows = UserFavorite.objects.filter(user_id__in=chunk).values_list('user_id', 'resource_id')
+        for user_id, resource_id in rows.iterator():
+            favorites[user_id].append(resource_id)
+    reached = {resource_id for resources in favorites.values() for resource_id in resources}
+    popularity = {}
+    for chunk in _chunks(reached):
+        counts = (
+            UserFavorite.objects.filter(resource_id__in=chunk)
+            .values_list('resource_id').annotate(patrons=Count('id')).order_by()
+        )
+        popularity.update(counts)
+    return patrons, favorites, popularity
+
+
+def compute_neighbours(resource_ids=None):
+    """Yield ``(resource_id, [(other_id, score), ...])``, best first"""
+    min_users = getattr(settings, 'LIBRARY_COFAVORITE_MIN_USERS', 2)
+    max_favorites = getattr(settings, 'LIBRARY_COFAVORITE_MAX_USER_FAVORITES', 500)
+    count = recommendation_count()
+    patrons, favorites, popularity = _load(resource_ids)
+
+    user_weight = {}
+    for user_id, resources in favorites.items():
+        if 1 < len(resources) <= max_favorites:
+            user_weight[user_id] = 1 / math.log(1 + len(resources))
+
+    for resource_id, users in patrons.items():
+        scores = defaultdict(float)
+        shared = defaultdict(int)
+        for user_id in users:
+            weight = user_weight.get(user_id)
+            if weight is None:
+                continue
+            for other_id in favorites[user_id]:
+                scores[other_id] += weight
+                shared[other_id] += 1
+        scores.pop(resource_id, None)
+        norm = math.sqrt(popularity[resource_id])
+        candidates = (
+            (other_id, score / (norm * math.sqrt(popularity[other_id])))
+            for other_id, score in scores.items()
+            if shared[other_id] >= min_users
+        )
+        # Ties go to the older (lower id) resource so results are stable
+        yield resource_id, heapq.nlargest(count, candidates, key=lambda item: (item[1], -item[0]))
+
+
+def _rows(neighbours):
+    for resource_id, others in neighbours:
+        for other_id, score in others:
+            yield CoFavorite(resource_id=resource_id, related_id=other_id, score=score)
+
+
+def _insert(rows):
+    rows = iter(rows)
+    total = 0
+    while True:
+        chunk = list(itertools.islice(rows, CHUNK_SIZE))
+        if not chunk:
+            return total
+        CoFavorite.objects.bulk_create(chunk)
+        total += len(chunk)
+
+
+def build():
+    """Recompute recommendations for every resource; returns rows written"""
+    with transaction.atomic():
+        CoFavorite.objects.all().delete()
+        total = _insert(_rows(compute_neighbours()))
+        transaction.on_commit(_rebuilt)
+    return total
+
+
+def update(resource_ids):
+    """
+    Recompute after favorites of ``resource_ids`` were added or removed (or
+    the resources deleted). Their own neighbours are recomputed, as are the
+    resources that listed them or that they now list, since the score is
+    symmetric. Other resources may drift until the next ``build()``.
+    """
+    resource_ids = set(resource_ids)
+    if not resource_ids:
+        return
+    with transaction.atomic():
+        existing = set(LibraryResource.objects.filter(pk__in=resource_ids).values_list('pk', flat=True))
+        neighbours = dict(compute_neighbours(existing))
+        affected = {
+            other_id for others in neighbours.values() for other_id, _ in others
+        }
+        for chunk in _chunks(resource_ids):
+            affected.update(
+                CoFavorite.objects.filter(related_id__in=chunk).values_list('resource_id', flat=True)
+            )
+        affected -= resource_ids
+        neighbours.update(compute_neighbours(affected))
+
+        # Replace the rows of every recomputed resource; one no longer
+        # sharing enough patrons with any other gets none
+        recomputed = existing | affected
+        for chunk in _chunks(recomputed):
+            CoFavorite.objects.filter(resource_id__in=chunk).delete()
+        _insert(_rows(neighbours.items()))
+        transaction.on_commit(lambda: _changed(recomputed))
+
+
+# Update queue ----------------------------------------------------------
+
+def enqueue(resource_ids):
+    """Queue ``resource_ids`` for ``update()`` and wake the background thread"""
+    CoFavoriteUpdate.objects.bulk_create(
+        [CoFavoriteUpdate(resource_id=pk) for pk in resource_ids],
+        batch_size=CHUNK_SIZE, ignore_conflicts=True,
+    )
+    queue_worker.wake()
+
+
+def update_on_commit(resource_ids):
+    """Queue ``resource_ids`` once the current transaction commits, all in one INSERT"""
+    if getattr(settings, 'LIBRARY_COFAVORITE_AUTO_UPDATE', True):
+        on_commit_batch(enqueue, resource_ids)
+
+
+def process_queue():
+    """``update()`` the queued resources, a chunk at a time; returns how many"""
+    total = 0
+    while True:
+        with transaction.atomic():
+            # Concurrent drains (threads of other processes, the command)
+            # take different rows where the database can skip locked ones
+            resource_ids = list(
+                CoFavoriteUpdate.objects.select_for_update(skip_locked=True)
+                .values_list('resource_id', flat=True)[:CHUNK_SIZE]
+            )
+            if not resource_ids:
+                return total
+            CoFavoriteUpdate.objects.filter(resource_id__in=resource_ids).delete()
+            update(resource_ids)
+        total += len(resource_ids)
+
+
+class QueueWorker:
+    """Per-process thread that drains the queue a little after it is woken"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = None
+        self._wake = threading.Event()
+
+    @property
+    def delay(self):
+        return getattr(settings, 'LIBRARY_COFAVORITE_UPDATE_DELAY', 5)
+
+    def wake(self):
+        if self.delay is None:
+            return
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    # Forked workers start a thread of their own
+                    self._wake = threading.Event()
+                    thread = threading.Thread(target=self._run, name='cofavorite-updates', daemon=True)
+                    thread.start()
+                    self._pid = os.getpid()
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            # Changes made meanwhile are picked up by the same drain
+            time.sleep(self.delay or 0)
+            self._wake.clear()
+            try:
+                process_queue()
+            except Exception:
+                logger.exception('Updating "also favorited" recommendations failed')
+            finally:
+                connection.close()
+
+
+queue_worker = QueueWorker()
+
+
+def also_favorited(resource):
+    """The stored recommendations for ``resource``, best first"""
+    entries = resource.cofavorite_entries.select_related('related').order_by('-score', 'related_id')
+    return [entry.related for entry in entries[:recommendation_count()]]
+
+
+def recommended_for(user):
+    """
+    Resources similar to the user's recent favorites that the user has not
+    favorited, best first (empty when signed out)
+    """
+    if not user.is_authenticated:
+        return []
+    sources = getattr(settings, 'LIBRARY_COFAVORITE_PROFILE_SOURCES', 20)
+    user_favorites = UserFavorite.objects.filter(user=user)
+    recent = list(user_favorites.values_list('resource_id', flat=True)[:sources])
+    if not recent:
+        return []
+    totals = (
+        CoFavorite.objects.filter(resource_id__in=recent)
+        .exclude(related_id__in=user_favorites.values('resource_id'))
+        .values_list('related_id').annotate(total=Sum('score'))
+        .order_by('-total', 'related_id')[:recommendation_count()]
+    )
+    ids = [related_id for related_id, _ in totals]
+    resources = LibraryResource.objects.in_bulk(ids)
+    return [resources[pk] for pk in ids if pk in resources]
@@ -0,0 +1,92 @@
+"""
+Conditional GET for the resource and search pages.
+
+Each page gets a weak ETag built from what its content depends on -- the
+resource's ``date_updated`` for a detail page, the search parameters for a
+search page, the catalog version (``library.search_cache``) for both, and
+who is asking -- so a repeat request can be answered ``304 Not Modified``
+after one cheap lookup, before the page's own queries and rendering (the
+detail page loads just the resource row first).
+
+Pages for signed-in users also show that user's favorites, so their ETag
+includes the version of the user's favorites (``library.favorites``), and
+they get no Last-Modified (a date cannot express a favorite being removed). Anonymous pages also carry
+Last-Modified: the later of ``date_updated`` and the catalog watermark.
+Detail pages list the resource's "also favorited" recommendations, so
+their validators also follow that resource's
+``library.cofavorites.version()``.
+
+Responses are ``Cache-Control: private, no-cache``: browsers and proxies
+keep them but revalidate on every use. Popularity counters are not part of
+the validators, so a revalidated page can show a slightly old view count,
+as cached search pages already do. Requests with flash messages waiting are
+never answered 304, so the messages are not lost.
+"""
+import hashlib
+
+from django.contrib.messages import get_messages
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+from . import cofavorites, favorites
+from .search_cache import get_catalog_changed, get_catalog_version
+
+
+class Validators:
+    """ETag and optional Last-Modified for one response"""
+
+    def __init__(self, parts, last_modified=None):
+        digest = hashlib.md5(
+            '\x1f'.join(str(part) for part in parts).encode(), usedforsecurity=False
+        ).hexdigest()
+        self.etag = f'W/"{digest}"'
+        self.last_modified = last_modified
+
+    def not_modified(self, request):
+        """The 304 (or 412) response for ``request``, or None to render the page"""
+        if get_messages(request):
+            return None
+        last_modified = int(self.last_modified.timestamp()) if self.last_modified else None
+        return get_conditional_response(
+            request, etag=self.etag, last_modified=last_modified
+        )
+
+    def apply(self, response):
+        if response.status_code in (200, 304):
+            response.headers.setdefault('ETag', self.etag)
+            if self.last_modified:
+                response.headers.setdefault(
+                    'Last-Modified', http_date(self.last_modified.timestamp())
+                )
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+
+def viewer(request):
+    """The part of a page that depends on who is looking"""
+    user = request.user
+    if not user.is_authenticated:
+        return 'anonymous'
+    return f'{user.pk}:{favorites.version(user.pk)}'
+
+
+def resource_validators(request, resource):
+    """Validators for the detail page of ``resource``"""
+    last_modified = None
+    if not request.user.is_authenticated:
+        last_modified = max(
+            resource.date_updated, get_catalog_changed(), cofavorites.changed_at(resource.pk)
+        )
+    return Validators(
+        [
+            'resource', resource.pk, resource.date_updated.isoformat(), get_catalog_version(),
+            cofavorites.version(resource.pk), viewer(request),
+        ],
+        last_modified,
+    )
+
+
+def search_validators(request):
+    params = sorted((key, value) for key, values in request.GET.lists() for value in values)
+    last_modified = None if request.user.is_authenticated else get_catalog_changed()
+    return Validators(['search', params, get_catalog_version(), viewer(request)], last_modified)
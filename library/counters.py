@@ -0,0 +1,118 @@
+"""
+Write-behind popularity counters.
+
+``view_count`` and ``download_count`` are bumped on every page view or
+download. Rather than a read-modify-write ``save()`` per hit, increments are
+summed in memory per worker and flushed every
+``LIBRARY_COUNTER_FLUSH_INTERVAL`` seconds (default 10), and at exit, as
+``UPDATE ... SET view_count = view_count + n`` statements -- one per distinct
+increment, covering every resource that received it. Concurrent workers can
+no longer lose each other's increments, and a hot resource costs one UPDATE
+per interval instead of one per hit. Each flush of view counts also refreshes
+the popular list in the statistics snapshot.
+
+Set ``LIBRARY_COUNTERS_BUFFERED = False`` to apply each increment immediately
+(still as an atomic ``F()`` update).
+"""
+import atexit
+import logging
+import os
+import threading
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from django.db.models import F
+
+from . import statistics
+from .models import LibraryResource
+
+
+logger = logging.getLogger(__name__)
+
+COUNTER_FIELDS = ('view_count', 'download_count')
+
+# Resource ids per UPDATE statement
+FLUSH_CHUNK_SIZE = 500
+
+
+class ResourceCounters:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = None
+        self._pending = {field: Counter() for field in COUNTER_FIELDS}
+
+    @property
+    def flush_interval(self):
+        return getattr(settings, 'LIBRARY_COUNTER_FLUSH_INTERVAL', 10)
+
+    def _start(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # Forked workers start with an empty buffer of their own
+            self._pending = {field: Counter() for field in COUNTER_FIELDS}
+            self._stop = threading.Event()
+            thread = threading.Thread(target=self._run, name='resource-counters', daemon=True)
+            thread.start()
+            self._pid = os.getpid()
+
+    def increment(self, resource_id, field, amount=1):
+        if field not in COUNTER_FIELDS:
+            raise ValueError(f'{field} is not a counter field')
+        if not getattr(settings, 'LIBRARY_COUNTERS_BUFFERED', True):
+            self._apply(field, {resource_id: amount})
+            return
+        self._start()
+        with self._lock:
+            self._pending[field][resource_id] += amount
+
+    def pending(self, resource_id, field):
+        """Increments not yet written for one resource"""
+        with self._lock:
+            return self._pending[field].get(resource_id, 0)
+
+    def _apply(self, field, increments):
+        by_amount = defaultdict(list)
+        for resource_id, amount in increments.items():
+            by_amount[amount].append(resource_id)
+        with transaction.atomic():
+            for amount, resource_ids in by_amount.items():
+                for start in range(0, len(resource_ids), FLUSH_CHUNK_SIZE):
+                    LibraryResource.objects.filter(
+                        pk__in=resource_ids[start:start + FLUSH_CHUNK_SIZE]
+                    ).update(**{field: F(field) + amount})
+
+    def flush(self):
+        if self._pid != os.getpid():
+            return
+        with self._lock:
+            pending = self._pending
+            self._pending = {field: Counter() for field in COUNTER_FIELDS}
+        for field, increments in pending.items():
+            if not increments:
+                continue
+            try:
+                self._apply(field, increments)
+            except DatabaseError:
+                logger.exception('Could not flush %s increments; will retry', field)
+                with self._lock:
+                    self._pending[field].update(increments)
+                continue
+            if field == 'view_count':
+                statistics.refresh_popular()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Resource counter flush failed')
+            finally:
+                connection.close()
+
+
+resource_counters = ResourceCounters()
+atexit.register(resource_counters.flush)
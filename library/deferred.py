@@ -0,0 +1,67 @@
+"""
+Work deferred until the current transaction commits, batched.
+
+Signal receivers that refresh derived data (related resources,
+recommendations, statistics counters) fire once per row or relation change.
+A form save, a cascade delete or a bulk edit sends many of them in one
+transaction, and a callback registered with ``transaction.on_commit`` for
+each would redo the same work many times.
+
+* ``on_commit_batch(callback, ids)`` collects the ids passed for
+  ``callback`` and calls it once, on commit, with all of them.
+* ``on_commit_sum(callback, deltas)`` adds up the ``{name: delta}`` mappings
+  passed for ``callback`` and calls it once, on commit, with the totals.
+
+Outside a transaction the callback runs immediately, as with ``on_commit``.
+
+Batches are kept per savepoint, so work queued inside a savepoint that is
+rolled back is dropped with it instead of being merged into the outer
+transaction's batch.
+"""
+from collections import Counter
+
+from django.db import transaction
+
+
+class _Batch:
+    def __init__(self, callback, items):
+        self.callback = callback
+        self.items = items
+        self.done = False
+
+    def pending(self, connection):
+        """Whether the on-commit callback for this batch is registered and yet to run"""
+        return not self.done and connection.in_atomic_block and any(
+            entry[1] == self.run for entry in connection.run_on_commit
+        )
+
+    def run(self):
+        self.done = True
+        self.callback(self.items)
+
+
+def _defer(callback, items):
+    connection = transaction.get_connection()
+    batches = connection.__dict__.setdefault('_library_commit_batches', {})
+    # Blocks entered with savepoint=False push None; they share the batch
+    key = (callback, tuple(sid for sid in connection.savepoint_ids if sid))
+    batch = batches.get(key)
+    if batch is not None and batch.pending(connection):
+        batch.items.update(items)
+        return
+    batch = batches[key] = _Batch(callback, items)
+    transaction.on_commit(batch.run)
+
+
+def on_commit_batch(callback, ids):
+    """Call ``callback(ids)`` once, on commit, with every id passed for it"""
+    ids = set(ids or ())
+    if ids:
+        _defer(callback, ids)
+
+
+def on_commit_sum(callback, deltas):
+    """Call ``callback(totals)`` once, on commit, with the summed ``deltas``"""
+    deltas = Counter({name: delta for name, delta in deltas.items() if delta})
+    if deltas:
+        _defer(callback, deltas)
@@ -0,0 +1,152 @@
+"""
+Streaming export of search results.
+
+``export_response()`` runs a ``SearchPlan`` and streams every matching
+resource, in the search order, as CSV, JSON Lines or BibTeX. Rows are
+projected (see ``library.projection``) in chunks of
+``LIBRARY_EXPORT_CHUNK_SIZE`` (default 2000), each chunk fetching its own
+authors, subjects and keywords in one query per relation, and written out
+as they are read: memory stays flat however many rows match, and the first
+bytes (the CSV header row, or the first chunk) go out without waiting for
+the rest of the result set. An export stops after
+``LIBRARY_EXPORT_MAX_ROWS`` rows (default 10000; None for no limit).
+
+The rows are read with the request's replica state (``library.replicas``),
+although the response body is read after the middleware has returned.
+
+Under ASGI the rows are handed to the server through an async iterator
+that reads them in a worker thread, ``ASYNC_BATCH`` at a time; Django would
+otherwise read a sync iterator to the end before sending anything.
+"""
+import csv
+import itertools
+import json
+import re
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+from . import projection, replicas
+
+
+FIELDS = [
+    'id', 'title', 'authors', 'subjects', 'keywords', 'resource_type',
+    'publication_year', 'publisher', 'isbn', 'doi', 'call_number', 'location',
+    'availability', 'url', 'pages', 'language',
+]
+
+# ResourceType.name -> BibTeX entry type
+BIBTEX_TYPES = {
+    'book': 'book',
+    'journal': 'article',
+    'thesis': 'phdthesis',
+    'conference': 'inproceedings',
+}
+BIBTEX_ESCAPES = {
+    '\\': r'\textbackslash{}', '{': r'\{', '}': r'\}', '&': r'\&', '%': r'\%',
+    '$': r'\$', '#': r'\#', '_': r'\_', '~': r'\textasciitilde{}', '^': r'\textasciicircum{}',
+}
+BIBTEX_SPECIAL = re.compile('|'.join(re.escape(char) for char in BIBTEX_ESCAPES))
+
+# Output rows read per worker-thread hop when streaming under ASGI
+ASYNC_BATCH = 500
+
+
+def max_rows():
+    return getattr(settings, 'LIBRARY_EXPORT_MAX_ROWS', 10000)
+
+
+def records(plan):
+    """Resources matching ``plan`` as dicts of ``FIELDS``, in order, up to ``max_rows()``"""
+    chunk_size = getattr(settings, 'LIBRARY_EXPORT_CHUNK_SIZE', 2000)
+    queryset = plan.order(plan.filtered()).distinct()
+    limit = max_rows()
+    if limit is not None:
+        queryset = queryset[:limit]
+    return projection.project(queryset, FIELDS, chunk_size)
+
+
+class Echo:
+    """File-like object that hands back what ``csv.writer`` writes"""
+
+    def write(self, value):
+        return value
+
+
+def csv_rows(records):
+    writer = csv.writer(Echo())
+    yield writer.writerow(FIELDS)
+    for item in records:
+        yield writer.writerow([
+            '; '.join(value) if isinstance(value, list) else ('' if value is None else value)
+            for value in (item[field] for field in FIELDS)
+        ])
+
+
+def jsonl_rows(records):
+    for item in records:
+        yield json.dumps(item, ensure_ascii=False) + '\n'
+
+
+def bibtex_escape(value):
+    return BIBTEX_SPECIAL.sub(lambda match: BIBTEX_ESCAPES[match.group()], str(value))
+
+
+def bibtex_rows(records):
+    for item in records:
+        fields = [
+            ('title', item['title']),
+            ('author', ' and '.join(item['authors'])),
+            ('year', item['publication_year']),
+            ('publisher', item['publisher']),
+            ('isbn', item['isbn']),
+            ('doi', item['doi']),
+            ('url', item['url']),
+            ('pages', item['pages']),
+            ('language', item['language']),
+            ('keywords', ', '.join(item['keywords'])),
+        ]
+        body = ',\n'.join(
+            f'  {name} = {{{bibtex_escape(value)}}}' for name, value in fields if value
+        )
+        entry_type = BIBTEX_TYPES.get(item['resource_type'], 'misc')
+        yield f'@{entry_type}{{library{item["id"]},\n{body}\n}}\n\n'
+
+
+FORMATS = {
+    'csv': (csv_rows, 'text/csv; charset=utf-8'),
+    'jsonl': (jsonl_rows, 'application/x-ndjson; charset=utf-8'),
+    'bibtex': (bibtex_rows, 'application/x-bibtex; charset=utf-8'),
+}
+EXTENSIONS = {'csv': 'csv', 'jsonl': 'jsonl', 'bibtex': 'bib'}
+
+
+async def async_rows(rows):
+    """Iterate the sync iterator ``rows`` from the event loop, in batches"""
+    next_batch = sync_to_async(lambda: list(itertools.islice(rows, ASYNC_BATCH)))
+    while True:
+        batch = await next_batch()
+        if not batch:
+            return
+        for row in batch:
+            yield row
+
+
+def export_response(plan, export_format, asynchronous=False):
+    """
+    ``StreamingHttpResponse`` with every resource matching ``plan``;
+    ``asynchronous=True`` for requests served over ASGI.
+    """
+    rows, content_type = FORMATS[export_format]
+    content = replicas.in_request(rows(records(plan)))
+    response = StreamingHttpResponse(
+        async_rows(content) if asynchronous else content,
+        content_type=content_type,
+    )
+    filename = 'library-export-%s.%s' % (
+        timezone.localtime().strftime('%Y%m%d-%H%M%S'), EXTENSIONS[export_format]
+    )
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
@@ -0,0 +1,142 @@
+"""
+Facet counts for the search sidebar.
+
+Counts for resource type, availability, year range and subject are taken
+over the current result set in a single statement: one GROUP BY over the
+matching resources for the first three facets, UNION ALL one GROUP BY over
+their subject links. Results are cached per search and catalog version, like
+result pages, so repeated searches pay nothing.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Case, CharField, Count, F, IntegerField, Value, When
+
+from .forms import LibrarySearchForm
+from .models import LibraryResource, ResourceType, Subject
+from .search_cache import cache_key, cacheable, get_catalog_version
+
+
+FACETS = ('resource_type', 'subject', 'year_range', 'availability')
+
+FACET_TITLES = {
+    'resource_type': 'Resource Type',
+    'subject': 'Subject',
+    'year_range': 'Year Range',
+    'availability': 'Availability',
+}
+
+YEAR_RANGES = [(value, label) for value, label in LibrarySearchForm.YEAR_CHOICES if value]
+
+
+def _year_range():
+    whens = []
+    for value, _ in YEAR_RANGES:
+        if value == 'before-2000':
+            whens.append(When(publication_year__lt=2000, then=Value(value)))
+        else:
+            start_year, end_year = map(int, value.split('-'))
+            whens.append(When(
+                publication_year__gte=start_year,
+                publication_year__lte=end_year,
+                then=Value(value),
+            ))
+    return Case(*whens, default=Value(''), output_field=CharField())
+
+
+def compute_facet_counts(plan):
+    """Return ``{facet: {value: count}}`` for the plan's result set"""
+    matching = plan.filtered().order_by().values('pk')
+    no_int = Value(None, output_field=IntegerField())
+    no_str = Value(None, output_field=CharField())
+
+    # Both branches annotate the same columns in the same order so that
+    # UNION ALL lines them up.
+    resources = LibraryResource.objects.filter(pk__in=matching).order_by().annotate(
+        facet_resource_type=F('resource_type'),
+        facet_availability=F('availability'),
+        facet_year_range=_year_range(),
+        facet_subject=no_int,
+    )
+    links = LibraryResource.subjects.through.objects.filter(
+        libraryresource_id__in=matching
+    ).order_by().annotate(
+        facet_resource_type=no_int,
+        facet_availability=no_str,
+        facet_year_range=no_str,
+        facet_subject=F('subject'),
+    )
+    columns = ('facet_resource_type', 'facet_availability', 'facet_year_range', 'facet_subject')
+    resources = resources.values_list(*columns).annotate(n=Count('pk'))
+    links = links.values_list(*columns).annotate(n=Count('pk'))
+
+    counts = {facet: {} for facet in FACETS}
+    for resource_type, availability, year_range, subject, n in resources.union(links, all=True):
+        if subject is not None:
+            counts['subject'][subject] = counts['subject'].get(subject, 0) + n
+            continue
+        for facet, value in (
+            ('resource_type', resource_type),
+            ('availability', availability),
+            ('year_range', year_range),
+        ):
+            if value:
+                counts[facet][value] = counts[facet].get(value, 0) + n
+    return counts
+
+
+def facet_counts(plan):
+    key = cache_key(plan.cleaned_data, 'facets')
+    counts = cache.get(key)
+    if counts is None:
+        counts = compute_facet_counts(plan)
+        if cacheable():
+            cache.set(key, counts, getattr(settings, 'LIBRARY_SEARCH_CACHE_TIMEOUT', 300))
+    return counts
+
+
+def facet_labels():
+    """Display labels for every facet value, cached per catalog version"""
+    key = f'library:facet_labels:{get_catalog_version()}'
+    labels = cache.get(key)
+    if labels is None:
+        labels = {
+            'resource_type': {
+                rtype.pk: str(rtype) for rtype in ResourceType.objects.all()
+            },
+            'subject': dict(Subject.objects.values_list('pk', 'name')),
+            'year_range': dict(YEAR_RANGES),
+            'availability': dict(LibraryResource.AVAILABILITY_CHOICES),
+        }
+        if cacheable():
+            cache.set(key, labels, getattr(settings, 'LIBRARY_SEARCH_CACHE_TIMEOUT', 300))
+    return labels
+
+
+def facet_options(plan, params):
+    """
+    Facets for the template, in sidebar order.
+
+    Each facet is ``{'name', 'title', 'options'}``; options are most frequent
+    first and carry the value, label, count, a query string that applies the
+    option and whether it is currently selected.
+    """
+    counts = facet_counts(plan)
+    labels = facet_labels()
+    facets = []
+    for facet in FACETS:
+        selected = params.get(facet, '')
+        options = []
+        for value, count in sorted(counts[facet].items(), key=lambda item: -item[1]):
+            query = params.copy()
+            query.pop('page', None)
+            query.pop('cursor', None)
+            query[facet] = value
+            options.append({
+                'value': value,
+                'label': labels[facet].get(value, value),
+                'count': count,
+                'querystring': query.urlencode(),
+                'selected': str(value) == selected,
+            })
+        facets.append({'name': facet, 'title': FACET_TITLES[facet], 'options': options})
+    return facets
@@ -0,0 +1,136 @@
+"""
+Per-user favorites membership cache.
+
+Pages that mark favorites -- search result cards and the detail page --
+only need to know which of the resources they show the user has
+favorited. Each user's favorite resource ids are cached as a frozenset, and
+``favorited()`` checks just the page's ids against it, so the cost does not
+grow with the number of favorites.
+
+The set is cached under a per-user version. ``library.signals`` calls
+``changed()`` when one of the user's favorites is saved or deleted, which
+moves the version, so the next page reloads the set. A set loaded before a
+write that commits meanwhile is stored under the old version and never
+read. Bulk writes, which send no signals, must call ``changed()``
+themselves, as ``apply()`` does. The version also identifies the user's
+favorites in page ETags (``library.conditional``).
+
+``apply()`` carries out a batch of add/remove operations (the batch
+favorites API) in one transaction with a fixed number of queries: a read
+of the set beforehand, one to check the added resources exist, a
+``bulk_create`` with conflicts ignored, one ``DELETE ... IN`` and one read
+of the resulting set, which is cached under the new version. The
+resources whose favorite actually changed are passed on to
+``library.cofavorites``, as the per-row signals would otherwise do.
+
+The set is always read from the primary database: a lagging replica
+(``library.replicas``) could otherwise cache a set without the write that
+just moved the version.
+
+Settings:
+
+* ``LIBRARY_FAVORITES_CACHE_TIMEOUT`` -- seconds a cached set is kept
+  (default 3600)
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.utils import timezone
+
+from .cofavorites import update_on_commit as update_cofavorites_on_commit
+from .models import LibraryResource, UserFavorite
+
+
+ADD = 'add'
+REMOVE = 'remove'
+
+
+def _version_key(user_id):
+    return f'library:favorites:{user_id}:version'
+
+
+def _timeout():
+    return getattr(settings, 'LIBRARY_FAVORITES_CACHE_TIMEOUT', 3600)
+
+
+def version(user_id):
+    """Token that changes whenever the user's favorites do"""
+    key = _version_key(user_id)
+    current = cache.get(key)
+    if current is None:
+        # A fresh token rather than a counter, so a version lost from the
+        # cache is never reused for a set cached before the loss
+        cache.add(key, time.time_ns(), timeout=None)
+        current = cache.get(key)
+    return current
+
+
+def _set_key(user_id, current):
+    return f'library:favorites:{user_id}:{current}'
+
+
+def changed(user_id, ids=None):
+    """Move the user's version; ``ids``, if known, is cached as the new set"""
+    current = time.time_ns()
+    cache.set(_version_key(user_id), current, timeout=None)
+    if ids is not None:
+        cache.set(_set_key(user_id, current), frozenset(ids), _timeout())
+
+
+def resource_ids(user_id):
+    """Frozenset of the ids of every resource the user has favorited"""
+    key = _set_key(user_id, version(user_id))
+    ids = cache.get(key)
+    if ids is None:
+        ids = frozenset(
+            UserFavorite.objects.using(DEFAULT_DB_ALIAS)
+            .filter(user_id=user_id).values_list('resource_id', flat=True)
+        )
+        cache.set(key, ids, _timeout())
+    return ids
+
+
+def favorited(user, ids):
+    """The subset of ``ids`` that ``user`` has favorited (empty when signed out)"""
+    if not user.is_authenticated:
+        return set()
+    return resource_ids(user.pk).intersection(ids)
+
+
+def is_favorited(user, resource_id):
+    return bool(favorited(user, [resource_id]))
+
+
+def apply(user, operations):
+    """
+    Apply ``(action, resource id)`` pairs in order -- the last action for a
+    resource wins -- and return ``(favorite ids, unknown ids)``: every
+    resource the user has favorited afterwards, and the added ids that
+    match no resource.
+    """
+    final = {}
+    for action, resource_id in operations:
+        final[resource_id] = action
+    adds = [pk for pk, action in final.items() if action == ADD]
+    removes = [pk for pk, action in final.items() if action == REMOVE]
+
+    with transaction.atomic():
+        before = frozenset(
+            UserFavorite.objects.filter(user=user).values_list('resource_id', flat=True)
+        )
+        known = set(LibraryResource.objects.filter(pk__in=adds).values_list('pk', flat=True)) if adds else set()
+        now = timezone.now()
+        UserFavorite.objects.bulk_create(
+            [UserFavorite(user=user, resource_id=pk, date_added=now) for pk in adds if pk in known],
+            ignore_conflicts=True,
+        )
+        if removes:
+            UserFavorite.objects.filter(user=user, resource_id__in=removes).delete()
+        ids = frozenset(
+            UserFavorite.objects.filter(user=user).values_list('resource_id', flat=True)
+        )
+        transaction.on_commit(lambda: changed(user.pk, ids))
+        update_cofavorites_on_commit(before ^ ids)
+    return ids, [pk for pk in adds if pk not in known]
@@ -0,0 +1,252 @@
+"""
+Per-request SQL and timing instrumentation.
+
+``InstrumentationMiddleware`` measures a sample of requests: total time, the
+number and duration of SQL queries (through a database execute wrapper, so
+nothing is recorded per query beyond a timer and a key), queries repeated
+with identical SQL and parameters, and template render time (through
+``InstrumentedDjangoTemplates``, the template backend; it includes any
+queries run lazily while rendering). The figures are added to in-process
+histograms per view, which staff can read as JSON from the
+``request_metrics`` view, and measured responses to staff (or to anyone
+under DEBUG) get a ``Server-Timing`` header.
+
+Measuring is opt-in: nothing is sampled unless a deployment sets a rate.
+
+The execute wrapper is installed once on each database connection as it is
+created and reports to the current request's metrics through a context
+variable, so async views -- whose ORM calls run in a worker thread, on that
+thread's connection -- are measured the same way as sync ones. The
+middleware itself runs sync or async, matching the rest of the chain.
+
+Settings:
+
+* ``LIBRARY_INSTRUMENTATION_SAMPLE_RATE`` -- fraction of requests measured
+  (default 0, disabled; 0.01 measures one request in a hundred)
+* ``LIBRARY_SERVER_TIMING`` -- set True to send ``Server-Timing`` headers
+  on every measured response, not only to staff
+"""
+import bisect
+import contextvars
+import random
+import threading
+import time
+from collections import Counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.template.backends.django import DjangoTemplates, Template
+
+
+# Upper bounds of the histogram buckets; the last bucket is unbounded
+TIME_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+_current = contextvars.ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    """What one request spent, filled in while it runs"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.total = 0.0
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self._seen = Counter()
+
+    @property
+    def duplicates(self):
+        """Queries that repeated an earlier one exactly"""
+        return sum(count - 1 for count in self._seen.values())
+
+    def __call__(self, execute, sql, params, many, context):
+        # Database execute wrapper
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - started
+            self.queries += 1
+            self._seen[(sql, repr(params))] += 1
+
+    def server_timing(self):
+        return ', '.join([
+            'total;dur=%.1f' % (self.total * 1000),
+            'db;dur=%.1f;desc="%d queries, %d duplicate"' % (
+                self.db_time * 1000, self.queries, self.duplicates
+            ),
+            'template;dur=%.1f' % (self.template_time * 1000),
+        ])
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def as_dict(self):
+        bounds = [str(bound) for bound in self.buckets] + ['+Inf']
+        return {
+            'buckets': dict(zip(bounds, self.counts)),
+            'count': self.count,
+            'sum': round(self.sum, 3),
+        }
+
+
+class MetricsRegistry:
+    """Histograms per view name, for this worker process"""
+
+    METRICS = {
+        'time_ms': TIME_BUCKETS_MS,
+        'db_time_ms': TIME_BUCKETS_MS,
+        'template_time_ms': TIME_BUCKETS_MS,
+        'queries': QUERY_BUCKETS,
+        'duplicate_queries': QUERY_BUCKETS,
+    }
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views = {}
+
+    def observe(self, view_name, metrics):
+        values = {
+            'time_ms': metrics.total * 1000,
+            'db_time_ms': metrics.db_time * 1000,
+            'template_time_ms': metrics.template_time * 1000,
+            'queries': metrics.queries,
+            'duplicate_queries': metrics.duplicates,
+        }
+        with self._lock:
+            histograms = self._views.get(view_name)
+            if histograms is None:
+                histograms = self._views[view_name] = {
+                    name: Histogram(buckets) for name, buckets in self.METRICS.items()
+                }
+            for name, value in values.items():
+                histograms[name].observe(value)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                view_name: {name: histogram.as_dict() for name, histogram in histograms.items()}
+                for view_name, histograms in sorted(self._views.items())
+            }
+
+    def reset(self):
+        with self._lock:
+            self._views = {}
+
+
+registry = MetricsRegistry()
+
+
+def current_metrics():
+    """The ``RequestMetrics`` of the request being measured, if any"""
+    return _current.get()
+
+
+def _execute(execute, sql, params, many, context):
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    return metrics(execute, sql, params, many, context)
+
+
+def install(connection, **kwargs):
+    """Report ``connection``'s queries to the metrics of the request running them"""
+    if _execute not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_execute)
+
+
+connection_created.connect(install, dispatch_uid='library.instrumentation.install')
+
+
+class InstrumentationMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self.sampled():
+            return self.get_response(request)
+
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, metrics)
+
+    async def __acall__(self, request):
+        if not self.sampled():
+            return await self.get_response(request)
+
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, metrics)
+
+    @staticmethod
+    def sampled():
+        rate = getattr(settings, 'LIBRARY_INSTRUMENTATION_SAMPLE_RATE', 0.0)
+        return rate > 0 and (rate >= 1 or random.random() < rate)
+
+    @staticmethod
+    def finish(request, response, metrics):
+        metrics.total = time.perf_counter() - metrics.started
+        match = getattr(request, 'resolver_match', None)
+        registry.observe(match.view_name if match else 'unresolved', metrics)
+        if show_server_timing(request):
+            response['Server-Timing'] = metrics.server_timing()
+        return response
+
+
+def show_server_timing(request):
+    """Timings reveal how requests are served; only staff see them by default"""
+    if getattr(settings, 'LIBRARY_SERVER_TIMING', False) or settings.DEBUG:
+        return True
+    user = getattr(request, 'user', None)
+    return user is not None and user.is_staff
+
+
+class InstrumentedTemplate(Template):
+    def render(self, context=None, request=None):
+        metrics = _current.get()
+        if metrics is None:
+            return super().render(context, request)
+        started = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            metrics.template_time += time.perf_counter() - started
+
+
+class InstrumentedDjangoTemplates(DjangoTemplates):
+    """``DjangoTemplates`` that adds top-level render time to the request metrics"""
+
+    def from_string(self, template_code):
+        return InstrumentedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        template = super().get_template(template_name)
+        return InstrumentedTemplate(template.template, self)
@@ -0,0 +1,95 @@
+"""
+HTTP load generator for comparing deployments.
+
+``run()`` keeps ``concurrency`` requests in flight against a running server
+for ``duration`` seconds, cycling through a list of paths, and reports
+throughput, latency percentiles and failures. The default paths replay
+autocomplete keystrokes -- every prefix of a few search terms, as typed --
+which is the burst of small requests the async views are for.
+
+Each request opens its own connection and asks the server to close it (the
+sync gunicorn worker does not keep connections alive), so WSGI and ASGI
+servers are measured on the same terms. Start both against the same
+database (see ``library_project.asgi``) and point the ``load_test`` command
+at each.
+"""
+import asyncio
+import itertools
+import time
+from urllib.parse import urlsplit
+
+
+KEYSTROKE_TERMS = ['machine learning', 'history', 'quantum physics', 'data', 'climate change']
+
+
+def keystroke_paths(terms=KEYSTROKE_TERMS):
+    """Autocomplete requests for each prefix of ``terms`` the view answers (2+ chars)"""
+    return [
+        '/api/keywords/?term=' + term[:length].replace(' ', '+')
+        for term in terms
+        for length in range(2, len(term) + 1)
+    ]
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(int(len(sorted_values) * fraction), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+async def fetch(host, port, path):
+    """GET ``path``; returns the response status"""
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        writer.write(
+            f'GET {path} HTTP/1.1\r\nHost: {host}\r\nConnection: close\r\n\r\n'.encode()
+        )
+        await writer.drain()
+        response = await reader.read()
+    finally:
+        writer.close()
+    return int(response.split(b' ', 2)[1])
+
+
+async def _load(base_url, paths, concurrency, duration, timeout):
+    url = urlsplit(base_url)
+    host, port = url.hostname, url.port or 80
+    prefix = url.path.rstrip('/')
+    paths = itertools.cycle(paths)
+    latencies, failures = [], 0
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        nonlocal failures
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                status = await asyncio.wait_for(fetch(host, port, prefix + next(paths)), timeout)
+            except (OSError, ValueError, IndexError, asyncio.TimeoutError):
+                status = None
+            if status is None or status >= 400:
+                failures += 1
+            else:
+                latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        'url': base_url,
+        'concurrency': concurrency,
+        'requests': len(latencies),
+        'failures': failures,
+        'requests_per_second': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 1),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 1),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 1),
+        'max_ms': round((latencies[-1] if latencies else 0.0) * 1000, 1),
+    }
+
+
+def run(base_url, paths=None, concurrency=50, duration=10.0, timeout=10.0):
+    """Load ``base_url`` and return a dict of throughput and latency figures"""
+    return asyncio.run(_load(base_url, paths or keystroke_paths(), concurrency, duration, timeout))
@@ -0,0 +1,81 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+from library import benchmarks
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the library views on seeded catalogs and check query budgets'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes',
+            default='1000,10000',
+            help='Comma-separated catalog sizes (default: 1000,10000)'
+        )
+        parser.add_argument('--seed', type=int, default=1, help='Catalog seed (default: 1)')
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=5,
+            help='Timed requests per view after the first (default: 5)'
+        )
+        parser.add_argument(
+            '--output',
+            default='benchmark_results.json',
+            help='Where to write the results (default: benchmark_results.json)'
+        )
+        parser.add_argument('--baseline', help='Earlier results file to compare against')
+        parser.add_argument(
+            '--tolerance',
+            type=float,
+            default=0.25,
+            help='Allowed slowdown / memory growth against the baseline (default: 0.25)'
+        )
+    
+    def handle(self, *args, **options):
+        try:
+            sizes = sorted(int(size) for size in options['sizes'].split(','))
+        except ValueError:
+            raise CommandError('--sizes must be comma-separated integers')
+        
+        baseline = None
+        if options['baseline']:
+            try:
+                with open(options['baseline']) as f:
+                    baseline = json.load(f)
+            except (OSError, ValueError) as e:
+                raise CommandError(f'Cannot read baseline: {e}')
+        
+        # Benchmarks run in a throwaway test database, with DEBUG off as in
+        # production
+        setup_test_environment(debug=False)
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            results = benchmarks.run(
+                sizes, seed=options['seed'], repeat=options['repeat'], progress=self.report
+            )
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+        
+        with open(options['output'], 'w') as f:
+            json.dump(results, f, indent=2)
+        self.stdout.write(f'Results written to {options["output"]}')
+        
+        problems = benchmarks.compare(results, baseline, options['tolerance'])
+        if problems:
+            for problem in problems:
+                self.stdout.write(self.style.ERROR(f'  ✗ {problem}'))
+            raise CommandError(f'{len(problems)} benchmark regression(s)')
+        
+        self.stdout.write(self.style.SUCCESS('✓ All views within budget'))
+    
+    def report(self, size, name, result):
+        self.stdout.write(
+            f'  {size:>8} {name:<22} {result["queries"]:>3} queries '
+            f'{result["time_ms"]:>8.1f}ms (cold {result["cold_ms"]:.1f}ms) '
+            f'peak {result["peak_kb"]:.0f}KB'
+        )
@@ -75,10 +75,7 @@ class Command(BaseCommand):
                 # Add keywords
                 keywords = ['programming', 'technology', 'learning', 'guide']
                 for kw in keywords[:2+i%3]:
-                    keyword, _ = Keyword.objects.get_or_create(
-                        word=kw,
-                        defaults={'frequency': 1}
-                    )
+                    keyword, _ = Keyword.objects.get_or_create(word=kw)
                     keyword.resources.add(resource)
                 
                 self.stdout.write(f'✓ Created: {title}')
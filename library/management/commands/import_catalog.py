@@ -0,0 +1,82 @@
+from django.core.management.base import BaseCommand, CommandError
+from library.bulk_import import (
+    CatalogImporter, DEFAULT_CHUNK_SIZE, READERS, detect_format
+)
+
+
+class Command(BaseCommand):
+    help = 'Bulk import catalog records from CSV, JSON Lines or MARCXML files'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help='Files to import')
+        parser.add_argument(
+            '--format',
+            choices=sorted(READERS),
+            help='Input format (default: from the file extension)'
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=DEFAULT_CHUNK_SIZE,
+            help=f'Records per transaction (default: {DEFAULT_CHUNK_SIZE})'
+        )
+        parser.add_argument(
+            '--default-type',
+            default='book',
+            help='Resource type for records that do not name one (default: book)'
+        )
+        parser.add_argument(
+            '--allow-unkeyed',
+            action='store_true',
+            help='Import records without ISBN or DOI (re-runs will duplicate them)'
+        )
+        parser.add_argument(
+            '--skip-related',
+            action='store_true',
+            help='Do not rebuild related resources afterwards'
+        )
+    
+    def handle(self, *args, **options):
+        formats = []
+        for path in options['paths']:
+            name = options['format'] or detect_format(path)
+            if name is None:
+                raise CommandError(f'Cannot tell the format of {path}; use --format')
+            formats.append((path, name))
+        
+        try:
+            importer = CatalogImporter(
+                chunk_size=options['chunk_size'],
+                allow_unkeyed=options['allow_unkeyed'],
+                default_type=options['default_type'],
+            )
+        except NotImplementedError as e:
+            raise CommandError(str(e))
+        
+        for path, name in formats:
+            self.stdout.write(f'Importing {path} ({name})...')
+            try:
+                importer.run(READERS[name](path), progress=self.report)
+            except (OSError, ValueError) as e:
+                raise CommandError(f'{path}: {e}')
+        
+        stats = importer.stats
+        elapsed, rate = stats.elapsed, stats.rate
+        
+        self.stdout.write('Refreshing statistics and related resources...')
+        importer.finish(rebuild_related=not options['skip_related'])
+        
+        for error in importer.errors:
+            self.stdout.write(self.style.WARNING(f'  Skipped {error}'))
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'✓ Imported {stats.created} of {stats.read} records in {elapsed:.1f}s '
+                f'({rate:.0f} rows/s); {stats.existing} already present, '
+                f'{stats.unkeyed} without ISBN/DOI, {stats.invalid} invalid'
+            )
+        )
+    
+    def report(self, stats):
+        self.stdout.write(
+            f'  {stats.read} read, {stats.created} created ({stats.rate:.0f} rows/s)'
+        )
@@ -0,0 +1,57 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from library import loadtest
+
+
+class Command(BaseCommand):
+    help = 'Load running servers (e.g. a WSGI and an ASGI deployment) and compare them'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('urls', nargs='+', help='Base URLs of the servers to load')
+        parser.add_argument(
+            '--concurrency',
+            default='50',
+            help='Comma-separated numbers of requests in flight (default: 50)'
+        )
+        parser.add_argument(
+            '--duration',
+            type=float,
+            default=10.0,
+            help='Seconds per server and concurrency level (default: 10)'
+        )
+        parser.add_argument(
+            '--path',
+            action='append',
+            dest='paths',
+            help='Path to request; repeat for several (default: autocomplete keystrokes)'
+        )
+        parser.add_argument('--output', help='Write the results to this JSON file')
+    
+    def handle(self, *args, **options):
+        try:
+            levels = [int(level) for level in options['concurrency'].split(',')]
+        except ValueError:
+            raise CommandError('--concurrency must be comma-separated integers')
+        
+        results = []
+        for concurrency in levels:
+            for url in options['urls']:
+                result = loadtest.run(
+                    url, options['paths'], concurrency=concurrency, duration=options['duration']
+                )
+                results.append(result)
+                self.stdout.write(
+                    f'  {url:<28} c={concurrency:<5} {result["requests_per_second"]:>8.1f} req/s  '
+                    f'p50 {result["p50_ms"]:>7.1f}ms  p95 {result["p95_ms"]:>7.1f}ms  '
+                    f'p99 {result["p99_ms"]:>7.1f}ms  failures {result["failures"]}'
+                )
+        
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(f'Results written to {options["output"]}')
+        
+        if any(result['requests'] == 0 for result in results):
+            raise CommandError('A server answered no requests; is it running?')
+        self.stdout.write(self.style.SUCCESS('✓ Load test complete'))
@@ -1,4 +1,13 @@
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import time
+
+import django
+from django.core.management import call_command
 from django.core.management.base import BaseCommand
+from django.db import connection, connections
+from library import synthetic
+from library.bulk_import import CatalogImporter
 from library.models import (
     Subject, Author, ResourceType, LibraryResource, Keyword
 )
@@ -15,10 +24,41 @@ class Command(BaseCommand):
             default=50,
             help='Number of resources to create (default: 50)'
         )
+        parser.add_argument(
+            '--synthetic',
+            action='store_true',
+            help='Generate a large synthetic catalog through the bulk import path'
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=1,
+            help='Random seed for --synthetic (default: 1)'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=synthetic.BATCH_SIZE,
+            help=f'Records per generated batch for --synthetic (default: {synthetic.BATCH_SIZE})'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='Worker processes for --synthetic (PostgreSQL only; default: 1)'
+        )
+        parser.add_argument(
+            '--skip-related',
+            action='store_true',
+            help='Do not rebuild related resources after --synthetic'
+        )
     
     def handle(self, *args, **options):
         count = options['count']
         
+        if options['synthetic']:
+            return self.generate_synthetic(options)
+        
         self.stdout.write(self.style.SUCCESS('Starting data population...'))
         
         # Create Resource Types
@@ -32,11 +72,7 @@ class Command(BaseCommand):
             ('multimedia', 'fas fa-video'),
         ]
         
-        for type_name, icon in resource_types_data:
-            ResourceType.objects.get_or_create(
-                name=type_name,
-                defaults={'icon': icon}
-            )
+        self.create_resource_types(resource_types_data)
         self.stdout.write(self.style.SUCCESS(f'✓ Created {len(resource_types_data)} resource types'))
         
         # Create Subjects
@@ -265,13 +301,7 @@ class Command(BaseCommand):
                 resource_keywords = random.sample(keywords_pool, min(keywords_count, len(keywords_pool)))
                 
                 for keyword_text in resource_keywords:
-                    keyword, created = Keyword.objects.get_or_create(
-                        word=keyword_text,
-                        defaults={'frequency': 1}
-                    )
-                    if not created:
-                        keyword.frequency += 1
-                        keyword.save()
+                    keyword, created = Keyword.objects.get_or_create(word=keyword_text)
                     keyword.resources.add(resource)
                 
                 created_count += 1
@@ -310,4 +340,76 @@ class Command(BaseCommand):
         self.stdout.write('  1. Run: python manage.py runserver')
         self.stdout.write('  2. Visit: http://127.0.0.1:8000/')
         self.stdout.write('  3. Login and start exploring!')
-
+    
+    def create_resource_types(self, resource_types_data):
+        for type_name, icon in resource_types_data:
+            ResourceType.objects.get_or_create(
+                name=type_name,
+                defaults={'icon': icon}
+            )
+    
+    def generate_synthetic(self, options):
+        count = options['count']
+        seed = options['seed']
+        batch_size = options['batch_size']
+        workers = options['workers']
+        if workers > 1 and connection.vendor == 'sqlite':
+            self.stdout.write(self.style.WARNING('SQLite allows one writer at a time; using 1 worker'))
+            workers = 1
+        
+        self.stdout.write(self.style.SUCCESS(
+            f'Generating {count} synthetic resources (seed {seed}, {workers} worker(s))...'
+        ))
+        self.create_resource_types([
+            ('book', 'fas fa-book'),
+            ('journal', 'fas fa-newspaper'),
+            ('thesis', 'fas fa-graduation-cap'),
+            ('conference', 'fas fa-users'),
+            ('digital', 'fas fa-laptop'),
+            ('multimedia', 'fas fa-video'),
+        ])
+        
+        started = time.monotonic()
+        batches = range((count + batch_size - 1) // batch_size)
+        read = created = 0
+        
+        if workers == 1:
+            importer = CatalogImporter(chunk_size=batch_size, count_keywords=False)
+            stats = importer.run(synthetic.generate(seed, count, batch_size), progress=self.report)
+            read, created = stats.read, stats.created
+        else:
+            # Each task is a run of batches; output does not depend on which
+            # worker generates which batch
+            tasks = [batches[i:i + 10] for i in range(0, len(batches), 10)]
+            connections.close_all()
+            with ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=django.setup,
+            ) as pool:
+                results = pool.map(
+                    synthetic.load_batches,
+                    [seed] * len(tasks), [count] * len(tasks), tasks, [batch_size] * len(tasks),
+                )
+                for task_read, task_created in results:
+                    read += task_read
+                    created += task_created
+                    rate = read / (time.monotonic() - started)
+                    self.stdout.write(f'  {read} generated, {created} created ({rate:.0f} rows/s)')
+        
+        elapsed = time.monotonic() - started
+        self.stdout.write('Recomputing keyword frequencies, statistics and related resources...')
+        call_command('recompute_keyword_frequencies', stdout=self.stdout)
+        CatalogImporter.finish(rebuild_related=not options['skip_related'])
+        
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'✓ Created {created} of {read} synthetic resources in {elapsed:.1f}s '
+                f'({read / elapsed if elapsed else 0:.0f} rows/s)'
+            )
+        )
+    
+    def report(self, stats):
+        self.stdout.write(
+            f'  {stats.read} generated, {stats.created} created ({stats.rate:.0f} rows/s)'
+        )
@@ -0,0 +1,17 @@
+import time
+
+from django.core.management.base import BaseCommand
+from library import related
+
+
+class Command(BaseCommand):
+    help = 'Recompute the precomputed related resources for the whole catalog'
+    
+    def handle(self, *args, **options):
+        self.stdout.write('Computing related resources...')
+        started = time.monotonic()
+        rows = related.build()
+        
+        self.stdout.write(
+            self.style.SUCCESS(f'✓ Stored {rows} related links in {time.monotonic() - started:.1f}s')
+        )
@@ -0,0 +1,20 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from library import cards
+
+
+class Command(BaseCommand):
+    help = 'Recompute the denormalized author names and keywords shown on search cards'
+    
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        with transaction.atomic():
+            updated = cards.rebuild()
+        
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'✓ Updated {updated} search cards in {time.monotonic() - started:.1f}s'
+            )
+        )
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from library.models import LibraryResource
+from library.search_backends import get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index from the catalog'
+    
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+        self.stdout.write(f'Rebuilding search index with {type(backend).__name__}...')
+        
+        with transaction.atomic():
+            backend.rebuild()
+        
+        self.stdout.write(
+            self.style.SUCCESS(f'✓ Indexed {LibraryResource.objects.count()} resources')
+        )
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from library import statistics
+
+
+class Command(BaseCommand):
+    help = 'Recompute the statistics page snapshot from the catalog'
+    
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            snapshot = statistics.rebuild()
+        
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'✓ Statistics rebuilt: {snapshot.total_resources} resources, '
+                f'{snapshot.total_authors} authors, {snapshot.total_subjects} subjects'
+            )
+        )
@@ -0,0 +1,50 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+from library import cards, statistics
+from library.models import Keyword
+
+
+class Command(BaseCommand):
+    help = 'Recompute every Keyword.frequency from its number of linked resources'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Keywords per UPDATE statement'
+        )
+    
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        
+        # One grouped aggregate over the link table
+        counts = dict(
+            Keyword.resources.through.objects.order_by().values('keyword_id').annotate(
+                n=Count('libraryresource_id')
+            ).values_list('keyword_id', 'n')
+        )
+        
+        changed = []
+        keywords = Keyword.objects.order_by().values_list('pk', 'frequency')
+        for pk, frequency in keywords.iterator(chunk_size=10000):
+            actual = counts.get(pk, 0)
+            if frequency != actual:
+                changed.append(Keyword(pk=pk, frequency=actual))
+        
+        # Only rows that drifted are written
+        with transaction.atomic():
+            Keyword.objects.bulk_update(changed, ['frequency'], batch_size=options['batch_size'])
+            statistics.refresh_keywords()
+            # Card keywords are listed most frequent first
+            cards_updated = cards.rebuild() if changed else 0
+        
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'✓ Updated {len(changed)} of {len(counts)} linked keywords '
+                f'and {cards_updated} search cards in {time.monotonic() - started:.1f}s'
+            )
+        )
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from library import search_cache
+
+
+class Command(BaseCommand):
+    help = 'Show hit/miss counters for the search result cache (needs a shared cache backend)'
+    
+    def handle(self, *args, **options):
+        stats = search_cache.stats()
+        self.stdout.write(f"Catalog version: {stats['catalog_version']}")
+        self.stdout.write(f"Hits:            {stats['hits']}")
+        self.stdout.write(f"Misses:          {stats['misses']}")
+        self.stdout.write(self.style.SUCCESS(f"Hit rate:        {stats['hit_rate']:.1%}"))
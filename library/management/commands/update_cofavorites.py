@@ -0,0 +1,18 @@
+import time
+
+from django.core.management.base import BaseCommand
+from library import cofavorites
+
+
+class Command(BaseCommand):
+    help = 'Recompute "also favorited" recommendations for the resources queued by favorite changes'
+    
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        count = cofavorites.process_queue()
+        
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'✓ Updated recommendations for {count} queued resources in {time.monotonic() - started:.1f}s'
+            )
+        )
@@ -0,0 +1,84 @@
+from django.db import migrations
+
+
+SQLITE_FORWARD = [
+    """
+    CREATE VIRTUAL TABLE library_resource_fts USING fts5(
+        title, description, abstract, authors, keywords,
+        tokenize = 'unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    INSERT INTO library_resource_fts (rowid, title, description, abstract, authors, keywords)
+    SELECT r.id, r.title, r.description, r.abstract,
+        COALESCE((
+            SELECT group_concat(a.first_name || ' ' || a.last_name, ' ')
+            FROM library_libraryresource_authors ra JOIN library_author a ON a.id = ra.author_id
+            WHERE ra.libraryresource_id = r.id
+        ), ''),
+        COALESCE((
+            SELECT group_concat(k.word, ' ')
+            FROM library_keyword_resources kr JOIN library_keyword k ON k.id = kr.keyword_id
+            WHERE kr.libraryresource_id = r.id
+        ), '')
+    FROM library_libraryresource r
+    """,
+]
+
+SQLITE_BACKWARD = ['DROP TABLE IF EXISTS library_resource_fts']
+
+POSTGRES_FORWARD = [
+    """
+    CREATE TABLE library_resource_search (
+        resource_id bigint PRIMARY KEY
+            REFERENCES library_libraryresource (id) ON DELETE CASCADE,
+        document tsvector NOT NULL
+    )
+    """,
+    """
+    CREATE INDEX library_resource_search_document_gin
+    ON library_resource_search USING GIN (document)
+    """,
+    """
+    INSERT INTO library_resource_search (resource_id, document)
+    SELECT r.id,
+        setweight(to_tsvector('simple', r.title), 'A') ||
+        setweight(to_tsvector('simple', COALESCE((
+            SELECT string_agg(a.first_name || ' ' || a.last_name, ' ')
+            FROM library_libraryresource_authors ra JOIN library_author a ON a.id = ra.author_id
+            WHERE ra.libraryresource_id = r.id
+        ), '')), 'B') ||
+        setweight(to_tsvector('simple', COALESCE((
+            SELECT string_agg(k.word, ' ')
+            FROM library_keyword_resources kr JOIN library_keyword k ON k.id = kr.keyword_id
+            WHERE kr.libraryresource_id = r.id
+        ), '')), 'B') ||
+        setweight(to_tsvector('simple', r.abstract), 'C') ||
+        setweight(to_tsvector('simple', r.description), 'D')
+    FROM library_libraryresource r
+    """,
+]
+
+POSTGRES_BACKWARD = ['DROP TABLE IF EXISTS library_resource_search']
+
+
+def _run(statements_by_vendor):
+    def run(apps, schema_editor):
+        statements = statements_by_vendor.get(schema_editor.connection.vendor, [])
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0002_libraryresource_remove_book_authors_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            _run({'sqlite': SQLITE_FORWARD, 'postgresql': POSTGRES_FORWARD}),
+            _run({'sqlite': SQLITE_BACKWARD, 'postgresql': POSTGRES_BACKWARD}),
+        ),
+    ]
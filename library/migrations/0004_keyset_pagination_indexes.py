@@ -0,0 +1,33 @@
+# Generated by Django 4.2.7 on 2026-10-18 17:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0003_search_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='libraryresource',
+            index=models.Index(fields=['title', 'id'], name='resource_title_seek_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='libraryresource',
+            index=models.Index(fields=['publication_year', 'id'], name='resource_year_seek_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='libraryresource',
+            index=models.Index(fields=['date_added', 'id'], name='resource_added_seek_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='libraryresource',
+            index=models.Index(fields=['view_count', 'date_added', 'id'], name='resource_views_seek_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userfavorite',
+            index=models.Index(fields=['user', 'date_added', 'id'], name='favorite_user_seek_idx'),
+        ),
+    ]
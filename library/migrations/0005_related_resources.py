@@ -0,0 +1,28 @@
+# Generated by Django 4.2.7 on 2026-10-18 17:37
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0004_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RelatedResource',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField()),
+                ('related', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='library.libraryresource')),
+                ('resource', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='related_entries', to='library.libraryresource')),
+            ],
+            options={
+                'ordering': ['resource', '-score'],
+                'indexes': [models.Index(fields=['resource', '-score'], name='related_resource_score_idx')],
+                'unique_together': {('resource', 'related')},
+            },
+        ),
+    ]
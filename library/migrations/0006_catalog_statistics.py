@@ -0,0 +1,30 @@
+# Generated by Django 4.2.7 on 2026-10-18 17:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0005_related_resources'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogStatistics',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total_resources', models.PositiveIntegerField(default=0)),
+                ('available_resources', models.PositiveIntegerField(default=0)),
+                ('digital_resources', models.PositiveIntegerField(default=0)),
+                ('total_authors', models.PositiveIntegerField(default=0)),
+                ('total_subjects', models.PositiveIntegerField(default=0)),
+                ('popular_resources', models.JSONField(default=list)),
+                ('top_keywords', models.JSONField(default=list)),
+                ('date_updated', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name_plural': 'catalog statistics',
+            },
+        ),
+    ]
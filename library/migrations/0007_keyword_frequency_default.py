@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 17:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0006_catalog_statistics'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='keyword',
+            name='frequency',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.7 on 2026-10-18 17:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0007_keyword_frequency_default'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='libraryresource',
+            index=models.Index(fields=['isbn'], name='resource_isbn_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='libraryresource',
+            index=models.Index(fields=['doi'], name='resource_doi_idx'),
+        ),
+    ]
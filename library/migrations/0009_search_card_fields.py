@@ -0,0 +1,59 @@
+# Generated by Django 4.2.7 on 2026-10-18 18:04
+
+from django.db import migrations, models
+
+
+CARD_KEYWORDS = 5
+
+
+def fill_card_fields(apps, schema_editor):
+    LibraryResource = apps.get_model('library', 'LibraryResource')
+    Keyword = apps.get_model('library', 'Keyword')
+    names, keywords = {}, {}
+    authors = LibraryResource.authors.through.objects.order_by(
+        'libraryresource_id', 'author__last_name', 'author__first_name'
+    ).values_list('libraryresource_id', 'author__first_name', 'author__last_name')
+    for pk, first_name, last_name in authors.iterator():
+        names.setdefault(pk, []).append(f'{first_name} {last_name}')
+    words = Keyword.resources.through.objects.order_by(
+        'libraryresource_id', '-keyword__frequency', 'keyword__word'
+    ).values_list('libraryresource_id', 'keyword__word')
+    for pk, word in words.iterator():
+        keywords.setdefault(pk, []).append(word)
+
+    resources = []
+    for resource in LibraryResource.objects.only('pk').iterator():
+        resource_keywords = keywords.get(resource.pk, [])
+        resource.author_names = ', '.join(names.get(resource.pk, []))[:500]
+        resource.top_keywords = resource_keywords[:CARD_KEYWORDS]
+        resource.keyword_count = len(resource_keywords)
+        resources.append(resource)
+    LibraryResource.objects.bulk_update(
+        resources, ['author_names', 'top_keywords', 'keyword_count'], batch_size=500
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0008_resource_identifier_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='libraryresource',
+            name='author_names',
+            field=models.CharField(blank=True, default='', editable=False, max_length=500),
+        ),
+        migrations.AddField(
+            model_name='libraryresource',
+            name='keyword_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='libraryresource',
+            name='top_keywords',
+            field=models.JSONField(blank=True, default=list, editable=False),
+        ),
+        migrations.RunPython(fill_card_fields, migrations.RunPython.noop),
+    ]
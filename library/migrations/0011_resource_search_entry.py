@@ -0,0 +1,25 @@
+# Generated by Django 4.2.7 on 2026-10-18 18:48
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0010_cofavorites'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResourceSearchEntry',
+            fields=[
+                ('resource', models.OneToOneField(db_column='rowid', db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_entry', serialize=False, to='library.libraryresource')),
+                ('document', models.TextField(db_column='library_resource_fts')),
+            ],
+            options={
+                'db_table': 'library_resource_fts',
+                'managed': False,
+            },
+        ),
+    ]
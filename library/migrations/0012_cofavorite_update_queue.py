@@ -0,0 +1,21 @@
+# Generated by Django 4.2.7 on 2026-10-18 18:51
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0011_resource_search_entry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CoFavoriteUpdate',
+            fields=[
+                ('resource_id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('queued_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
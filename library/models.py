@@ -86,32 +86,51 @@ class LibraryResource(models.Model):
     view_count = models.PositiveIntegerField(default=0)
     download_count = models.PositiveIntegerField(default=0)
     
+    # Search-card display values, kept in step with the links by library.cards
+    author_names = models.CharField(max_length=500, blank=True, default='', editable=False)
+    top_keywords = models.JSONField(default=list, blank=True, editable=False)
+    keyword_count = models.PositiveIntegerField(default=0, editable=False)
+    
     def __str__(self):
         return self.title
     
     def get_absolute_url(self):
         return reverse('library:resource_detail', kwargs={'pk': self.pk})
     
-    @property
-    def author_names(self):
-        return ", ".join([author.full_name for author in self.authors.all()])
-    
     @property
     def is_available(self):
         return self.availability in ['available', 'digital']
     
     def increment_view_count(self):
+        # Written behind by library.counters; only this instance is updated now
+        from .counters import resource_counters
+        resource_counters.increment(self.pk, 'view_count')
         self.view_count += 1
-        self.save(update_fields=['view_count'])
+    
+    def increment_download_count(self):
+        from .counters import resource_counters
+        resource_counters.increment(self.pk, 'download_count')
+        self.download_count += 1
     
     class Meta:
         ordering = ['-date_added']
+        # Keyset pagination seeks on (sort field, id) for each search ordering
+        indexes = [
+            models.Index(fields=['title', 'id'], name='resource_title_seek_idx'),
+            models.Index(fields=['publication_year', 'id'], name='resource_year_seek_idx'),
+            models.Index(fields=['date_added', 'id'], name='resource_added_seek_idx'),
+            models.Index(fields=['view_count', 'date_added', 'id'], name='resource_views_seek_idx'),
+            # Bulk imports are keyed on ISBN / DOI
+            models.Index(fields=['isbn'], name='resource_isbn_idx'),
+            models.Index(fields=['doi'], name='resource_doi_idx'),
+        ]
 
 
 class Keyword(models.Model):
     word = models.CharField(max_length=100, unique=True)
     resources = models.ManyToManyField(LibraryResource, related_name='keywords')
-    frequency = models.PositiveIntegerField(default=1)
+    # Number of linked resources, maintained by library.signals
+    frequency = models.PositiveIntegerField(default=0)
     
     def __str__(self):
         return self.word
@@ -137,4 +156,74 @@ class UserFavorite(models.Model):
     
     class Meta:
         unique_together = ['user', 'resource']
-        ordering = ['-date_added']
\ No newline at end of file
+        ordering = ['-date_added']
+        indexes = [
+            models.Index(fields=['user', 'date_added', 'id'], name='favorite_user_seek_idx'),
+        ]
+
+
+class RelatedResource(models.Model):
+    """Precomputed nearest neighbours of a resource, built by library.related"""
+    resource = models.ForeignKey(LibraryResource, on_delete=models.CASCADE, related_name='related_entries')
+    related = models.ForeignKey(LibraryResource, on_delete=models.CASCADE, related_name='+')
+    score = models.FloatField()
+    
+    class Meta:
+        unique_together = ['resource', 'related']
+        ordering = ['resource', '-score']
+        indexes = [
+            models.Index(fields=['resource', '-score'], name='related_resource_score_idx'),
+        ]
+
+
+class CoFavorite(models.Model):
+    """Precomputed "also favorited" recommendations of a resource, built by library.cofavorites"""
+    resource = models.ForeignKey(LibraryResource, on_delete=models.CASCADE, related_name='cofavorite_entries')
+    related = models.ForeignKey(LibraryResource, on_delete=models.CASCADE, related_name='+')
+    score = models.FloatField()
+    
+    class Meta:
+        unique_together = ['resource', 'related']
+        ordering = ['resource', '-score']
+        indexes = [
+            models.Index(fields=['resource', '-score'], name='cofavorite_resource_score_idx'),
+        ]
+
+
+class CoFavoriteUpdate(models.Model):
+    """Resource whose "also favorited" recommendations library.cofavorites has yet to recompute"""
+    # Not a foreign key: favorites of a resource being deleted queue it too
+    resource_id = models.BigIntegerField(primary_key=True)
+    queued_at = models.DateTimeField(default=timezone.now)
+
+
+class CatalogStatistics(models.Model):
+    """Single-row snapshot behind the statistics page, kept by library.statistics"""
+    total_resources = models.PositiveIntegerField(default=0)
+    available_resources = models.PositiveIntegerField(default=0)
+    digital_resources = models.PositiveIntegerField(default=0)
+    total_authors = models.PositiveIntegerField(default=0)
+    total_subjects = models.PositiveIntegerField(default=0)
+    popular_resources = models.JSONField(default=list)
+    top_keywords = models.JSONField(default=list)
+    date_updated = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name_plural = 'catalog statistics'
+
+
+class ResourceSearchEntry(models.Model):
+    """
+    Read-only view of the SQLite FTS5 index kept by library.search_backends,
+    so searches can join it (rowid = resource id). ``document`` is FTS5's
+    hidden column named after the table, the left operand of MATCH.
+    """
+    resource = models.OneToOneField(
+        LibraryResource, on_delete=models.DO_NOTHING, primary_key=True, db_column='rowid',
+        db_constraint=False, related_name='search_entry'
+    )
+    document = models.TextField(db_column='library_resource_fts')
+    
+    class Meta:
+        managed = False
+        db_table = 'library_resource_fts'
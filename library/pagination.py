@@ -0,0 +1,208 @@
+"""
+Keyset ("cursor") pagination.
+
+Instead of OFFSET, each page is fetched by seeking past the sort key of the
+last row shown, so page 5000 costs the same as page 1. Cursors are signed,
+opaque tokens carrying that sort key and a direction.
+
+The seek is only an index range scan when an index covers the whole sort
+key, primary key included: each sort option has one (migration 0004), and
+``SearchPlan`` orders by exactly those columns. A relevance ranking has no
+index to seek in -- every match is scored whatever the page -- so an
+ordering on an annotation gets cursors that carry the row's position
+instead of a score to compare floats against. Such pages are OFFSET pages
+again, and rows added or removed before the position shift them.
+
+The total is counted once, on the first page, and carried in the cursors
+of the pages after it together with a version of the data it was counted
+from (for search, the catalog version); a cursor from another version has
+its total counted again.
+"""
+import datetime
+
+from django.core import signing
+from django.core.paginator import InvalidPage
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+
+
+CURSOR_SALT = 'library.pagination.cursor'
+
+
+class InvalidCursor(InvalidPage):
+    pass
+
+
+def _encode_value(value):
+    if isinstance(value, datetime.datetime):
+        return {'dt': value.isoformat()}
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict) and 'dt' in value:
+        return parse_datetime(value['dt'])
+    return value
+
+
+class CursorPage:
+    def __init__(self, object_list, paginator, has_next, has_previous, offset=None):
+        self.object_list = object_list
+        self.paginator = paginator
+        self._has_next = has_next
+        self._has_previous = has_previous
+        # Position of the first row, for orderings paged by position
+        self.offset = offset
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+    @property
+    def next_cursor(self):
+        if self._has_next and self.object_list:
+            return self.paginator.encode(self, len(self.object_list) - 1, reverse=False)
+        return None
+
+    @property
+    def previous_cursor(self):
+        if self._has_previous and self.object_list:
+            return self.paginator.encode(self, 0, reverse=True)
+        return None
+
+
+class CursorPaginator:
+    """
+    Paginate an ordered queryset by keyset.
+
+    The queryset's ordering (or the model's default ordering) is used as the
+    sort key, with the primary key appended as a tie-breaker. ``count`` is
+    called for the total when the first page needs it (``queryset.count()``
+    by default). ``version``, if given, is a token that moves whenever the
+    total may have; a total carried under any other token is not trusted.
+    """
+
+    def __init__(self, queryset, per_page, count=None, version=None):
+        self.per_page = per_page
+        ordering = list(queryset.query.order_by or queryset.model._meta.ordering)
+        if not ordering or ordering[-1].lstrip('-') not in ('pk', 'id'):
+            descending = bool(ordering) and ordering[-1].startswith('-')
+            ordering.append('-pk' if descending else 'pk')
+        self.fields = [(name.lstrip('-'), name.startswith('-')) for name in ordering]
+        self.queryset = queryset.order_by(*ordering)
+        self.seekable = not any(name in queryset.query.annotations for name, _ in self.fields)
+        self._count = count or self.queryset.count
+        self.version = version
+        self._carried_count = None
+
+    @cached_property
+    def count(self):
+        if self._carried_count is not None:
+            return self._carried_count
+        return self._count()
+
+    def encode(self, page, index, reverse):
+        if self.seekable:
+            data = {'v': [_encode_value(getattr(page[index], name)) for name, _ in self.fields]}
+        else:
+            data = {'o': page.offset + index}
+        data['r'] = reverse
+        if 'count' in self.__dict__:
+            data['n'] = self.count
+            data['cv'] = self.version
+        return signing.dumps(data, salt=CURSOR_SALT, compress=True)
+
+    def decode(self, cursor):
+        """``(sort key values or position, reverse)`` from a cursor"""
+        try:
+            data = signing.loads(cursor, salt=CURSOR_SALT)
+            if self.seekable:
+                key = [_decode_value(value) for value in data['v']]
+                matches = len(key) == len(self.fields)
+            else:
+                key = data['o']
+                matches = isinstance(key, int) and key >= 0
+            reverse = bool(data['r'])
+            count = data.get('n') if data.get('cv') == self.version else None
+        except (signing.BadSignature, KeyError, TypeError, ValueError):
+            raise InvalidCursor('Invalid cursor')
+        if not matches:
+            raise InvalidCursor('Cursor does not match this ordering')
+        if isinstance(count, int):
+            self._carried_count = count
+        return key, reverse
+
+    def _seek(self, values, reverse):
+        """Rows strictly after ``values`` in (optionally reversed) sort order"""
+        condition = Q()
+        for i, (name, descending) in enumerate(self.fields):
+            lookup = 'lt' if descending != reverse else 'gt'
+            clause = Q(**{f'{name}__{lookup}': values[i]})
+            for (previous, _), value in zip(self.fields[:i], values):
+                clause &= Q(**{previous: value})
+            condition |= clause
+        return condition
+
+    def page(self, cursor=None):
+        if not cursor:
+            rows = list(self.queryset[:self.per_page + 1])
+            return CursorPage(rows[:self.per_page], self, len(rows) > self.per_page, False, 0)
+
+        values, reverse = self.decode(cursor)
+        if not self.seekable:
+            return self._page_at(values, reverse)
+        queryset = self.queryset.filter(self._seek(values, reverse))
+        if reverse:
+            rows = list(queryset.reverse()[:self.per_page + 1])
+            has_more = len(rows) > self.per_page
+            rows = rows[:self.per_page][::-1]
+            return CursorPage(rows, self, True, has_more)
+        rows = list(queryset[:self.per_page + 1])
+        return CursorPage(rows[:self.per_page], self, len(rows) > self.per_page, True)
+
+    def _page_at(self, position, reverse):
+        """The page after (or before) the row at ``position``"""
+        if reverse:
+            start = max(position - self.per_page, 0)
+            rows = list(self.queryset[start:position])
+            return CursorPage(rows, self, True, start > 0, start)
+        start = position + 1
+        rows = list(self.queryset[start:start + self.per_page + 1])
+        return CursorPage(rows[:self.per_page], self, len(rows) > self.per_page, True, start)
+
+
+def wants_cursor(request):
+    """Cursor pagination is opt-in via ?paginate=cursor (implied by ?cursor=)"""
+    return 'cursor' in request.GET or request.GET.get('paginate') == 'cursor'
+
+
+def cursor_querystring(request):
+    """Current query string minus paging parameters, for building page links"""
+    params = request.GET.copy()
+    params.pop('cursor', None)
+    params.pop('page', None)
+    params['paginate'] = 'cursor'
+    return params.urlencode()
+
+
+def export_querystring(request):
+    """Current query string minus paging parameters, for export links"""
+    params = request.GET.copy()
+    for name in ('cursor', 'page', 'paginate'):
+        params.pop(name, None)
+    return params.urlencode()
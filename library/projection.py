@@ -0,0 +1,118 @@
+"""
+Resource rows as plain dicts, without model instances.
+
+Used by the export and the JSON search API, which only need a few fields
+per resource. Scalar fields are read with ``values()`` on the search
+queryset; authors, subjects and keywords are fetched for a whole batch of
+rows at once, one through-table query per relation, and joined onto the
+rows in Python. ``aattach()`` does the same through the async ORM.
+"""
+import itertools
+
+from .models import Keyword, LibraryResource
+
+
+# Field name -> column read with values()
+COLUMNS = {
+    'id': 'id',
+    'title': 'title',
+    'resource_type': 'resource_type__name',
+    'description': 'description',
+    'abstract': 'abstract',
+    'publication_year': 'publication_year',
+    'publisher': 'publisher',
+    'isbn': 'isbn',
+    'doi': 'doi',
+    'call_number': 'call_number',
+    'location': 'location',
+    'availability': 'availability',
+    'url': 'url',
+    'pages': 'pages',
+    'language': 'language',
+    'date_added': 'date_added',
+    'view_count': 'view_count',
+    'download_count': 'download_count',
+    'author_names': 'author_names',
+    'top_keywords': 'top_keywords',
+    'keyword_count': 'keyword_count',
+}
+
+# Field name -> (through model, related value columns, ordering)
+LINKS = {
+    'authors': (
+        LibraryResource.authors.through, ('author__first_name', 'author__last_name'),
+        ('author__last_name', 'author__first_name'),
+    ),
+    'subjects': (LibraryResource.subjects.through, ('subject__name',), ('subject__name',)),
+    'keywords': (
+        Keyword.resources.through, ('keyword__word',), ('-keyword__frequency', 'keyword__word'),
+    ),
+}
+
+FIELDS = [*COLUMNS, *LINKS]
+
+
+def values(queryset, fields):
+    """``queryset.values()`` with the columns ``fields`` need (always ``id``)"""
+    columns = {'id'} | {COLUMNS[field] for field in fields if field in COLUMNS}
+    return queryset.values(*sorted(columns))
+
+
+def _link_rows(name, resource_ids):
+    through, columns, ordering = LINKS[name]
+    return through.objects.filter(libraryresource_id__in=resource_ids).order_by(
+        'libraryresource_id', *ordering
+    ).values_list('libraryresource_id', *columns)
+
+
+def _group(rows):
+    links = {}
+    for resource_id, *names in rows:
+        links.setdefault(resource_id, []).append(' '.join(names))
+    return links
+
+
+def _links(name, resource_ids):
+    """``{resource id: [values]}`` for one relation, in one query"""
+    return _group(_link_rows(name, resource_ids))
+
+
+def _records(rows, fields, links):
+    records = []
+    for row in rows:
+        related = {name: related_values.get(row['id'], []) for name, related_values in links.items()}
+        record = {}
+        for field in fields:
+            if field in COLUMNS:
+                record[field] = row[COLUMNS[field]]
+            else:
+                record[field] = related[field]
+        records.append(record)
+    return records
+
+
+def attach(rows, fields):
+    """Turn a batch of ``values()`` rows into dicts of exactly ``fields``"""
+    resource_ids = [row['id'] for row in rows]
+    links = {name: _links(name, resource_ids) for name in fields if name in LINKS}
+    return _records(rows, fields, links)
+
+
+async def aattach(rows, fields):
+    """``attach()`` for async views"""
+    resource_ids = [row['id'] for row in rows]
+    links = {}
+    for name in fields:
+        if name in LINKS:
+            links[name] = _group([row async for row in _link_rows(name, resource_ids)])
+    return _records(rows, fields, links)
+
+
+def project(queryset, fields, chunk_size=2000):
+    """Every row of ``queryset`` as a dict of ``fields``, ``chunk_size`` at a time"""
+    rows = values(queryset, fields).iterator(chunk_size=chunk_size)
+    while True:
+        chunk = list(itertools.islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield from attach(chunk, fields)
@@ -0,0 +1,206 @@
+"""
+Precomputed related resources.
+
+Two resources are related by the subjects, keywords and authors they share.
+Each shared item scores its kind's weight divided by ``log(1 + n)``, where
+``n`` is the number of resources carrying it, so a shared author counts for
+more than a shared broad subject. The top ``LIBRARY_RELATED_COUNT`` (default
+5) neighbours of every resource are stored in ``RelatedResource`` and the
+detail page reads them with one indexed lookup.
+
+Scores are computed as a sparse product of the resource/feature incidence
+matrix with its transpose: the three link tables are read once into posting
+lists, and each resource accumulates scores over the postings of its own
+features only. ``build()`` does the whole catalog (``rebuild_related``
+command); ``update()`` recomputes the resources whose links changed and the
+neighbours they can affect, and is called from ``library.signals`` once per
+transaction, with every resource the transaction relinked
+(``library.deferred``). An update only reads the posting lists of features
+narrow enough to count.
+
+The table is built by catalog imports and on demand with
+``rebuild_related``; ``migrate`` only reminds you to run it when it finds
+the table empty while the catalog is not (``library.signals``).
+
+Settings:
+
+* ``LIBRARY_RELATED_COUNT`` -- neighbours kept per resource (default 5)
+* ``LIBRARY_RELATED_WEIGHTS`` -- ``{'author', 'keyword', 'subject'}`` weights
+* ``LIBRARY_RELATED_MAX_POSTINGS`` -- items carried by more resources than
+  this are ignored as too broad to mean anything (default 1000)
+* ``LIBRARY_RELATED_AUTO_UPDATE`` -- set False to skip incremental updates,
+  e.g. during bulk imports followed by a rebuild
+"""
+import heapq
+import itertools
+import math
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+
+from .deferred import on_commit_batch
+from .models import Keyword, LibraryResource, RelatedResource
+
+
+DEFAULT_WEIGHTS = {'author': 3.0, 'keyword': 2.0, 'subject': 1.0}
+
+# (feature kind, link table, feature column)
+LINK_TABLES = (
+    ('author', LibraryResource.authors.through, 'author_id'),
+    ('keyword', Keyword.resources.through, 'keyword_id'),
+    ('subject', LibraryResource.subjects.through, 'subject_id'),
+)
+
+# Resource ids per query / rows per INSERT
+CHUNK_SIZE = 500
+
+
+def related_count():
+    return getattr(settings, 'LIBRARY_RELATED_COUNT', 5)
+
+
+def _chunks(items, size=CHUNK_SIZE):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _links(kind, through, column, **filters):
+    rows = through.objects.filter(**filters).values_list('libraryresource_id', column)
+    return ((resource_id, (kind, feature_id)) for resource_id, feature_id in rows.iterator())
+
+
+def max_postings():
+    return getattr(settings, 'LIBRARY_RELATED_MAX_POSTINGS', 1000)
+
+
+def _load(resource_ids=None):
+    """
+    Features of ``resource_ids`` (all resources when None) and the full
+    posting list of each of those features that is neither unique to one
+    resource nor longer than ``max_postings()``.
+    """
+    features = defaultdict(list)
+    postings = defaultdict(list)
+    for kind, through, column in LINK_TABLES:
+        if resource_ids is None:
+            for resource_id, feature in _links(kind, through, column):
+                features[resource_id].append(feature)
+                postings[feature].append(resource_id)
+            continue
+        feature_ids = set()
+        for chunk in _chunks(resource_ids):
+            for resource_id, feature in _links(kind, through, column, libraryresource_id__in=chunk):
+                features[resource_id].append(feature)
+                feature_ids.add(feature[1])
+        # Count postings first, so broad features are never loaded
+        scored = set()
+        for chunk in _chunks(feature_ids):
+            counts = (
+                through.objects.filter(**{f'{column}__in': chunk})
+                .values_list(column).annotate(n=Count('pk')).order_by()
+            )
+            scored.update(feature_id for feature_id, n in counts if 1 < n <= max_postings())
+        for chunk in _chunks(scored):
+            for resource_id, feature in _links(kind, through, column, **{f'{column}__in': chunk}):
+                postings[feature].append(resource_id)
+    return features, postings
+
+
+def compute_neighbours(resource_ids=None):
+    """Yield ``(resource_id, [(related_id, score), ...])``, best first"""
+    weights = {**DEFAULT_WEIGHTS, **getattr(settings, 'LIBRARY_RELATED_WEIGHTS', {})}
+    limit = max_postings()
+    count = related_count()
+    features, postings = _load(resource_ids)
+
+    feature_weight = {}
+    for feature, resources in postings.items():
+        if 1 < len(resources) <= limit:
+            feature_weight[feature] = weights[feature[0]] / math.log(1 + len(resources))
+
+    for resource_id, resource_features in features.items():
+        scores = defaultdict(float)
+        for feature in resource_features:
+            weight = feature_weight.get(feature)
+            if weight is None:
+                continue
+            for other_id in postings[feature]:
+                scores[other_id] += weight
+        scores.pop(resource_id, None)
+        # Ties go to the older (lower id) resource so results are stable
+        yield resource_id, heapq.nlargest(count, scores.items(), key=lambda item: (item[1], -item[0]))
+
+
+def _rows(neighbours):
+    for resource_id, related in neighbours:
+        for related_id, score in related:
+            yield RelatedResource(resource_id=resource_id, related_id=related_id, score=score)
+
+
+def _insert(rows):
+    rows = iter(rows)
+    total = 0
+    while True:
+        chunk = list(itertools.islice(rows, CHUNK_SIZE))
+        if not chunk:
+            return total
+        RelatedResource.objects.bulk_create(chunk)
+        total += len(chunk)
+
+
+def build():
+    """Recompute related resources for the whole catalog; returns rows written"""
+    with transaction.atomic():
+        RelatedResource.objects.all().delete()
+        return _insert(_rows(compute_neighbours()))
+
+
+def update(resource_ids):
+    """
+    Recompute after the links of ``resource_ids`` changed (or they were
+    deleted). Their own neighbours are recomputed, as are the resources that
+    listed them or that they now list, since the score is symmetric. Other
+    resources may drift until the next ``build()``.
+    """
+    resource_ids = set(resource_ids)
+    if not resource_ids:
+        return
+    with transaction.atomic():
+        existing = set(LibraryResource.objects.filter(pk__in=resource_ids).values_list('pk', flat=True))
+        neighbours = dict(compute_neighbours(existing))
+        affected = {
+            related_id for related in neighbours.values() for related_id, _ in related
+        }
+        for chunk in _chunks(resource_ids):
+            affected.update(
+                RelatedResource.objects.filter(related_id__in=chunk).values_list('resource_id', flat=True)
+            )
+        affected -= resource_ids
+        neighbours.update(compute_neighbours(affected))
+
+        # Replace the rows of every recomputed resource; one left with no
+        # shared links gets none
+        recomputed = existing | affected
+        for chunk in _chunks(recomputed):
+            RelatedResource.objects.filter(resource_id__in=chunk).delete()
+        _insert(_rows(neighbours.items()))
+
+
+def update_on_commit(resource_ids):
+    """``update()`` once the transaction commits, with every id it passed here"""
+    if getattr(settings, 'LIBRARY_RELATED_AUTO_UPDATE', True):
+        on_commit_batch(update, resource_ids)
+
+
+def missing():
+    """Whether the table is empty but the catalog is not"""
+    return not RelatedResource.objects.exists() and LibraryResource.objects.exists()
+
+
+def related_resources(resource):
+    """The stored neighbours of ``resource``, best first"""
+    entries = resource.related_entries.select_related('related')
+    return [entry.related for entry in entries[:related_count()]]
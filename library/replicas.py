@@ -0,0 +1,168 @@
+"""
+Read-replica routing.
+
+``ReplicaRouter`` sends reads of the catalog (the ``library`` app's models)
+to a replica database and every write to ``default``, the primary. Replica
+reads are only used inside a request that ``ReplicaMiddleware`` has cleared
+for them:
+
+* the request is a safe method (GET, HEAD, ...), so it is not itself a write;
+* the browser has not written recently -- a request with another method that
+  writes gets a short-lived cookie, and the same browser's reads stay on
+  the primary until it expires, so users see their own changes even if the
+  replica lags;
+* the request has not written yet -- after its first write (a view counter,
+  say) the rest of its reads go to the primary, as do reads inside a
+  transaction.
+
+A request reads from one replica throughout, so a page does not mix the
+states of two replicas; that includes the body of a streamed response,
+read after the middleware has returned (``in_request``). Management
+commands, background flushes and other code outside requests always use
+the primary. Sessions, users and the admin's tables are never routed.
+Migrations run on the primary only; the replicas get the schema through
+replication.
+
+Settings:
+
+* ``LIBRARY_REPLICAS`` -- aliases in ``DATABASES`` that replicate
+  ``default`` (settings.py builds them from ``REPLICA_DATABASE_URLS``;
+  empty disables routing)
+* ``LIBRARY_REPLICA_PIN_SECONDS`` -- how long a browser's reads stay on the
+  primary after it writes (default 10); keep it above the replication lag
+"""
+import contextvars
+import random
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+REPLICATED_APPS = {'library'}
+PIN_COOKIE = 'library_primary'
+SAFE_METHODS = {'GET', 'HEAD', 'OPTIONS', 'TRACE'}
+
+_request = contextvars.ContextVar('replica_request', default=None)
+
+
+def replicas():
+    return getattr(settings, 'LIBRARY_REPLICAS', [])
+
+
+def pin_seconds():
+    return getattr(settings, 'LIBRARY_REPLICA_PIN_SECONDS', 10)
+
+
+class RequestState:
+    """Where the current request may read from; shared by the threads it uses"""
+
+    def __init__(self, alias=None):
+        self.alias = alias
+        self.wrote = False
+
+
+def reading_replica():
+    """Whether reads in the current request may still go to a replica"""
+    state = _request.get()
+    return state is not None and state.alias is not None
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label not in REPLICATED_APPS or not reading_replica():
+            return None
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            # Related lookups from an object stay where it was read
+            return instance._state.db
+        return _request.get().alias
+
+    def db_for_write(self, model, **hints):
+        state = _request.get()
+        if state is not None:
+            state.alias = None
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in replicas():
+            return False
+        return None
+
+
+def in_request(rows):
+    """
+    Iterate ``rows`` with the current request's replica state. A streamed
+    response body is read after ``ReplicaMiddleware`` has returned, when its
+    reads would otherwise go to the primary.
+    """
+    state = _request.get()
+
+    def iterate():
+        iterator = iter(rows)
+        while True:
+            token = _request.set(state)
+            try:
+                row = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                _request.reset(token)
+            yield row
+
+    return iterate()
+
+
+class ReplicaMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        state = self.state_for(request)
+        token = _request.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _request.reset(token)
+        return self.pin(request, response, state)
+
+    async def __acall__(self, request):
+        state = self.state_for(request)
+        token = _request.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request.reset(token)
+        return self.pin(request, response, state)
+
+    @staticmethod
+    def state_for(request):
+        aliases = replicas()
+        if aliases and request.method in SAFE_METHODS and PIN_COOKIE not in request.COOKIES:
+            return RequestState(random.choice(aliases))
+        return RequestState()
+
+    @staticmethod
+    def pin(request, response, state):
+        if state.wrote and request.method not in SAFE_METHODS and replicas():
+            response.set_cookie(
+                PIN_COOKIE, '1', max_age=pin_seconds(), httponly=True, samesite='Lax',
+                secure=request.is_secure() or None,
+            )
+        return response
@@ -0,0 +1,170 @@
+"""
+Search execution for LibrarySearchView.
+
+A ``SearchPlan`` parses the search form once, builds the result queryset and
+computes the result count at most once. Logging, pagination and the template
+all read the count from the plan instead of re-counting.
+"""
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Count, Q
+from django.utils.functional import cached_property
+
+from .forms import LibrarySearchForm
+from .models import LibraryResource
+from .search_backends import get_search_backend
+from .search_cache import cacheable, get_catalog_version
+from .search_log import search_log
+
+
+def estimate_count(queryset):
+    """Planner row estimate for ``queryset`` (PostgreSQL only)"""
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def catalog_totals():
+    """Catalog-wide resource counts for the stats cards, in one query"""
+    key = f'library:catalog_totals:{get_catalog_version()}'
+    totals = cache.get(key)
+    if totals is None:
+        totals = LibraryResource.objects.aggregate(
+            total=Count('pk'),
+            available=Count('pk', filter=Q(availability='available')),
+            digital=Count('pk', filter=Q(availability='digital')),
+        )
+        if cacheable():
+            cache.set(key, totals, getattr(settings, 'LIBRARY_SEARCH_CACHE_TIMEOUT', 300))
+    return totals
+
+
+# Sort options ordered by every column of their keyset index (migration
+# 0004) but the id, which CursorPaginator appends
+SORT_ORDERINGS = {
+    '-view_count': ('-view_count', '-date_added'),
+}
+
+
+class SearchPlan:
+    """Everything one search request needs, computed once"""
+
+    def __init__(self, params):
+        self.form = LibrarySearchForm(params)
+        self.is_valid = self.form.is_valid()
+        self.cleaned_data = self.form.cleaned_data if self.is_valid else None
+        data = self.cleaned_data or {}
+        self.query = (data.get('query') or '').strip()
+        self.sort_by = data.get('sort_by') or 'relevance'
+        self.count_is_estimate = False
+        self._count = None
+
+    def filtered(self):
+        """Matching resources, without ordering or related-object loading"""
+        queryset = LibraryResource.objects.all()
+        if not self.is_valid:
+            return queryset
+        data = self.cleaned_data
+        resource_type = data.get('resource_type')
+        subject = data.get('subject')
+        year_range = data.get('year_range')
+        availability = data.get('availability')
+
+        # Keyword search
+        if self.query:
+            queryset = get_search_backend().filter(queryset, self.query)
+
+        # Apply filters
+        if resource_type:
+            queryset = queryset.filter(resource_type=resource_type)
+
+        if subject:
+            queryset = queryset.filter(subjects=subject)
+
+        if year_range:
+            if year_range == 'before-2000':
+                queryset = queryset.filter(publication_year__lt=2000)
+            else:
+                start_year, end_year = map(int, year_range.split('-'))
+                queryset = queryset.filter(
+                    publication_year__gte=start_year,
+                    publication_year__lte=end_year
+                )
+
+        if availability:
+            queryset = queryset.filter(availability=availability)
+
+        return queryset
+
+    def order(self, queryset):
+        if not self.is_valid:
+            return queryset
+        if self.sort_by != 'relevance':
+            return queryset.order_by(*SORT_ORDERINGS.get(self.sort_by, (self.sort_by,)))
+        if self.query:
+            return get_search_backend().rank(queryset, self.query)
+        return queryset.order_by('-view_count', '-date_added')
+
+    @staticmethod
+    def with_related(queryset):
+        # Cards read the denormalized author and keyword fields (library.cards)
+        return queryset.select_related('resource_type')
+
+    @cached_property
+    def queryset(self):
+        return self.with_related(self.order(self.filtered())).distinct()
+
+    @property
+    def count(self):
+        if self._count is None:
+            self._count = self._compute_count()
+        return self._count
+
+    def set_count(self, count):
+        """Use a count computed elsewhere (e.g. the result cache)"""
+        self._count = count
+
+    def _compute_count(self):
+        # On PostgreSQL, very large result sets can be shown with the planner
+        # estimate instead of an exact COUNT(*).
+        threshold = getattr(settings, 'LIBRARY_SEARCH_ESTIMATE_THRESHOLD', None)
+        queryset = self.filtered()
+        if threshold and connections[queryset.db].vendor == 'postgresql':
+            estimate = estimate_count(queryset)
+            if estimate >= threshold:
+                self.count_is_estimate = True
+                return estimate
+        return queryset.count()
+
+    def load(self, resource_ids):
+        """Fetch resources by id, preserving the given order"""
+        resources = self.with_related(LibraryResource.objects.all()).in_bulk(resource_ids)
+        return [resources[pk] for pk in resource_ids if pk in resources]
+
+    def log(self, user):
+        if self.query:
+            search_log.add(
+                query=self.query,
+                user=user if user.is_authenticated else None,
+                results_count=self.count
+            )
+
+
+class SearchPaginator(Paginator):
+    """Paginator that takes its total from the search plan"""
+
+    def __init__(self, plan, *args, **kwargs):
+        self.plan = plan
+        super().__init__(*args, **kwargs)
+
+    @cached_property
+    def count(self):
+        return self.plan.count
@@ -0,0 +1,325 @@
+"""
+Full-text search backends for the library catalog.
+
+LibrarySearchView hands the keyword part of a search to a backend, which
+answers it from a dedicated index (an FTS5 table on SQLite, a ``tsvector``
+column with a GIN index on PostgreSQL) instead of OR-ing ``icontains``
+predicates across the resource, author and keyword tables.
+
+The "relevance" sort is also answered by the backend, which ranks matches
+inside the database so only the requested page is ever loaded.
+
+The index is kept in sync by the receivers in ``library.signals`` and can be
+rebuilt from scratch with ``manage.py rebuild_search_index``.
+"""
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import F, FloatField, Func, Lookup, Q, Value
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+
+from .models import LibraryResource, Keyword, ResourceSearchEntry
+
+
+TOKEN_RE = re.compile(r'\w+')
+
+# Number of resource ids written per statement when (re)indexing; keeps us
+# well under SQLite's bound-parameter limit.
+INDEX_CHUNK_SIZE = 500
+
+# Relative importance of each indexed field when ranking by relevance.
+# Override with settings.LIBRARY_SEARCH_FIELD_WEIGHTS.
+DEFAULT_FIELD_WEIGHTS = {
+    'title': 10.0,
+    'description': 1.0,
+    'abstract': 2.0,
+    'authors': 5.0,
+    'keywords': 8.0,
+}
+
+# Popularity only breaks ties between equally relevant resources
+TIE_BREAK_ORDERING = ('-view_count', '-date_added')
+
+
+def tokenize(text):
+    """Split free text into lower-case search terms"""
+    return TOKEN_RE.findall((text or '').lower())
+
+
+def _chunks(ids, size=INDEX_CHUNK_SIZE):
+    ids = list(ids)
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+
+def field_weights():
+    weights = dict(DEFAULT_FIELD_WEIGHTS)
+    weights.update(getattr(settings, 'LIBRARY_SEARCH_FIELD_WEIGHTS', {}))
+    return weights
+
+
+def _tables():
+    return {
+        'resource': LibraryResource._meta.db_table,
+        'resource_authors': LibraryResource.authors.through._meta.db_table,
+        'author': LibraryResource.authors.field.related_model._meta.db_table,
+        'keyword_resources': Keyword.resources.through._meta.db_table,
+        'keyword': Keyword._meta.db_table,
+    }
+
+
+class Match(Lookup):
+    """FTS5 ``MATCH``; the left side is the index's table-named column"""
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return '%s MATCH %s' % (lhs, rhs), lhs_params + rhs_params
+
+
+ResourceSearchEntry._meta.get_field('document').register_lookup(Match)
+
+
+class BM25(Func):
+    """FTS5 ``bm25()`` negated, so higher is more relevant"""
+    function = 'bm25'
+    template = '-%(function)s(%(expressions)s)'
+    output_field = FloatField()
+
+
+class BaseSearchBackend:
+    """Interface every search backend implements"""
+
+    def filter(self, queryset, query):
+        """Restrict ``queryset`` to resources matching ``query``"""
+        raise NotImplementedError
+
+    def rank(self, queryset, query):
+        """
+        Order ``queryset`` (already filtered by ``query``) by relevance.
+
+        Backends without a ranking function fall back to popularity.
+        """
+        return queryset.order_by(*TIE_BREAK_ORDERING)
+
+    def index_resources(self, resource_ids):
+        """(Re)index the given resources from their current database state"""
+
+    def remove_resources(self, resource_ids):
+        """Drop the given resources from the index"""
+
+    def rebuild(self):
+        """Rebuild the whole index"""
+
+
+class SimpleSearchBackend(BaseSearchBackend):
+    """Unindexed fallback for databases without a full-text engine"""
+
+    def filter(self, queryset, query):
+        return queryset.filter(
+            Q(title__icontains=query) |
+            Q(description__icontains=query) |
+            Q(abstract__icontains=query) |
+            Q(authors__first_name__icontains=query) |
+            Q(authors__last_name__icontains=query) |
+            Q(keywords__word__icontains=query)
+        ).distinct()
+
+
+class SQLiteFTSBackend(BaseSearchBackend):
+    """SQLite FTS5 index stored in ``library_resource_fts`` (rowid = resource id)"""
+
+    table = 'library_resource_fts'
+    COLUMNS = ('title', 'description', 'abstract', 'authors', 'keywords')
+
+    INDEX_SQL = """
+        INSERT INTO {fts} (rowid, title, description, abstract, authors, keywords)
+        SELECT r.id, r.title, r.description, r.abstract,
+            COALESCE((
+                SELECT group_concat(a.first_name || ' ' || a.last_name, ' ')
+                FROM {resource_authors} ra JOIN {author} a ON a.id = ra.author_id
+                WHERE ra.libraryresource_id = r.id
+            ), ''),
+            COALESCE((
+                SELECT group_concat(k.word, ' ')
+                FROM {keyword_resources} kr JOIN {keyword} k ON k.id = kr.keyword_id
+                WHERE kr.libraryresource_id = r.id
+            ), '')
+        FROM {resource} r
+        {where}
+    """
+
+    def match_expression(self, query):
+        terms = tokenize(query)
+        return ' '.join('"%s"*' % term for term in terms)
+
+    def filter(self, queryset, query):
+        # Joining the index (ResourceSearchEntry) lets SQLite drive the
+        # query from the MATCH and lets rank() read bm25() from the same row
+        expression = self.match_expression(query)
+        if not expression:
+            return queryset.none()
+        return queryset.filter(search_entry__document__match=expression)
+
+    def rank(self, queryset, query):
+        # bm25() is computed per matching row by FTS5 from the per-column
+        # term statistics it already keeps; it returns lower-is-better.
+        # It reads the MATCH of the join filter() added, so the index is
+        # searched once per query.
+        if not self.match_expression(query):
+            return super().rank(queryset, query)
+        weights = field_weights()
+        relevance = BM25(
+            F('search_entry__document'),
+            *(Value(float(weights[column])) for column in self.COLUMNS)
+        )
+        return queryset.annotate(relevance=relevance).order_by(
+            '-relevance', *TIE_BREAK_ORDERING
+        )
+
+    def _index_sql(self, where=''):
+        return self.INDEX_SQL.format(fts=self.table, where=where, **_tables())
+
+    def index_resources(self, resource_ids):
+        with connection.cursor() as cursor:
+            for chunk in _chunks(resource_ids):
+                placeholders = ', '.join(['%s'] * len(chunk))
+                cursor.execute(
+                    'DELETE FROM %s WHERE rowid IN (%s)' % (self.table, placeholders), chunk
+                )
+                cursor.execute(
+                    self._index_sql('WHERE r.id IN (%s)' % placeholders), chunk
+                )
+
+    def remove_resources(self, resource_ids):
+        with connection.cursor() as cursor:
+            for chunk in _chunks(resource_ids):
+                placeholders = ', '.join(['%s'] * len(chunk))
+                cursor.execute(
+                    'DELETE FROM %s WHERE rowid IN (%s)' % (self.table, placeholders), chunk
+                )
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM %s' % self.table)
+            cursor.execute(self._index_sql())
+
+
+class PostgresSearchBackend(BaseSearchBackend):
+    """PostgreSQL ``tsvector`` index stored in ``library_resource_search``"""
+
+    table = 'library_resource_search'
+    config = 'simple'
+
+    INDEX_SQL = """
+        INSERT INTO {search} (resource_id, document)
+        SELECT r.id,
+            setweight(to_tsvector('{config}', r.title), 'A') ||
+            setweight(to_tsvector('{config}', COALESCE((
+                SELECT string_agg(a.first_name || ' ' || a.last_name, ' ')
+                FROM {resource_authors} ra JOIN {author} a ON a.id = ra.author_id
+                WHERE ra.libraryresource_id = r.id
+            ), '')), 'B') ||
+            setweight(to_tsvector('{config}', COALESCE((
+                SELECT string_agg(k.word, ' ')
+                FROM {keyword_resources} kr JOIN {keyword} k ON k.id = kr.keyword_id
+                WHERE kr.libraryresource_id = r.id
+            ), '')), 'B') ||
+            setweight(to_tsvector('{config}', r.abstract), 'C') ||
+            setweight(to_tsvector('{config}', r.description), 'D')
+        FROM {resource} r
+        {where}
+        ON CONFLICT (resource_id) DO UPDATE SET document = EXCLUDED.document
+    """
+
+    def tsquery(self, query):
+        return ' & '.join('%s:*' % term for term in tokenize(query))
+
+    def filter(self, queryset, query):
+        tsquery = self.tsquery(query)
+        if not tsquery:
+            return queryset.none()
+        return queryset.filter(pk__in=RawSQL(
+            "SELECT resource_id FROM %s WHERE document @@ to_tsquery('%s', %%s)"
+            % (self.table, self.config),
+            [tsquery],
+        ))
+
+    def rank(self, queryset, query):
+        # PostgreSQL has no BM25; ts_rank over the A-D field weights with
+        # log-length normalisation (flag 1) is the closest built-in.
+        # Authors and keywords share the B label.
+        tsquery = self.tsquery(query)
+        if not tsquery:
+            return super().rank(queryset, query)
+        weights = field_weights()
+        # ts_rank takes weights in {D, C, B, A} order, each in [0, 1]
+        labels = [
+            weights['description'],
+            weights['abstract'],
+            max(weights['authors'], weights['keywords']),
+            weights['title'],
+        ]
+        top = max(labels) or 1.0
+        label_array = 'ARRAY[%s]::float4[]' % ', '.join(str(w / top) for w in labels)
+        relevance = RawSQL(
+            "SELECT ts_rank(%s, document, to_tsquery('%s', %%s), 1) FROM %s "
+            "WHERE resource_id = %s.id" % (
+                label_array, self.config, self.table, LibraryResource._meta.db_table,
+            ),
+            [tsquery],
+        )
+        return queryset.annotate(relevance=relevance).order_by(
+            '-relevance', *TIE_BREAK_ORDERING
+        )
+
+    def _index_sql(self, where=''):
+        return self.INDEX_SQL.format(
+            search=self.table, config=self.config, where=where, **_tables()
+        )
+
+    def index_resources(self, resource_ids):
+        with connection.cursor() as cursor:
+            for chunk in _chunks(resource_ids):
+                cursor.execute(self._index_sql('WHERE r.id = ANY(%s)'), [chunk])
+
+    def remove_resources(self, resource_ids):
+        with connection.cursor() as cursor:
+            for chunk in _chunks(resource_ids):
+                cursor.execute(
+                    'DELETE FROM %s WHERE resource_id = ANY(%%s)' % self.table, [chunk]
+                )
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute('TRUNCATE %s' % self.table)
+            cursor.execute(self._index_sql())
+
+
+VENDOR_BACKENDS = {
+    'sqlite': SQLiteFTSBackend,
+    'postgresql': PostgresSearchBackend,
+}
+
+_backend = None
+
+
+def get_search_backend():
+    """
+    Return the configured search backend.
+
+    ``settings.LIBRARY_SEARCH_BACKEND`` may name a backend class by dotted
+    path; otherwise one is picked from the database vendor.
+    """
+    global _backend
+    if _backend is None:
+        path = getattr(settings, 'LIBRARY_SEARCH_BACKEND', None)
+        if path:
+            backend_class = import_string(path)
+        else:
+            backend_class = VENDOR_BACKENDS.get(connection.vendor, SimpleSearchBackend)
+        _backend = backend_class()
+    return _backend
@@ -0,0 +1,181 @@
+"""
+Versioned result cache for LibrarySearchView.
+
+A cached page stores the ordered resource ids shown on that page and the
+total result count, keyed by the normalised search form and page number.
+Every key embeds the current catalog version; ``library.signals`` bumps the
+version whenever a resource or one of its relations is written, so entries
+computed against an older catalog are simply never looked up again.
+
+The time of the last bump is kept too, as the catalog's Last-Modified
+watermark for conditional GETs (``library.conditional``), and so that a
+request reading a replica (``library.replicas``) within
+``LIBRARY_REPLICA_PIN_SECONDS`` of a change does not store what it read
+under the new version: the replica may not have the change yet.
+
+The version and the entries live in Django's cache, which must be shared
+between workers (see ``CACHES`` in settings) for invalidation to reach all
+of them. When several workers run on a per-process cache
+(``library.checks``), results are not cached at all.
+"""
+import datetime
+import hashlib
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from . import checks, replicas
+
+
+VERSION_KEY = 'library:catalog_version'
+CHANGED_KEY = 'library:catalog_changed'
+HITS_KEY = 'library:search_cache:hits'
+MISSES_KEY = 'library:search_cache:misses'
+
+
+def _timeout():
+    return getattr(settings, 'LIBRARY_SEARCH_CACHE_TIMEOUT', 300)
+
+
+def get_catalog_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # add() so concurrent first readers agree on the starting value
+        cache.add(VERSION_KEY, 1, timeout=None)
+        version = cache.get(VERSION_KEY, 1)
+    return version
+
+
+async def aget_catalog_version():
+    """``get_catalog_version()`` for async views"""
+    version = await cache.aget(VERSION_KEY)
+    if version is None:
+        await cache.aadd(VERSION_KEY, 1, timeout=None)
+        version = await cache.aget(VERSION_KEY, 1)
+    return version
+
+
+def bump_catalog_version():
+    cache.set(CHANGED_KEY, time.time(), timeout=None)
+    try:
+        return cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.add(VERSION_KEY, 2, timeout=None)
+        return cache.get(VERSION_KEY, 2)
+
+
+def get_catalog_changed():
+    """When the catalog version last moved (or first read, if unknown)"""
+    changed = cache.get(CHANGED_KEY)
+    if changed is None:
+        cache.add(CHANGED_KEY, time.time(), timeout=None)
+        changed = cache.get(CHANGED_KEY, time.time())
+    return datetime.datetime.fromtimestamp(changed, tz=datetime.timezone.utc)
+
+
+def enabled():
+    """Whether search results are cached at all"""
+    return not checks.per_process_cache()
+
+
+def cacheable():
+    """Whether results read by the current request may be cached"""
+    if not enabled():
+        return False
+    if not replicas.reading_replica():
+        return True
+    changed = cache.get(CHANGED_KEY)
+    return changed is None or time.time() - changed >= replicas.pin_seconds()
+
+
+async def acacheable():
+    """``cacheable()`` for async views"""
+    if not enabled():
+        return False
+    if not replicas.reading_replica():
+        return True
+    changed = await cache.aget(CHANGED_KEY)
+    return changed is None or time.time() - changed >= replicas.pin_seconds()
+
+
+def _count(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 1, timeout=None)
+
+
+def normalize_search(cleaned_data):
+    """Reduce ``LibrarySearchForm.cleaned_data`` to a stable, hashable form"""
+    cleaned_data = cleaned_data or {}
+    resource_type = cleaned_data.get('resource_type')
+    subject = cleaned_data.get('subject')
+    return {
+        'query': ' '.join((cleaned_data.get('query') or '').casefold().split()),
+        'resource_type': resource_type.pk if resource_type else None,
+        'subject': subject.pk if subject else None,
+        'year_range': cleaned_data.get('year_range') or '',
+        'availability': cleaned_data.get('availability') or '',
+        'sort_by': cleaned_data.get('sort_by') or 'relevance',
+    }
+
+
+def cache_key(cleaned_data, page):
+    payload = json.dumps([normalize_search(cleaned_data), str(page)], sort_keys=True)
+    digest = hashlib.sha1(payload.encode()).hexdigest()
+    return f'library:search:{get_catalog_version()}:{digest}'
+
+
+def get_page(cleaned_data, page):
+    """Return ``(resource_ids, count)`` for a cached page, or ``None``"""
+    if not enabled():
+        return None
+    entry = cache.get(cache_key(cleaned_data, page))
+    _count(HITS_KEY if entry is not None else MISSES_KEY)
+    return entry
+
+
+def set_page(cleaned_data, page, resource_ids, count):
+    if cacheable():
+        cache.set(cache_key(cleaned_data, page), (list(resource_ids), count), _timeout())
+
+
+def stats():
+    hits = cache.get(HITS_KEY, 0)
+    misses = cache.get(MISSES_KEY, 0)
+    total = hits + misses
+    return {
+        'catalog_version': get_catalog_version(),
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': hits / total if total else 0.0,
+    }
+
+
+class CachedResults:
+    """
+    Stand-in for the search queryset on a cache hit.
+
+    Reports the cached total to the paginator and serves the one page that
+    was loaded from the cached ids.
+    """
+
+    def __init__(self, count, offset, objects):
+        self._count = count
+        self.offset = offset
+        self.objects = objects
+
+    def count(self):
+        return self._count
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return self.objects[key - self.offset]
+        start = (key.start or 0) - self.offset
+        stop = None if key.stop is None else key.stop - self.offset
+        return self.objects[max(start, 0):stop]
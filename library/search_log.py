@@ -0,0 +1,128 @@
+"""
+Buffered SearchLog writer.
+
+Searches enqueue their log entry and return immediately; a background thread
+in each worker writes the queue with ``bulk_create`` once ``batch_size``
+entries are waiting or ``flush_interval`` seconds have passed, and once more
+when the process exits. The queue is bounded: when the database falls behind,
+new entries are dropped and counted rather than slowing searches down.
+
+Settings:
+
+* ``LIBRARY_SEARCH_LOG_BUFFERED`` -- set False to write synchronously
+* ``LIBRARY_SEARCH_LOG_QUEUE_SIZE`` (default 10000)
+* ``LIBRARY_SEARCH_LOG_BATCH_SIZE`` (default 200)
+* ``LIBRARY_SEARCH_LOG_FLUSH_INTERVAL`` in seconds (default 5)
+"""
+import atexit
+import logging
+import os
+import queue
+import threading
+
+from django.conf import settings
+from django.db import DatabaseError, connection
+from django.utils import timezone
+
+from .models import SearchLog
+
+
+logger = logging.getLogger(__name__)
+
+
+class SearchLogBuffer:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = None
+        self.dropped = 0
+        self.written = 0
+
+    @property
+    def batch_size(self):
+        return getattr(settings, 'LIBRARY_SEARCH_LOG_BATCH_SIZE', 200)
+
+    @property
+    def flush_interval(self):
+        return getattr(settings, 'LIBRARY_SEARCH_LOG_FLUSH_INTERVAL', 5)
+
+    def _start(self):
+        # (Re)start per process so a forked worker never shares its parent's
+        # queue or thread.
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(
+                maxsize=getattr(settings, 'LIBRARY_SEARCH_LOG_QUEUE_SIZE', 10000)
+            )
+            self._wakeup = threading.Event()
+            self._flush_lock = threading.Lock()
+            thread = threading.Thread(
+                target=self._run, name='search-log-writer', daemon=True
+            )
+            thread.start()
+            self._pid = os.getpid()
+
+    def add(self, query, user=None, results_count=0):
+        entry = SearchLog(
+            query=query,
+            user=user,
+            results_count=results_count,
+            timestamp=timezone.now(),
+        )
+        if not getattr(settings, 'LIBRARY_SEARCH_LOG_BUFFERED', True):
+            entry.save()
+            return
+        self._start()
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return
+        if self._queue.qsize() >= self.batch_size:
+            self._wakeup.set()
+
+    def flush(self):
+        """Write everything queued so far; returns the number of rows written"""
+        if self._pid != os.getpid():
+            return 0
+        with self._flush_lock:
+            entries = []
+            while True:
+                try:
+                    entries.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not entries:
+                return 0
+            try:
+                SearchLog.objects.bulk_create(entries, batch_size=self.batch_size)
+            except DatabaseError:
+                logger.exception('Dropped %d search log entries', len(entries))
+                with self._lock:
+                    self.dropped += len(entries)
+                return 0
+            with self._lock:
+                self.written += len(entries)
+            return len(entries)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Search log writer failed')
+            finally:
+                # The writer thread has its own connection; don't hold it
+                # open between batches
+                connection.close()
+
+    def stats(self):
+        pending = self._queue.qsize() if self._pid == os.getpid() else 0
+        return {'pending': pending, 'written': self.written, 'dropped': self.dropped}
+
+
+search_log = SearchLogBuffer()
+atexit.register(search_log.flush)
@@ -0,0 +1,483 @@
+"""
+Signal receivers that keep derived catalog data in sync with model writes.
+
+Connected from ``LibraryConfig.ready``.
+"""
+import sys
+
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Count, F, Value
+from django.db.models.functions import Greatest
+from django.db.models.signals import (
+    post_init, post_save, pre_delete, post_delete, m2m_changed, post_migrate
+)
+from django.dispatch import receiver
+
+from .models import (
+    Author, CoFavorite, Keyword, LibraryResource, RelatedResource, ResourceType, Subject, UserFavorite
+)
+from .cofavorites import update_on_commit as update_cofavorites_on_commit
+from .deferred import on_commit_batch
+from .related import missing as related_missing, update_on_commit as update_related_on_commit
+from . import cards, favorites, statistics
+from .search_backends import get_search_backend
+from .search_cache import bump_catalog_version
+from .suggest import suggester, KEYWORD, TITLE, AUTHOR, SUBJECT
+
+
+# Resource fields that end up in the full-text index
+INDEXED_FIELDS = {'title', 'description', 'abstract'}
+
+# Popularity counters change on every page view; they only affect the
+# "Most Popular" ordering, which may lag until cached pages expire.
+COUNTER_FIELDS = {'view_count', 'download_count'}
+
+
+def _reindex_on_commit(resource_ids):
+    resource_ids = set(resource_ids or ())
+    if resource_ids:
+        transaction.on_commit(lambda: get_search_backend().index_resources(resource_ids))
+
+
+def _related_resource_ids(instance):
+    return list(instance.resources.values_list('pk', flat=True))
+
+
+# Affected resources ----------------------------------------------------
+#
+# Renaming or deleting an author or keyword, deleting a subject, or clearing
+# their links changes resources that the search index, search cards, related
+# resources and statistics derive from. These receivers look the resources
+# up once and leave them on the instance as ``_affected_resource_ids`` for
+# the other sections to read; being connected first, they run first.
+
+# Fields whose text is indexed and shown on cards
+NAME_FIELDS = {Author: ('first_name', 'last_name'), Keyword: ('word',)}
+
+
+def _name(instance, fields):
+    return tuple(fields.get(name) for name in NAME_FIELDS[type(instance)])
+
+
+def _affected_resource_ids(instance):
+    return getattr(instance, '_affected_resource_ids', None)
+
+
+@receiver(post_init, sender=Author)
+@receiver(post_init, sender=Keyword)
+def remember_name(sender, instance, **kwargs):
+    # Read from __dict__ so deferred fields are not loaded
+    instance._saved_name = _name(instance, instance.__dict__)
+
+
+@receiver(post_save, sender=Author)
+@receiver(post_save, sender=Keyword)
+def remember_renamed_resources(sender, instance, created, raw=False, **kwargs):
+    name = _name(instance, vars(instance))
+    renamed = not created and not raw and name != instance._saved_name
+    instance._affected_resource_ids = _related_resource_ids(instance) if renamed else []
+    instance._saved_name = name
+
+
+@receiver(pre_delete, sender=Author)
+@receiver(pre_delete, sender=Keyword)
+@receiver(pre_delete, sender=Subject)
+def remember_resources_before_delete(sender, instance, **kwargs):
+    # Their links are cascaded away without an m2m_changed signal
+    instance._affected_resource_ids = _related_resource_ids(instance)
+
+
+@receiver(m2m_changed, sender=LibraryResource.authors.through)
+@receiver(m2m_changed, sender=LibraryResource.subjects.through)
+@receiver(m2m_changed, sender=Keyword.resources.through)
+def remember_resources_before_clear(sender, instance, action, **kwargs):
+    if action == 'pre_clear' and not isinstance(instance, LibraryResource):
+        instance._affected_resource_ids = _related_resource_ids(instance)
+
+
+# Search index ----------------------------------------------------------
+
+@receiver(post_save, sender=LibraryResource)
+def index_saved_resource(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    if raw:
+        return
+    if created or update_fields is None or INDEXED_FIELDS & set(update_fields):
+        _reindex_on_commit([instance.pk])
+
+
+@receiver(post_delete, sender=LibraryResource)
+def unindex_deleted_resource(sender, instance, **kwargs):
+    pk = instance.pk
+    transaction.on_commit(lambda: get_search_backend().remove_resources([pk]))
+
+
+@receiver(m2m_changed, sender=LibraryResource.authors.through)
+@receiver(m2m_changed, sender=Keyword.resources.through)
+def reindex_resource_relations(sender, instance, action, pk_set, **kwargs):
+    """Authors and keywords are part of the indexed document"""
+    if isinstance(instance, LibraryResource):
+        if action == 'post_clear' or (action in ('post_add', 'post_remove') and pk_set):
+            _reindex_on_commit([instance.pk])
+    elif action == 'post_clear':
+        _reindex_on_commit(_affected_resource_ids(instance))
+    elif action in ('post_add', 'post_remove'):
+        _reindex_on_commit(pk_set)
+
+
+@receiver(post_save, sender=Author)
+@receiver(post_save, sender=Keyword)
+def reindex_renamed_resources(sender, instance, **kwargs):
+    _reindex_on_commit(_affected_resource_ids(instance))
+
+
+@receiver(post_delete, sender=Author)
+@receiver(post_delete, sender=Keyword)
+def reindex_after_delete(sender, instance, **kwargs):
+    _reindex_on_commit(_affected_resource_ids(instance))
+
+
+# Autocomplete suggester ------------------------------------------------
+
+@receiver(post_save, sender=Keyword)
+def suggest_keyword(sender, instance, raw=False, **kwargs):
+    if not raw:
+        suggester.update(KEYWORD, instance.pk, instance.word, instance.frequency)
+
+
+@receiver(post_save, sender=LibraryResource)
+def suggest_title(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw:
+        return
+    if update_fields is not None and set(update_fields) == {'view_count'}:
+        suggester.update_weight(TITLE, instance.pk, instance.view_count)
+    else:
+        suggester.update(TITLE, instance.pk, instance.title, instance.view_count)
+
+
+@receiver(post_save, sender=Author)
+def suggest_author(sender, instance, raw=False, **kwargs):
+    if not raw:
+        suggester.update(AUTHOR, instance.pk, instance.full_name)
+
+
+@receiver(post_save, sender=Subject)
+def suggest_subject(sender, instance, raw=False, **kwargs):
+    if not raw:
+        suggester.update(SUBJECT, instance.pk, instance.name)
+
+
+@receiver(post_delete, sender=Keyword)
+@receiver(post_delete, sender=LibraryResource)
+@receiver(post_delete, sender=Author)
+@receiver(post_delete, sender=Subject)
+def forget_suggestion(sender, instance, **kwargs):
+    kind = {Keyword: KEYWORD, LibraryResource: TITLE, Author: AUTHOR, Subject: SUBJECT}[sender]
+    suggester.remove(kind, instance.pk)
+
+
+@receiver(m2m_changed, sender=LibraryResource.authors.through)
+@receiver(m2m_changed, sender=LibraryResource.subjects.through)
+def reweight_suggestions(sender, instance, action, pk_set, model, **kwargs):
+    """Authors and subjects are ranked by how many resources they have"""
+    if action not in ('post_add', 'post_remove') or not pk_set or suggester.built_at is None:
+        return
+    if isinstance(instance, LibraryResource):
+        related_model, ids = model, pk_set
+    else:
+        related_model, ids = type(instance), [instance.pk]
+    kind = AUTHOR if related_model is Author else SUBJECT
+    counts = related_model.objects.filter(pk__in=ids).annotate(
+        weight=Count('resources')
+    ).values_list('pk', 'weight')
+    for pk, weight in counts:
+        suggester.update_weight(kind, pk, weight)
+
+
+# Keyword frequency -----------------------------------------------------
+
+def _adjust_keyword_frequency(keyword_ids, delta):
+    """Add ``delta`` to the frequency of ``keyword_ids`` in one UPDATE"""
+    keyword_ids = list(keyword_ids or ())
+    if not keyword_ids or not delta:
+        return
+    Keyword.objects.filter(pk__in=keyword_ids).update(
+        frequency=Greatest(F('frequency') + delta, Value(0))
+    )
+    on_commit_batch(_keyword_frequency_changed, keyword_ids)
+
+
+def _keyword_frequency_changed(keyword_ids):
+    """Pass the new frequencies on to the suggester and statistics page"""
+    rows = list(Keyword.objects.filter(pk__in=keyword_ids).values_list('pk', 'word', 'frequency'))
+    if suggester.built_at is not None:
+        for pk, _, frequency in rows:
+            suggester.update_weight(KEYWORD, pk, frequency)
+    statistics.refresh_keywords_if_affected([(word, frequency) for _, word, frequency in rows])
+
+
+def _linked_ids(instance, pk_set):
+    """Which of ``pk_set`` are actually linked to ``instance``"""
+    manager = instance.keywords if isinstance(instance, LibraryResource) else instance.resources
+    return list(manager.filter(pk__in=pk_set).values_list('pk', flat=True))
+
+
+@receiver(m2m_changed, sender=Keyword.resources.through)
+def count_keyword_links(sender, instance, action, pk_set, **kwargs):
+    """Keep Keyword.frequency equal to its number of resources"""
+    if action == 'pre_remove':
+        # pk_set holds the ids passed to remove(), linked or not
+        instance._frequency_remove_ids = _linked_ids(instance, pk_set) if pk_set else []
+        return
+    if action == 'pre_clear' and isinstance(instance, LibraryResource):
+        instance._frequency_clear_ids = list(instance.keywords.values_list('pk', flat=True))
+        return
+    if action == 'post_add':
+        # Django passes only the newly linked ids here
+        changed, delta = pk_set, 1
+    elif action == 'post_remove':
+        changed, delta = getattr(instance, '_frequency_remove_ids', None), -1
+    elif action == 'post_clear' and isinstance(instance, Keyword):
+        Keyword.objects.filter(pk=instance.pk).update(frequency=0)
+        on_commit_batch(_keyword_frequency_changed, [instance.pk])
+        return
+    elif action == 'post_clear':
+        changed, delta = getattr(instance, '_frequency_clear_ids', None), -1
+    else:
+        return
+    if not changed:
+        return
+    if isinstance(instance, Keyword):
+        _adjust_keyword_frequency([instance.pk], delta * len(changed))
+    else:
+        _adjust_keyword_frequency(changed, delta)
+
+
+@receiver(pre_delete, sender=LibraryResource)
+def remember_resource_keywords(sender, instance, **kwargs):
+    # The links are cascaded away without an m2m_changed signal
+    instance._frequency_keyword_ids = list(instance.keywords.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=LibraryResource)
+def uncount_deleted_resource_keywords(sender, instance, **kwargs):
+    _adjust_keyword_frequency(getattr(instance, '_frequency_keyword_ids', None), -1)
+
+
+# Search cards ----------------------------------------------------------
+
+@receiver(m2m_changed, sender=LibraryResource.authors.through)
+@receiver(m2m_changed, sender=Keyword.resources.through)
+def refresh_cards_on_relation_change(sender, instance, action, pk_set, **kwargs):
+    """Card author names and keywords follow the resource's links"""
+    if isinstance(instance, LibraryResource):
+        if action == 'post_clear' or (action in ('post_add', 'post_remove') and pk_set):
+            cards.refresh_on_commit([instance.pk])
+    elif action == 'post_clear':
+        cards.refresh_on_commit(_affected_resource_ids(instance))
+    elif action in ('post_add', 'post_remove'):
+        cards.refresh_on_commit(pk_set)
+
+
+@receiver(post_save, sender=Author)
+@receiver(post_save, sender=Keyword)
+def refresh_cards_on_rename(sender, instance, **kwargs):
+    cards.refresh_on_commit(_affected_resource_ids(instance))
+
+
+@receiver(post_delete, sender=Author)
+@receiver(post_delete, sender=Keyword)
+def refresh_cards_after_delete(sender, instance, **kwargs):
+    cards.refresh_on_commit(_affected_resource_ids(instance))
+
+
+# Related resources -----------------------------------------------------
+
+@receiver(post_migrate)
+def check_related_resources(sender, using=DEFAULT_DB_ALIAS, apps=None, verbosity=1, **kwargs):
+    """Point out a catalog without related resources; building them is O(catalog)"""
+    if sender.name != 'library' or using != DEFAULT_DB_ALIAS or verbosity < 1:
+        return
+    try:
+        apps.get_model('library', 'RelatedResource')
+    except LookupError:
+        # Migrated back to before the table existed
+        return
+    if related_missing():
+        stdout = kwargs.get('stdout') or sys.stdout
+        stdout.write(
+            'Related resources have not been computed for this catalog; '
+            'run "manage.py rebuild_related".\n'
+        )
+
+
+@receiver(m2m_changed, sender=LibraryResource.authors.through)
+@receiver(m2m_changed, sender=LibraryResource.subjects.through)
+@receiver(m2m_changed, sender=Keyword.resources.through)
+def relink_related_resources(sender, instance, action, pk_set, **kwargs):
+    if isinstance(instance, LibraryResource):
+        if action == 'post_clear' or (action in ('post_add', 'post_remove') and pk_set):
+            update_related_on_commit([instance.pk])
+    elif action == 'post_clear':
+        update_related_on_commit(_affected_resource_ids(instance))
+    elif action in ('post_add', 'post_remove'):
+        update_related_on_commit(pk_set)
+
+
+@receiver(pre_delete, sender=LibraryResource)
+def remember_related_listers(sender, instance, **kwargs):
+    # Their rows pointing here are cascaded away; refill them afterwards
+    instance._related_listers = list(
+        RelatedResource.objects.filter(related=instance).values_list('resource_id', flat=True)
+    )
+
+
+@receiver(post_delete, sender=LibraryResource)
+def relink_after_resource_delete(sender, instance, **kwargs):
+    update_related_on_commit(getattr(instance, '_related_listers', None))
+
+
+@receiver(post_delete, sender=Author)
+@receiver(post_delete, sender=Keyword)
+@receiver(post_delete, sender=Subject)
+def relink_after_delete(sender, instance, **kwargs):
+    update_related_on_commit(_affected_resource_ids(instance))
+
+
+# Statistics snapshot ---------------------------------------------------
+
+@receiver(post_init, sender=LibraryResource)
+def remember_availability(sender, instance, **kwargs):
+    instance._stats_availability = instance.__dict__.get('availability')
+
+
+@receiver(post_save, sender=LibraryResource)
+def count_saved_resource(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    if raw:
+        return
+    if created:
+        statistics.adjust(total_resources=1)
+        statistics.availability_moved(None, instance.availability)
+    elif update_fields is None or not set(update_fields) <= COUNTER_FIELDS:
+        if update_fields is None or 'availability' in update_fields:
+            statistics.availability_moved(instance._stats_availability, instance.availability)
+        statistics.refresh_popular_if_listed([instance.pk])
+    instance._stats_availability = instance.availability
+
+
+@receiver(post_delete, sender=LibraryResource)
+def count_deleted_resource(sender, instance, **kwargs):
+    statistics.adjust(total_resources=-1)
+    statistics.availability_moved(instance.availability, None)
+    statistics.refresh_popular_if_listed([instance.pk])
+
+
+@receiver(post_save, sender=Author)
+@receiver(post_save, sender=Subject)
+def count_created_name(sender, instance, created, raw=False, **kwargs):
+    column = 'total_authors' if sender is Author else 'total_subjects'
+    if created and not raw:
+        statistics.adjust(**{column: 1})
+    elif sender is Author:
+        # Author names are shown in the popular list
+        statistics.refresh_popular_if_listed(_affected_resource_ids(instance) or ())
+
+
+@receiver(post_delete, sender=Author)
+@receiver(post_delete, sender=Subject)
+def count_deleted_name(sender, instance, **kwargs):
+    statistics.adjust(**{'total_authors' if sender is Author else 'total_subjects': -1})
+
+
+@receiver(m2m_changed, sender=LibraryResource.authors.through)
+def refresh_popular_authors(sender, instance, action, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if isinstance(instance, LibraryResource):
+        statistics.refresh_popular_if_listed([instance.pk])
+    elif pk_set:
+        statistics.refresh_popular_if_listed(pk_set)
+
+
+@receiver(post_save, sender=Keyword)
+def refresh_top_keywords(sender, instance, raw=False, **kwargs):
+    # Checked against the list once per transaction, like link changes
+    if not raw:
+        on_commit_batch(_keyword_frequency_changed, [instance.pk])
+
+
+@receiver(post_delete, sender=Keyword)
+def refresh_top_keywords_after_delete(sender, instance, **kwargs):
+    on_commit_batch(statistics.refresh_keywords_if_affected, [(instance.word, instance.frequency)])
+
+
+# Search result cache ---------------------------------------------------
+
+def _bump_on_commit():
+    transaction.on_commit(bump_catalog_version)
+
+
+@receiver(post_save, sender=LibraryResource)
+def invalidate_on_resource_save(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or not set(update_fields) <= COUNTER_FIELDS:
+        _bump_on_commit()
+
+
+@receiver(post_save, sender=Author)
+@receiver(post_save, sender=Keyword)
+@receiver(post_save, sender=Subject)
+@receiver(post_save, sender=ResourceType)
+@receiver(post_delete, sender=LibraryResource)
+@receiver(post_delete, sender=Author)
+@receiver(post_delete, sender=Keyword)
+@receiver(post_delete, sender=Subject)
+@receiver(post_delete, sender=ResourceType)
+def invalidate_on_catalog_write(sender, **kwargs):
+    _bump_on_commit()
+
+
+@receiver(m2m_changed, sender=LibraryResource.authors.through)
+@receiver(m2m_changed, sender=LibraryResource.subjects.through)
+@receiver(m2m_changed, sender=Keyword.resources.through)
+def invalidate_on_relation_change(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        _bump_on_commit()
+
+
+# Favorites membership cache --------------------------------------------
+
+def _favorites_changed(user_ids):
+    for user_id in user_ids:
+        favorites.changed(user_id)
+
+
+@receiver(post_save, sender=UserFavorite)
+@receiver(post_delete, sender=UserFavorite)
+def invalidate_favorites(sender, instance, raw=False, **kwargs):
+    if not raw:
+        on_commit_batch(_favorites_changed, [instance.user_id])
+
+
+# "Also favorited" recommendations --------------------------------------
+
+@receiver(post_save, sender=UserFavorite)
+def recount_saved_favorite(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        update_cofavorites_on_commit([instance.resource_id])
+
+
+@receiver(post_delete, sender=UserFavorite)
+def recount_deleted_favorite(sender, instance, **kwargs):
+    update_cofavorites_on_commit([instance.resource_id])
+
+
+@receiver(pre_delete, sender=LibraryResource)
+def remember_cofavorite_listers(sender, instance, **kwargs):
+    # Their rows pointing here are cascaded away; refill them afterwards
+    instance._cofavorite_listers = list(
+        CoFavorite.objects.filter(related=instance).values_list('resource_id', flat=True)
+    )
+
+
+@receiver(post_delete, sender=LibraryResource)
+def refill_after_resource_delete(sender, instance, **kwargs):
+    update_cofavorites_on_commit(getattr(instance, '_cofavorite_listers', None))
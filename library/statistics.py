@@ -0,0 +1,141 @@
+"""
+Statistics snapshot for the public statistics page.
+
+The page reads a single ``CatalogStatistics`` row instead of counting the
+catalog on every hit. The counts are adjusted in place with ``F()`` updates
+from ``library.signals`` as resources, authors and subjects are created,
+deleted or change availability. The deltas of a transaction are added up and
+applied in one UPDATE after it commits, so a writer never holds the snapshot
+row's lock for the rest of its transaction and concurrent writers do not
+queue behind each other on it; the popular-resource and top-keyword lists
+are stored ready to render and refreshed from their indexes when view counts
+are flushed or keywords change. ``rebuild()`` (the ``rebuild_statistics``
+command) recomputes everything from scratch.
+"""
+from django.db import transaction
+from django.db.models import Count, F, Q
+from django.utils import timezone
+
+from .deferred import on_commit_sum
+from .models import Author, CatalogStatistics, Keyword, LibraryResource, Subject
+
+
+SNAPSHOT_PK = 1
+POPULAR_COUNT = 10
+TOP_KEYWORD_COUNT = 20
+
+# Availability value -> counter column
+AVAILABILITY_COLUMNS = {
+    'available': 'available_resources',
+    'digital': 'digital_resources',
+}
+
+
+def _popular_resources():
+    resources = LibraryResource.objects.order_by('-view_count', '-date_added')[:POPULAR_COUNT]
+    return [
+        {
+            'pk': resource.pk,
+            'title': resource.title,
+            'author_names': resource.author_names,
+            'view_count': resource.view_count,
+        }
+        for resource in resources
+    ]
+
+
+def _top_keywords():
+    return list(
+        Keyword.objects.order_by('-frequency', 'word').values('word', 'frequency')[:TOP_KEYWORD_COUNT]
+    )
+
+
+def rebuild():
+    totals = LibraryResource.objects.aggregate(
+        total_resources=Count('pk'),
+        available_resources=Count('pk', filter=Q(availability='available')),
+        digital_resources=Count('pk', filter=Q(availability='digital')),
+    )
+    snapshot, _ = CatalogStatistics.objects.update_or_create(pk=SNAPSHOT_PK, defaults={
+        **totals,
+        'total_authors': Author.objects.count(),
+        'total_subjects': Subject.objects.count(),
+        'popular_resources': _popular_resources(),
+        'top_keywords': _top_keywords(),
+    })
+    return snapshot
+
+
+def get_snapshot():
+    snapshot = CatalogStatistics.objects.filter(pk=SNAPSHOT_PK).first()
+    if snapshot is None:
+        with transaction.atomic():
+            snapshot = rebuild()
+    return snapshot
+
+
+def _apply(deltas):
+    deltas = {column: delta for column, delta in deltas.items() if delta}
+    if deltas:
+        CatalogStatistics.objects.filter(pk=SNAPSHOT_PK).update(
+            date_updated=timezone.now(),
+            **{column: F(column) + delta for column, delta in deltas.items()}
+        )
+
+
+def adjust(**deltas):
+    """
+    Add ``deltas`` to the snapshot's counters once the current transaction
+    commits (no-op until the snapshot exists)
+    """
+    on_commit_sum(_apply, deltas)
+
+
+def availability_moved(old, new):
+    """Adjust counters for a resource whose availability went ``old`` -> ``new``"""
+    deltas = {}
+    if old in AVAILABILITY_COLUMNS:
+        deltas[AVAILABILITY_COLUMNS[old]] = -1
+    if new in AVAILABILITY_COLUMNS:
+        deltas[AVAILABILITY_COLUMNS[new]] = deltas.get(AVAILABILITY_COLUMNS[new], 0) + 1
+    adjust(**deltas)
+
+
+def refresh_popular():
+    CatalogStatistics.objects.filter(pk=SNAPSHOT_PK).update(
+        popular_resources=_popular_resources(), date_updated=timezone.now()
+    )
+
+
+def refresh_popular_if_listed(resource_ids):
+    """Refresh the popular list if it shows any of ``resource_ids``"""
+    listed = CatalogStatistics.objects.filter(pk=SNAPSHOT_PK).values_list(
+        'popular_resources', flat=True
+    ).first()
+    if listed and {entry['pk'] for entry in listed} & set(resource_ids):
+        refresh_popular()
+
+
+def refresh_keywords():
+    CatalogStatistics.objects.filter(pk=SNAPSHOT_PK).update(
+        top_keywords=_top_keywords(), date_updated=timezone.now()
+    )
+
+
+def refresh_keywords_if_affected(frequencies):
+    """
+    Refresh the top-keyword list if any of ``frequencies`` (``(word,
+    frequency)`` pairs of changed keywords) is listed or now ranks high
+    enough to be
+    """
+    listed = CatalogStatistics.objects.filter(pk=SNAPSHOT_PK).values_list(
+        'top_keywords', flat=True
+    ).first()
+    if listed is None:
+        return
+    words = {entry['word'] for entry in listed}
+    lowest = min((entry['frequency'] for entry in listed), default=0)
+    if len(listed) < TOP_KEYWORD_COUNT or any(
+        word in words or frequency >= lowest for word, frequency in frequencies
+    ):
+        refresh_keywords()
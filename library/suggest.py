@@ -0,0 +1,302 @@
+"""
+In-memory prefix suggester behind ``keyword_autocomplete``.
+
+Every keyword, resource title, author name and subject name is stored in a
+sorted array of normalised keys, one key per word boundary so "mach" finds
+"Introduction to Machine Learning". Lookups are a bisect into that array.
+For short prefixes, whose ranges cover a large slice of the catalog, the
+top-k entries are precomputed at build time and maintained as entries change.
+
+The structure lives in each worker process. It is built on first use (or by
+``warm()`` at WSGI and ASGI startup), updated incrementally by ``library.signals`` and
+rebuilt from the database once it is older than
+``settings.LIBRARY_SUGGEST_MAX_AGE`` seconds, which picks up writes made by
+other processes. That rebuild runs in a background thread: requests keep
+being answered from the old structure until the new one is swapped in, and
+incremental updates made while it loads are replayed onto it.
+"""
+import heapq
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import namedtuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DatabaseError, connection
+from django.db.models import Count
+
+from .models import Author, Keyword, LibraryResource, Subject
+
+
+KEYWORD = 'keyword'
+TITLE = 'title'
+AUTHOR = 'author'
+SUBJECT = 'subject'
+
+KIND_LABELS = {
+    TITLE: 'Title',
+    AUTHOR: 'Author',
+    SUBJECT: 'Subject',
+}
+
+# Keywords come first, as they did before titles and names were suggested;
+# within a kind, entries are ordered by weight (keyword frequency, title
+# views, or number of resources for authors and subjects).
+KIND_ORDER = {KEYWORD: 0, SUBJECT: 1, AUTHOR: 2, TITLE: 3}
+
+Suggestion = namedtuple('Suggestion', 'text weight kind')
+
+# Sentinel that sorts after any real character
+_PREFIX_END = '\U0010ffff'
+
+
+def normalize(text):
+    return ' '.join((text or '').casefold().split())
+
+
+def _rank(suggestion, entry_id):
+    return (KIND_ORDER[suggestion.kind], -suggestion.weight, suggestion.text, entry_id)
+
+
+def _keys(text):
+    """One key per word start: "a b c" -> "a b c", "b c", "c" """
+    words = normalize(text).split(' ')
+    return {' '.join(words[i:]) for i in range(len(words)) if words[i]}
+
+
+class PrefixSuggester:
+    def __init__(self, limit=10, precomputed_length=3):
+        self.limit = limit
+        self.precomputed_length = precomputed_length
+        # Keep spare room in precomputed lists so de-duplicated results stay full
+        self._top_size = limit * 2
+        self._lock = threading.RLock()
+        self._keys = []        # sorted [(key, entry_id)]
+        self._entries = {}     # entry_id -> Suggestion
+        self._top = {}         # short prefix -> sorted [_rank(...)]
+        self.built_at = None
+        # Incremental updates made while a background rebuild loads, or None
+        self._pending = None
+
+
+    # Building ---------------------------------------------------------
+
+    def build(self):
+        """Load every suggestion source from the database"""
+        self._swap(*self._load())
+
+    def _load(self):
+        entries = {}
+        for pk, word, frequency in Keyword.objects.values_list('pk', 'word', 'frequency'):
+            entries[(KEYWORD, pk)] = Suggestion(word, frequency, KEYWORD)
+        for pk, title, views in LibraryResource.objects.values_list('pk', 'title', 'view_count'):
+            entries[(TITLE, pk)] = Suggestion(title, views, TITLE)
+        authors = Author.objects.annotate(weight=Count('resources')).values_list(
+            'pk', 'first_name', 'last_name', 'weight'
+        )
+        for pk, first_name, last_name, weight in authors:
+            entries[(AUTHOR, pk)] = Suggestion(f"{first_name} {last_name}", weight, AUTHOR)
+        subjects = Subject.objects.annotate(weight=Count('resources')).values_list(
+            'pk', 'name', 'weight'
+        )
+        for pk, name, weight in subjects:
+            entries[(SUBJECT, pk)] = Suggestion(name, weight, SUBJECT)
+
+        keys = []
+        top = {}
+        for entry_id, suggestion in entries.items():
+            entry_keys = _keys(suggestion.text)
+            keys.extend((key, entry_id) for key in entry_keys)
+            item = _Ranked(_rank(suggestion, entry_id))
+            prefixes = {p for key in entry_keys for p in self._short_prefixes(key)}
+            for prefix in prefixes:
+                heap = top.setdefault(prefix, [])
+                if len(heap) < self._top_size:
+                    heapq.heappush(heap, item)
+                elif heap[0] < item:
+                    heapq.heapreplace(heap, item)
+        keys.sort()
+        top = {prefix: sorted(r.item for r in heap) for prefix, heap in top.items()}
+        return keys, entries, top
+
+    def _swap(self, keys, entries, top):
+        with self._lock:
+            self._keys = keys
+            self._entries = entries
+            self._top = top
+            self.built_at = time.monotonic()
+            pending, self._pending = self._pending, None
+            for method, args in pending or ():
+                method(*args)
+
+    def warm(self):
+        """Build now if the catalog tables are available"""
+        try:
+            self.build()
+        except DatabaseError:
+            pass
+
+    def _is_stale(self):
+        max_age = getattr(settings, 'LIBRARY_SUGGEST_MAX_AGE', 300)
+        return self.built_at is None or time.monotonic() - self.built_at > max_age
+
+    def _ensure_fresh(self):
+        """Build now if never built; start a background rebuild if stale"""
+        if self.built_at is None:
+            with self._lock:
+                if self.built_at is None:
+                    self.build()
+        elif self._is_stale():
+            self._start_refresh()
+
+    def _start_refresh(self):
+        with self._lock:
+            if self._pending is not None or not self._is_stale():
+                return
+            self._pending = []
+        threading.Thread(target=self._refresh_thread, name='suggester-refresh', daemon=True).start()
+
+    def _refresh_thread(self):
+        try:
+            self._refresh()
+        finally:
+            connection.close()
+
+    def _refresh(self):
+        try:
+            loaded = self._load()
+        except Exception:
+            # Keep serving the old structure; a later request retries
+            with self._lock:
+                self._pending = None
+            raise
+        self._swap(*loaded)
+
+    def _short_prefixes(self, key):
+        return [key[:n] for n in range(1, min(len(key), self.precomputed_length) + 1)]
+
+    # Lookup -----------------------------------------------------------
+
+    def _scan(self, prefix):
+        lo = bisect_left(self._keys, (prefix,))
+        hi = bisect_left(self._keys, (prefix + _PREFIX_END,))
+        seen = {entry_id for _, entry_id in self._keys[lo:hi]}
+        return heapq.nsmallest(
+            self._top_size,
+            (_rank(self._entries[e], e) for e in seen),
+        )
+
+    def suggest(self, term, limit=None):
+        """Return up to ``limit`` suggestions whose words start with ``term``"""
+        limit = limit or self.limit
+        prefix = normalize(term)
+        if not prefix:
+            return []
+        self._ensure_fresh()
+        return self._lookup(prefix, limit)
+
+    async def asuggest(self, term, limit=None):
+        """``suggest()`` for async views; only the first build leaves the event loop"""
+        limit = limit or self.limit
+        prefix = normalize(term)
+        if not prefix:
+            return []
+        if self.built_at is None:
+            await sync_to_async(self._ensure_fresh)()
+        elif self._is_stale():
+            # Only starts a thread
+            self._start_refresh()
+        return self._lookup(prefix, limit)
+
+    def _lookup(self, prefix, limit):
+        with self._lock:
+            if len(prefix) <= self.precomputed_length:
+                candidates = self._top.get(prefix, [])
+            else:
+                candidates = self._scan(prefix)
+            results, seen = [], set()
+            for *_, text, entry_id in candidates:
+                if text.casefold() in seen:
+                    continue
+                seen.add(text.casefold())
+                results.append(self._entries[entry_id])
+                if len(results) == limit:
+                    break
+            return results
+
+    # Incremental updates ----------------------------------------------
+
+    def update(self, kind, pk, text, weight=None):
+        """Add or replace one entry; ``weight=None`` keeps the current weight"""
+        entry_id = (kind, pk)
+        with self._lock:
+            if self.built_at is None:
+                return
+            if self._pending is not None:
+                self._pending.append((self.update, (kind, pk, text, weight)))
+            old = self._entries.get(entry_id)
+            if weight is None:
+                weight = old.weight if old is not None else 0
+            if old is not None and old.text != text:
+                self._remove(entry_id)
+                old = None
+            self._entries[entry_id] = Suggestion(text, weight, kind)
+            entry_keys = _keys(text)
+            if old is None:
+                for key in entry_keys:
+                    insort(self._keys, (key, entry_id))
+            for prefix in {p for key in entry_keys for p in self._short_prefixes(key)}:
+                self._refresh_top(prefix, entry_id, old, weight)
+
+    def update_weight(self, kind, pk, weight):
+        with self._lock:
+            suggestion = self._entries.get((kind, pk))
+            if suggestion is not None and suggestion.weight != weight:
+                self.update(kind, pk, suggestion.text, weight)
+
+    def remove(self, kind, pk):
+        with self._lock:
+            if self.built_at is not None:
+                if self._pending is not None:
+                    self._pending.append((self.remove, (kind, pk)))
+                self._remove((kind, pk))
+
+    def _remove(self, entry_id):
+        suggestion = self._entries.pop(entry_id, None)
+        if suggestion is None:
+            return
+        entry_keys = _keys(suggestion.text)
+        for key in entry_keys:
+            index = bisect_left(self._keys, (key, entry_id))
+            if index < len(self._keys) and self._keys[index] == (key, entry_id):
+                del self._keys[index]
+        for prefix in {p for key in entry_keys for p in self._short_prefixes(key)}:
+            top = self._top.get(prefix)
+            if top and any(item[-1] == entry_id for item in top):
+                self._top[prefix] = self._scan(prefix)
+
+    def _refresh_top(self, prefix, entry_id, old, weight):
+        top = [item for item in self._top.get(prefix, []) if item[-1] != entry_id]
+        was_listed = len(top) != len(self._top.get(prefix, []))
+        if was_listed and old is not None and weight < old.weight:
+            # A listed entry dropped; something unlisted may now outrank it
+            self._top[prefix] = self._scan(prefix)
+            return
+        insort(top, _rank(self._entries[entry_id], entry_id))
+        self._top[prefix] = top[:self._top_size]
+
+
+class _Ranked:
+    """Heap item that compares best-first, so heap[0] is the worst entry"""
+
+    __slots__ = ('item',)
+
+    def __init__(self, item):
+        self.item = item
+
+    def __lt__(self, other):
+        return self.item > other.item
+
+
+suggester = PrefixSuggester()
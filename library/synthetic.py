@@ -0,0 +1,196 @@
+"""
+Synthetic catalog generation for load testing.
+
+Produces catalog records with skewed, production-like distributions --
+Zipf-distributed author, subject and keyword popularity, mostly one or two
+authors per item, publication years weighted towards recent decades and
+heavy-tailed view counts -- and loads them through ``CatalogImporter``.
+
+Output depends only on the seed and the requested size: records are
+generated in fixed-size batches, each from its own ``Random(seed, batch)``,
+so the same catalog comes out however the batches are split between worker
+processes. ISBNs are derived from the seed and record number, so re-running
+a generation is a no-op.
+"""
+import itertools
+import random
+from functools import lru_cache
+
+from django.db import close_old_connections
+
+from .bulk_import import CatalogImporter
+
+
+BATCH_SIZE = 1000
+
+SUBJECTS = [
+    'Computer Science', 'Literature', 'History', 'Science', 'Medicine',
+    'Engineering', 'Arts', 'Philosophy', 'Psychology', 'Economics',
+    'Mathematics', 'Physics', 'Chemistry', 'Biology', 'Sociology',
+]
+SUBJECT_PREFIXES = ['', 'Applied', 'Theoretical', 'Computational', 'Historical', 'Experimental']
+
+FIRST_NAMES = [
+    'James', 'Mary', 'John', 'Patricia', 'Robert', 'Jennifer', 'Michael',
+    'Linda', 'William', 'Elizabeth', 'David', 'Barbara', 'Richard', 'Susan',
+    'Joseph', 'Jessica', 'Thomas', 'Sarah', 'Charles', 'Karen', 'Wei', 'Yuki',
+    'Priya', 'Ahmed', 'Fatima', 'Carlos', 'Sofia', 'Ivan', 'Olga', 'Kwame',
+    'Amara', 'Lars', 'Ingrid', 'Mateo', 'Lucia', 'Hiroshi', 'Mei', 'Ravi',
+    'Ana', 'Pierre',
+]
+SURNAME_SYLLABLES = [
+    'an', 'ber', 'cas', 'dal', 'en', 'fer', 'gar', 'hol', 'is', 'jan', 'kov',
+    'lin', 'mar', 'nor', 'os', 'per', 'quin', 'ros', 'san', 'tor', 'ul',
+    'val', 'wes', 'yam', 'zel',
+]
+
+WORDS = [
+    'research', 'analysis', 'study', 'methodology', 'theory', 'practice',
+    'application', 'framework', 'system', 'development', 'implementation',
+    'evaluation', 'assessment', 'innovation', 'technology', 'design',
+    'strategy', 'model', 'concept', 'principle', 'technique', 'process',
+    'management', 'optimization', 'integration', 'learning', 'network',
+    'data', 'culture', 'society', 'history', 'policy', 'energy', 'climate',
+    'health', 'language', 'memory', 'ethics', 'markets', 'cities', 'water',
+    'genetics', 'computation', 'statistics', 'security', 'education',
+    'migration', 'religion', 'art', 'music', 'law', 'trade', 'power',
+    'identity', 'media', 'evolution', 'materials', 'robotics', 'vision',
+    'agriculture', 'oceans', 'infection', 'cognition', 'behavior',
+]
+TITLE_FORMS = [
+    '{a} and {b} in {subject}',
+    'Introduction to {a}',
+    '{a}: {b} and Beyond',
+    'Advances in {a} {b}',
+    'A History of {a}',
+    'Handbook of {a} {b}',
+    '{subject}: {a} Perspectives',
+]
+
+PUBLISHERS = [
+    'Academic Press', 'Tech Publications', 'University Press',
+    'Scientific Books', 'Global Publishers', 'Modern Education Press',
+    'Knowledge House', 'Learning Publishers', 'Research Institute Press',
+    'International Publishing', 'Educational Books Inc',
+]
+LOCATIONS = [
+    'Main Library - First Floor', 'Main Library - Second Floor',
+    'Science Library', 'Digital Collection', 'Reference Section',
+    'Special Collections', 'Reserved Section',
+]
+
+RESOURCE_TYPES = (['book', 'journal', 'thesis', 'conference', 'digital', 'multimedia'], [50, 25, 8, 10, 5, 2])
+AVAILABILITY = (['available', 'checked_out', 'digital', 'restricted'], [55, 20, 20, 5])
+AUTHORS_PER_ITEM = ([1, 2, 3, 4, 5], [50, 28, 13, 6, 3])
+SUBJECTS_PER_ITEM = ([1, 2, 3], [60, 30, 10])
+KEYWORDS_PER_ITEM = ([2, 3, 4, 5, 6, 7, 8], [5, 15, 25, 25, 15, 10, 5])
+
+
+def vocabulary_sizes(count):
+    """Authors, subjects and keywords for a catalog of ``count`` resources"""
+    return {
+        'authors': max(20, count // 3),
+        'subjects': min(len(SUBJECTS) * len(SUBJECT_PREFIXES), max(len(SUBJECTS), count // 5000)),
+        'keywords': min(len(WORDS) ** 2, max(len(WORDS), count // 50)),
+    }
+
+
+def author_name(index):
+    first = FIRST_NAMES[index % len(FIRST_NAMES)]
+    index //= len(FIRST_NAMES)
+    syllables = []
+    for _ in range(3):
+        syllables.append(SURNAME_SYLLABLES[index % len(SURNAME_SYLLABLES)])
+        index //= len(SURNAME_SYLLABLES)
+    last = ''.join(syllables).capitalize()
+    return f'{first} {last}{index + 1 if index else ""}'
+
+
+def subject_name(index):
+    prefix = SUBJECT_PREFIXES[index // len(SUBJECTS)]
+    return f'{prefix} {SUBJECTS[index % len(SUBJECTS)]}'.strip()
+
+
+def keyword(index):
+    if index < len(WORDS):
+        return WORDS[index]
+    index -= len(WORDS)
+    return f'{WORDS[index // len(WORDS)]} {WORDS[index % len(WORDS)]}'
+
+
+@lru_cache(maxsize=None)
+def zipf_weights(size, exponent=1.1):
+    """Cumulative Zipf weights over ``size`` ranks, for ``Random.choices``"""
+    return list(itertools.accumulate(1 / (rank ** exponent) for rank in range(1, size + 1)))
+
+
+def generate_batch(seed, batch, count, batch_size=BATCH_SIZE):
+    """Records ``batch * batch_size`` up to ``count``, deterministic from ``seed``"""
+    rng = random.Random(f'{seed}:{batch}')
+    sizes = vocabulary_sizes(count)
+    start = batch * batch_size
+    size = min(batch_size, count - start)
+    if size <= 0:
+        return []
+
+    # Draw each column for the whole batch at once
+    author_counts = rng.choices(*AUTHORS_PER_ITEM, k=size)
+    subject_counts = rng.choices(*SUBJECTS_PER_ITEM, k=size)
+    keyword_counts = rng.choices(*KEYWORDS_PER_ITEM, k=size)
+    authors = iter(rng.choices(range(sizes['authors']), cum_weights=zipf_weights(sizes['authors']), k=sum(author_counts)))
+    subjects = iter(rng.choices(range(sizes['subjects']), cum_weights=zipf_weights(sizes['subjects']), k=sum(subject_counts)))
+    keywords = iter(rng.choices(range(sizes['keywords']), cum_weights=zipf_weights(sizes['keywords']), k=sum(keyword_counts)))
+    types = rng.choices(*RESOURCE_TYPES, k=size)
+    availability = rng.choices(*AVAILABILITY, k=size)
+    # Years skew recent; views are heavy-tailed
+    years = [int(rng.triangular(1900, 2025, 2020)) for _ in range(size)]
+    views = [min(10 ** 6, int(rng.paretovariate(1.16)) - 1) * 3 for _ in range(size)]
+
+    records = []
+    for i in range(size):
+        number = start + i
+        # Popular values can be drawn twice for one item; keep them once
+        item_subjects = [subject_name(s) for s in dict.fromkeys(itertools.islice(subjects, subject_counts[i]))]
+        item_keywords = [keyword(k) for k in dict.fromkeys(itertools.islice(keywords, keyword_counts[i]))]
+        item_authors = [author_name(a) for a in dict.fromkeys(itertools.islice(authors, author_counts[i]))]
+        title = rng.choice(TITLE_FORMS).format(
+            a=item_keywords[0].title(), b=item_keywords[-1].title(), subject=item_subjects[0]
+        )
+        records.append({
+            'title': f'{title} ({number + 1})',
+            'authors': item_authors,
+            'subjects': item_subjects,
+            'keywords': item_keywords,
+            'resource_type': types[i],
+            'description': f'A study of {", ".join(item_keywords)} in {item_subjects[0].lower()}.',
+            'publication_year': years[i],
+            'publisher': rng.choice(PUBLISHERS),
+            'isbn': f'979-{seed % 1000:03d}{number:010d}',
+            'location': rng.choice(LOCATIONS),
+            'availability': availability[i],
+            'pages': rng.randint(40, 1200),
+            'view_count': views[i],
+            'download_count': views[i] // rng.randint(3, 12),
+        })
+    return records
+
+
+def generate(seed, count, batch_size=BATCH_SIZE, batches=None):
+    """All records, or those of the given batch numbers, in order"""
+    if batches is None:
+        batches = range((count + batch_size - 1) // batch_size)
+    for batch in batches:
+        yield from generate_batch(seed, batch, count, batch_size)
+
+
+def load_batches(seed, count, batches, batch_size=BATCH_SIZE):
+    """
+    Generate and import some batches; returns ``(read, created)``.
+
+    Runs in pool workers, so it leaves keyword frequencies to be recomputed
+    once every worker is done.
+    """
+    close_old_connections()
+    importer = CatalogImporter(chunk_size=batch_size, count_keywords=False)
+    stats = importer.run(generate(seed, count, batch_size, batches))
+    return stats.read, stats.created
@@ -1,3 +1,1364 @@
-from django.test import TestCase
+import io
+import json
+import os
+import tempfile
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.models import Count
+from django.http import HttpResponse, QueryDict, StreamingHttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from . import (
+    benchmarks, cards, checks, cofavorites, export, facets, favorites, instrumentation, related, replicas,
+    search_cache, signals, statistics, suggest,
+)
+from .bulk_import import CatalogImporter, read_csv, read_marcxml, split_author_name
+from .search_backends import SimpleSearchBackend, get_search_backend, tokenize
+from .counters import ResourceCounters
+from .models import (
+    Author, CoFavoriteUpdate, Keyword, LibraryResource, RelatedResource, SearchLog, Subject, UserFavorite,
+)
+from .pagination import CursorPaginator, InvalidCursor
+from .search import SearchPaginator, SearchPlan
+from .search_log import SearchLogBuffer
+from .suggest import KEYWORD, TITLE, PrefixSuggester, suggester
+
+
+@override_settings(**benchmarks.SETTINGS)
+class CatalogTestCase(TestCase):
+    """
+    A synthetic catalog of ``catalog_size`` resources (``self.user`` has
+    favorited the first ones), buffered writes made synchronously, and an
+    empty cache before every test.
+    """
+    catalog_size = 30
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = benchmarks.seed_catalog(cls.catalog_size)
+
+    def setUp(self):
+        cache.clear()
+
+
+class QueryBudgetTests(CatalogTestCase):
+    """
+    Every view stays within its query budget in ``benchmarks.QUERY_BUDGETS``.
+
+    Run at two catalog sizes, so a query count that grows with the catalog
+    fails here even if the small catalog happens to fit the budget.
+    """
+    def setUp(self):
+        super().setUp()
+        suggester.build()
+        statistics.rebuild()
+        self.client.force_login(self.user)
+        self.urls = benchmarks.view_urls()
+
+    def assertWithinBudget(self, name):
+        budget = benchmarks.QUERY_BUDGETS[name]
+        with self.assertNumQueriesAtMost(budget, name):
+            response = self.client.get(self.urls[name])
+        self.assertEqual(response.status_code, 200)
+
+    def assertNumQueriesAtMost(self, budget, name):
+        return _AtMost(self, budget, name)
+
+    def test_search(self):
+        self.assertWithinBudget('search')
+
+    def test_search_filtered(self):
+        self.assertWithinBudget('search_filtered')
+
+    def test_search_cursor(self):
+        self.assertWithinBudget('search_cursor')
+
+    def test_search_browse(self):
+        self.assertWithinBudget('search_browse')
+
+    def test_search_api(self):
+        self.assertWithinBudget('search_api')
+
+    def test_resource_lookup(self):
+        self.assertWithinBudget('resource_lookup')
+
+    def test_resource_detail(self):
+        self.assertWithinBudget('resource_detail')
+
+    def test_favorites(self):
+        self.assertWithinBudget('favorites')
+
+    def test_statistics(self):
+        self.assertWithinBudget('statistics')
+
+    def test_keyword_autocomplete(self):
+        self.assertWithinBudget('keyword_autocomplete')
+
+
+class LargerCatalogQueryBudgetTests(QueryBudgetTests):
+    catalog_size = 300
+
+
+class SearchBackendTests(CatalogTestCase):
+    catalog_size = 20
+
+    def matches(self, query, backend=None):
+        backend = backend or get_search_backend()
+        return set(backend.filter(LibraryResource.objects.all(), query).values_list('pk', flat=True))
+
+    def test_matches_title_author_and_keyword_prefixes(self):
+        resource = LibraryResource.objects.filter(keyword_count__gt=0).first()
+        title_word = max(tokenize(resource.title), key=len)
+        author = resource.authors.first()
+        keyword = resource.keywords.first()
+        for query in [title_word[:4], author.last_name, f'{keyword.word} {title_word}']:
+            self.assertIn(resource.pk, self.matches(query), query)
+        # The index never finds more than the unindexed icontains search
+        self.assertLessEqual(self.matches(title_word), self.matches(title_word, SimpleSearchBackend()))
+        self.assertEqual(self.matches('  '), set())
+
+    def test_index_follows_saves_and_deletes(self):
+        resource = LibraryResource.objects.first()
+        with self.captureOnCommitCallbacks(execute=True):
+            resource.title = 'Zyzzyva habitats'
+            resource.save()
+        self.assertEqual(self.matches('zyzzyva'), {resource.pk})
+        with self.captureOnCommitCallbacks(execute=True):
+            resource.title = 'Aardwolf habitats'
+            resource.save()
+        self.assertEqual(self.matches('zyzzyva'), set())
+        with self.captureOnCommitCallbacks(execute=True):
+            resource.delete()
+        self.assertEqual(self.matches('aardwolf'), set())
+
+    def test_rebuild_restores_the_index(self):
+        backend = get_search_backend()
+        resource = LibraryResource.objects.first()
+        word = max(tokenize(resource.title), key=len)
+        backend.remove_resources(LibraryResource.objects.values_list('pk', flat=True))
+        self.assertEqual(self.matches(word), set())
+        backend.rebuild()
+        self.assertIn(resource.pk, self.matches(word))
+
+
+class RelevanceRankingTests(CatalogTestCase):
+    catalog_size = 20
+
+    def setUp(self):
+        super().setUp()
+        self.in_title, self.in_description = LibraryResource.objects.order_by('pk')[:2]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.in_title.title = 'Quokka field notes'
+            self.in_title.save()
+            # Popularity only breaks ties, so this one must not win on it
+            self.in_description.description = 'Notes that mention a quokka in passing.'
+            self.in_description.view_count = 10 ** 6
+            self.in_description.save()
+
+    def ranked(self):
+        return [resource.pk for resource in SearchPlan({'query': 'quokka'}).queryset]
+
+    def test_title_matches_outrank_description_matches(self):
+        self.assertEqual(self.ranked(), [self.in_title.pk, self.in_description.pk])
+
+    def test_field_weights_are_configurable(self):
+        weights = {'title': 0.1, 'description': 50.0}
+        with override_settings(LIBRARY_SEARCH_FIELD_WEIGHTS=weights):
+            self.assertEqual(self.ranked(), [self.in_description.pk, self.in_title.pk])
+
+    @skipUnless(connection.vendor == 'sqlite', 'FTS5 index')
+    def test_index_is_searched_once(self):
+        queryset = SearchPlan({'query': 'quokka notes'}).queryset
+        with CaptureQueriesContext(connection) as queries:
+            list(queryset)
+        sql, = [query['sql'] for query in queries.captured_queries]
+        self.assertEqual(sql.count(' MATCH '), 1)
+        self.assertIn('bm25(', sql)
+
+
+class SuggesterTests(CatalogTestCase):
+    catalog_size = 20
+
+    def setUp(self):
+        super().setUp()
+        self.suggester = PrefixSuggester(limit=5)
+        self.suggester.build()
+
+    def test_matches_any_word_start_keywords_first(self):
+        resource = LibraryResource.objects.first()
+        word = resource.title.split()[-1]
+        results = self.suggester.suggest(word.upper())
+        self.assertIn(resource.title, [result.text for result in results if result.kind == TITLE])
+        kinds = [suggest.KIND_ORDER[result.kind] for result in results]
+        self.assertEqual(kinds, sorted(kinds))
+        self.assertLessEqual(len(results), 5)
+        self.assertEqual(self.suggester.suggest('   '), [])
+
+    def test_incremental_updates(self):
+        self.suggester.update(KEYWORD, 999999, 'zebrafish', 3)
+        self.assertEqual([result.text for result in self.suggester.suggest('zeb')], ['zebrafish'])
+        self.suggester.update_weight(KEYWORD, 999999, 7)
+        self.assertEqual(self.suggester.suggest('zebrafish')[0].weight, 7)
+        self.suggester.remove(KEYWORD, 999999)
+        self.assertEqual(self.suggester.suggest('zeb'), [])
+
+    def test_stale_index_is_served_while_rebuilt_in_the_background(self):
+        keyword = Keyword.objects.create(word='quagga', frequency=1)
+        self.suggester.remove(KEYWORD, keyword.pk)
+        self.suggester.built_at -= 10 ** 6
+        with mock.patch.object(suggest.threading, 'Thread') as thread:
+            with self.assertNumQueries(0):
+                self.assertEqual(self.suggester.suggest('quag'), [])
+            self.suggester.suggest('quag')
+        thread.assert_called_once()
+        thread.return_value.start.assert_called_once()
+
+        # Made while the rebuild loads, so replayed onto the new structure
+        self.suggester.update(KEYWORD, 999999, 'quahog', 1)
+        self.suggester._refresh()
+        self.assertEqual([result.text for result in self.suggester.suggest('qua')], ['quagga', 'quahog'])
+        self.assertFalse(self.suggester._is_stale())
+
+
+class SearchCacheTests(CatalogTestCase):
+    def titles(self):
+        return [resource.title for resource in self.client.get('/?sort_by=title').context['resources']]
+
+    def test_pages_are_cached_until_the_catalog_changes(self):
+        first = self.titles()
+        self.assertEqual(search_cache.stats()['misses'], 1)
+        self.assertEqual(self.titles(), first)
+        self.assertEqual(search_cache.stats()['hits'], 1)
+
+        resource = LibraryResource.objects.get(title=first[0])
+        with self.captureOnCommitCallbacks(execute=True):
+            resource.title = '!First on the shelf'
+            resource.save()
+        self.assertEqual(self.titles()[0], '!First on the shelf')
+
+    def test_popularity_counters_do_not_invalidate(self):
+        version = search_cache.get_catalog_version()
+        resource = LibraryResource.objects.first()
+        with self.captureOnCommitCallbacks(execute=True):
+            resource.increment_view_count()
+        self.assertEqual(search_cache.get_catalog_version(), version)
+
+    def test_several_workers_need_a_shared_cache(self):
+        self.assertEqual(checks.check_shared_cache(), [])
+        with override_settings(LIBRARY_WORKER_PROCESSES=4):
+            warnings = checks.check_shared_cache()
+            self.assertEqual([warning.id for warning in warnings], ['library.E001'])
+            self.assertFalse(warnings[0].is_serious())
+            with self.assertLogs('library.checks', 'WARNING'):
+                checks.check_cache_at_startup()
+            with override_settings(LIBRARY_REQUIRE_SHARED_CACHE=True):
+                with self.assertRaises(ImproperlyConfigured):
+                    checks.check_cache_at_startup()
+
+    def test_per_process_cache_disables_result_cache(self):
+        with override_settings(LIBRARY_WORKER_PROCESSES=4):
+            self.titles()
+            self.titles()
+            self.assertEqual(search_cache.stats()['hits'], 0)
+            self.assertFalse(search_cache.cacheable())
+
+
+class SearchCountTests(CatalogTestCase):
+    def test_plan_counts_once(self):
+        word = Keyword.objects.order_by('-frequency').first().word
+        plan = SearchPlan({'query': word})
+        with self.assertNumQueries(1):
+            count = plan.count
+            self.assertEqual(SearchPaginator(plan, plan.queryset, 10).count, count)
+        # The log entry reuses the count: its INSERT is the only query
+        with self.assertNumQueries(1):
+            plan.log(AnonymousUser())
+        self.assertEqual(count, plan.filtered().count())
+
+    def test_search_page_counts_once(self):
+        word = Keyword.objects.order_by('-frequency').first().word
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f'/?query={word}')
+        counts = [query for query in queries if '"__count"' in query['sql']]
+        self.assertEqual(len(counts), 1)
+        self.assertEqual(response.context['results_count'], SearchPlan({'query': word}).count)
+
+
+class CursorPaginationTests(CatalogTestCase):
+    def walk(self, paginator):
+        """Ids of every page walked forward, then of every page walked back"""
+        forward, pages = [], []
+        page = paginator.page()
+        while True:
+            pages.append([row.pk for row in page])
+            forward.extend(pages[-1])
+            if not page.has_next():
+                break
+            page = paginator.page(page.next_cursor)
+        backward = list(pages[-1])
+        while page.has_previous():
+            page = paginator.page(page.previous_cursor)
+            backward[:0] = [row.pk for row in page]
+        return forward, backward
+
+    def assertRoundTrip(self, queryset, per_page=7):
+        expected = [row.pk for row in CursorPaginator(queryset, len(queryset) + 1).page()]
+        forward, backward = self.walk(CursorPaginator(queryset, per_page))
+        self.assertEqual(forward, expected)
+        self.assertEqual(backward, expected)
+        self.assertEqual(len(expected), len(set(expected)))
+
+    def test_round_trip_for_every_sort_option(self):
+        for sort_by in ['title', '-title', '-publication_year', '-view_count', '-date_added']:
+            with self.subTest(sort_by=sort_by):
+                self.assertRoundTrip(SearchPlan({'sort_by': sort_by}).queryset)
+
+    def test_ties_are_broken_by_id(self):
+        LibraryResource.objects.update(view_count=3, date_added=timezone.now(), title='Same')
+        self.assertRoundTrip(SearchPlan({'sort_by': '-view_count'}).queryset, per_page=4)
+        self.assertRoundTrip(SearchPlan({'sort_by': 'title'}).queryset, per_page=4)
+
+    def test_popularity_order_seeks_along_its_index(self):
+        queryset = SearchPlan({'sort_by': '-view_count'}).queryset
+        fields = [name for name, _ in CursorPaginator(queryset, 5).fields]
+        self.assertEqual(fields, ['view_count', 'date_added', 'pk'])
+
+    def test_relevance_pages_by_position(self):
+        word = Keyword.objects.order_by('-frequency').first().word
+        queryset = SearchPlan({'query': word}).queryset
+        self.assertFalse(CursorPaginator(queryset, 5).seekable)
+        self.assertRoundTrip(queryset, per_page=3)
+
+    def test_tampered_and_foreign_cursors_are_rejected(self):
+        queryset = SearchPlan({'sort_by': 'title'}).queryset
+        cursor = CursorPaginator(queryset, 5).page().next_cursor
+        for bad in [cursor[:-2] + 'xx', 'garbage']:
+            with self.assertRaises(InvalidCursor):
+                CursorPaginator(queryset, 5).page(bad)
+        with self.assertRaises(InvalidCursor):
+            CursorPaginator(SearchPlan({'sort_by': '-view_count'}).queryset, 5).page(cursor)
+        self.assertEqual(self.client.get(f'/?paginate=cursor&cursor={cursor[:-2]}xx').status_code, 404)
+
+    def test_total_is_counted_on_the_first_page_only(self):
+        first = self.client.get('/?paginate=cursor&sort_by=title')
+        total = first.context['results_count']
+        cursor = first.context['page_obj'].next_cursor
+        with CaptureQueriesContext(connection) as queries:
+            second = self.client.get(f'/?paginate=cursor&sort_by=title&cursor={cursor}')
+        self.assertEqual(second.context['results_count'], total)
+        self.assertFalse([query for query in queries if '"__count"' in query['sql']])
+
+    def test_total_is_recounted_after_a_catalog_change(self):
+        first = self.client.get('/?paginate=cursor&sort_by=title')
+        total = first.context['results_count']
+        cursor = first.context['page_obj'].next_cursor
+        with self.captureOnCommitCallbacks(execute=True):
+            LibraryResource.objects.filter(pk=LibraryResource.objects.order_by('-title').first().pk).delete()
+        second = self.client.get(f'/?paginate=cursor&sort_by=title&cursor={cursor}')
+        self.assertEqual(second.context['results_count'], total - 1)
+
+    def test_relevance_pages_say_they_go_by_position(self):
+        word = Keyword.objects.order_by('-frequency').first().word
+        response = self.client.get(f'/?paginate=cursor&query={word}&page_size=3')
+        self.assertTrue(response.context['cursor_by_position'])
+        response = self.client.get('/?paginate=cursor&sort_by=title')
+        self.assertFalse(response.context['cursor_by_position'])
+
+
+class FacetTests(CatalogTestCase):
+    catalog_size = 40
+
+    def test_counts_match_the_result_set_in_one_query(self):
+        word = Keyword.objects.order_by('-frequency').first().word
+        plan = SearchPlan({'query': word})
+        with self.assertNumQueries(1):
+            counts = facets.compute_facet_counts(plan)
+        results = plan.filtered()
+        expected_types = {}
+        for type_id in results.values_list('resource_type', flat=True):
+            expected_types[type_id] = expected_types.get(type_id, 0) + 1
+        self.assertEqual(counts['resource_type'], expected_types)
+        for subject_id, count in counts['subject'].items():
+            self.assertEqual(results.filter(subjects=subject_id).count(), count)
+        self.assertEqual(sum(counts['availability'].values()), plan.count)
+
+    def test_options_are_cached_ordered_and_mark_the_selection(self):
+        resource = LibraryResource.objects.first()
+        params = QueryDict(f'availability={resource.availability}&page=3')
+        plan = SearchPlan(params)
+        options = facets.facet_options(plan, params)
+        with self.assertNumQueries(0):
+            self.assertEqual(facets.facet_options(plan, params), options)
+        availability = next(facet for facet in options if facet['name'] == 'availability')
+        self.assertEqual([option['selected'] for option in availability['options']], [True])
+        subject = next(facet for facet in options if facet['name'] == 'subject')
+        counts = [option['count'] for option in subject['options']]
+        self.assertEqual(counts, sorted(counts, reverse=True))
+        self.assertNotIn('page=', subject['options'][0]['querystring'])
+
+
+@override_settings(
+    LIBRARY_SEARCH_LOG_BUFFERED=True, LIBRARY_SEARCH_LOG_FLUSH_INTERVAL=3600,
+    LIBRARY_SEARCH_LOG_QUEUE_SIZE=3,
+)
+class SearchLogBufferTests(TestCase):
+    def test_entries_are_written_in_one_batch_on_flush(self):
+        buffer = SearchLogBuffer()
+        for query in ['alpha', 'beta', 'gamma']:
+            buffer.add(query, results_count=1)
+        self.assertEqual(SearchLog.objects.count(), 0)
+        with self.assertNumQueries(1):
+            self.assertEqual(buffer.flush(), 3)
+        self.assertEqual(
+            sorted(SearchLog.objects.values_list('query', flat=True)), ['alpha', 'beta', 'gamma']
+        )
+        self.assertEqual(buffer.stats(), {'pending': 0, 'written': 3, 'dropped': 0})
+
+    def test_a_full_queue_drops_entries(self):
+        buffer = SearchLogBuffer()
+        for n in range(5):
+            buffer.add(f'query {n}')
+        self.assertEqual(buffer.stats(), {'pending': 3, 'written': 0, 'dropped': 2})
+        buffer.flush()
+
+
+@override_settings(LIBRARY_COUNTERS_BUFFERED=True, LIBRARY_COUNTER_FLUSH_INTERVAL=3600)
+class ResourceCounterTests(CatalogTestCase):
+    catalog_size = 10
+
+    def test_increments_are_summed_and_written_on_flush(self):
+        first, second, third = LibraryResource.objects.order_by('pk')[:3]
+        counters = ResourceCounters()
+        for resource, hits in [(first, 2), (second, 2), (third, 1)]:
+            for _ in range(hits):
+                counters.increment(resource.pk, 'view_count')
+        counters.increment(first.pk, 'download_count')
+        self.assertEqual(counters.pending(first.pk, 'view_count'), 2)
+        self.assertEqual(LibraryResource.objects.get(pk=first.pk).view_count, first.view_count)
+
+        counters.flush()
+        for resource, views, downloads in [(first, 2, 1), (second, 2, 0), (third, 1, 0)]:
+            resource_after = LibraryResource.objects.get(pk=resource.pk)
+            self.assertEqual(resource_after.view_count, resource.view_count + views)
+            self.assertEqual(resource_after.download_count, resource.download_count + downloads)
+        self.assertEqual(counters.pending(first.pk, 'view_count'), 0)
+        with self.assertRaises(ValueError):
+            counters.increment(first.pk, 'title')
+
+
+class RelatedResourceTests(CatalogTestCase):
+    catalog_size = 20
+
+    def setUp(self):
+        super().setUp()
+        related.build()
+        self.first, self.second = LibraryResource.objects.order_by('pk')[:2]
+
+    def test_resources_sharing_an_author_are_related(self):
+        author = Author.objects.create(first_name='Ada', last_name='Unique')
+        with self.captureOnCommitCallbacks(execute=True):
+            author.resources.add(self.first, self.second)
+        self.assertIn(self.second, related.related_resources(self.first))
+        self.assertIn(self.first, related.related_resources(self.second))
+        self.assertLessEqual(len(related.related_resources(self.first)), related.related_count())
+
+    def test_one_update_per_transaction(self):
+        with mock.patch.object(related, 'update', wraps=related.update) as update:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.first.authors.add(Author.objects.create(first_name='Ada', last_name='Unique'))
+                self.first.subjects.add(Subject.objects.create(name='Unique subject'))
+                self.first.keywords.add(Keyword.objects.create(word='unique-keyword'))
+        update.assert_called_once_with({self.first.pk})
+
+    def test_rolled_back_changes_do_not_swallow_later_ones(self):
+        author = Author.objects.create(first_name='Ada', last_name='Unique')
+        with mock.patch.object(related, 'update') as update:
+            with self.captureOnCommitCallbacks(execute=True):
+                try:
+                    with transaction.atomic():
+                        self.first.authors.add(author)
+                        raise ValueError
+                except ValueError:
+                    pass
+                self.second.authors.add(author)
+        update.assert_called_once_with({self.second.pk})
+
+    def test_broad_features_are_not_loaded(self):
+        with override_settings(LIBRARY_RELATED_MAX_POSTINGS=1):
+            features, postings = related._load([self.first.pk])
+        self.assertTrue(features[self.first.pk])
+        self.assertEqual(dict(postings), {})
+
+    def test_migrate_points_out_a_missing_table(self):
+        out = io.StringIO()
+        call_command('migrate', 'library', verbosity=1, stdout=out)
+        self.assertNotIn('rebuild_related', out.getvalue())
+        RelatedResource.objects.all().delete()
+        call_command('migrate', 'library', verbosity=1, stdout=out)
+        self.assertIn('rebuild_related', out.getvalue())
+        self.assertFalse(RelatedResource.objects.exists())
+
+
+class StatisticsTests(CatalogTestCase):
+    catalog_size = 10
+
+    def setUp(self):
+        super().setUp()
+        self.snapshot = statistics.rebuild()
+        self.resource = LibraryResource.objects.order_by('pk').first()
+
+    def current(self):
+        return statistics.get_snapshot()
+
+    def test_counts_follow_creates_and_deletes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Author.objects.create(first_name='Ada', last_name='Lovelace')
+            Subject.objects.create(name='Analytical engines')
+            self.resource.delete()
+        current = self.current()
+        self.assertEqual(current.total_authors, self.snapshot.total_authors + 1)
+        self.assertEqual(current.total_subjects, self.snapshot.total_subjects + 1)
+        self.assertEqual(current.total_resources, self.snapshot.total_resources - 1)
+
+    def test_availability_moves_between_counters(self):
+        self.resource.availability = 'available'
+        self.resource.save()
+        resource = LibraryResource.objects.get(pk=self.resource.pk)
+        before = statistics.rebuild()
+        with self.captureOnCommitCallbacks(execute=True):
+            resource.availability = 'digital'
+            resource.save()
+        current = self.current()
+        self.assertEqual(current.available_resources, before.available_resources - 1)
+        self.assertEqual(current.digital_resources, before.digital_resources + 1)
+
+    def test_deltas_applied_once_after_commit(self):
+        with mock.patch.object(statistics, '_apply', wraps=statistics._apply) as apply:
+            with self.captureOnCommitCallbacks(execute=True):
+                for index in range(3):
+                    Author.objects.create(first_name='Ada', last_name=f'Lovelace {index}')
+                Author.objects.filter(last_name='Lovelace 0').delete()
+                self.assertEqual(self.current().total_authors, self.snapshot.total_authors)
+        apply.assert_called_once_with({'total_authors': 2})
+        self.assertEqual(self.current().total_authors, self.snapshot.total_authors + 2)
+
+    def test_rolled_back_savepoint_is_not_counted(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Author.objects.create(first_name='Ada', last_name='Lovelace')
+            try:
+                with transaction.atomic():
+                    Author.objects.create(first_name='Charles', last_name='Babbage')
+                    raise ValueError
+            except ValueError:
+                pass
+        self.assertEqual(self.current().total_authors, self.snapshot.total_authors + 1)
+
+
+class KeywordFrequencyTests(CatalogTestCase):
+    catalog_size = 10
+
+    def setUp(self):
+        super().setUp()
+        statistics.rebuild()
+        self.first, self.second, self.third = LibraryResource.objects.order_by('pk')[:3]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.keyword = Keyword.objects.create(word='zymurgy')
+
+    def assertFrequency(self, expected):
+        self.keyword.refresh_from_db()
+        self.assertEqual(self.keyword.frequency, expected)
+        self.assertEqual(self.keyword.resources.count(), expected)
+
+    def test_add_counts_new_links_only(self):
+        self.first.keywords.add(self.keyword)
+        self.first.keywords.add(self.keyword)
+        self.keyword.resources.add(self.first, self.second)
+        self.assertFrequency(2)
+
+    def test_remove_unlinked_keyword(self):
+        self.keyword.resources.add(self.first)
+        self.second.keywords.remove(self.keyword)
+        self.assertFrequency(1)
+        self.first.keywords.remove(self.keyword)
+        self.assertFrequency(0)
+
+    def test_remove_from_keyword_counts_linked_resources_only(self):
+        self.keyword.resources.add(self.first, self.second)
+        self.keyword.resources.remove(self.second, self.third)
+        self.assertFrequency(1)
+
+    def test_clear(self):
+        self.keyword.resources.add(self.first, self.second, self.third)
+        self.first.keywords.clear()
+        self.assertFrequency(2)
+        self.keyword.resources.clear()
+        self.assertFrequency(0)
+
+    def test_resource_delete(self):
+        self.keyword.resources.add(self.first, self.second)
+        self.first.delete()
+        self.assertFrequency(1)
+
+    def test_refreshed_once_per_transaction(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            other = Keyword.objects.create(word='zyzzyva')
+        with mock.patch.object(statistics, 'refresh_keywords_if_affected') as refresh:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.first.keywords.add(self.keyword, other)
+                self.second.keywords.add(self.keyword)
+                self.third.keywords.add(other)
+                self.keyword.resources.remove(self.first)
+        refresh.assert_called_once()
+        self.assertCountEqual(refresh.call_args.args[0], [('zymurgy', 1), ('zyzzyva', 2)])
+
+    def test_new_top_keyword_reaches_statistics_and_suggestions(self):
+        suggester.build()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.keyword.resources.add(*LibraryResource.objects.all())
+        top = statistics.get_snapshot().top_keywords[0]
+        self.assertEqual(top, {'word': 'zymurgy', 'frequency': LibraryResource.objects.count()})
+        suggestion = suggester.suggest('zymurgy')[0]
+        self.assertEqual((suggestion.kind, suggestion.weight), (KEYWORD, LibraryResource.objects.count()))
+
+    def test_keyword_writes_refresh_the_top_list_once_per_transaction(self):
+        with CaptureQueriesContext(connection) as queries:
+            with self.captureOnCommitCallbacks(execute=True):
+                for word in ['zebu', 'zloty', 'zymase']:
+                    Keyword.objects.create(word=word)
+                self.keyword.word = 'zymurgist'
+                self.keyword.save()
+        updates = [query for query in queries if 'UPDATE "library_catalogstatistics"' in query['sql']]
+        self.assertLessEqual(len(updates), 1)
+
+        listed = statistics.get_snapshot().top_keywords[0]['word']
+        with self.captureOnCommitCallbacks(execute=True):
+            Keyword.objects.get(word=listed).delete()
+        words = [entry['word'] for entry in statistics.get_snapshot().top_keywords]
+        self.assertNotIn(listed, words)
+
+
+MARCXML = """<?xml version="1.0" encoding="UTF-8"?>
+<collection xmlns="http://www.loc.gov/MARC21/slim">
+  <record>
+    <leader>00000nam a2200000 a 4500</leader>
+    <controlfield tag="008">190101s2019{blank}eng d</controlfield>
+    <datafield tag="020" ind1=" " ind2=" "><subfield code="a">9780000000028 (pbk.)</subfield></datafield>
+    <datafield tag="024" ind1="7" ind2=" ">
+      <subfield code="a">10.1000/rottnest</subfield><subfield code="2">doi</subfield>
+    </datafield>
+    <datafield tag="100" ind1="1" ind2=" "><subfield code="a">Smith, Jane.</subfield></datafield>
+    <datafield tag="245" ind1="1" ind2="0">
+      <subfield code="a">Quokka field notes :</subfield><subfield code="b">a year on Rottnest /</subfield>
+    </datafield>
+    <datafield tag="650" ind1=" " ind2="0"><subfield code="a">Zoology.</subfield></datafield>
+  </record>
+</collection>
+""".replace('{blank}', ' ' * 24)
+
+
+class ImporterTests(CatalogTestCase):
+    catalog_size = 5
+
+    records = [
+        {
+            'title': 'Quokka field notes', 'publication_year': 'c2019', 'isbn': '9780000000011',
+            'authors': 'Smith, Jane; Tom Baker', 'subjects': ['Zoology'], 'keywords': 'Marsupials; quokka',
+        },
+        {
+            'title': 'Quokka ecology', 'publication_year': 2020, 'doi': '10.1000/quokka',
+            'authors': ['Jane Smith'], 'keywords': ['quokka'], 'resource_type': 'journal',
+        },
+    ]
+
+    def write(self, name, content):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, name)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        return path
+
+    def test_imports_records_with_links(self):
+        stats = CatalogImporter().run(self.records)
+        self.assertEqual((stats.read, stats.created), (2, 2))
+        notes = LibraryResource.objects.get(isbn='9780000000011')
+        self.assertEqual(notes.publication_year, 2019)
+        self.assertEqual(
+            set(notes.authors.values_list('first_name', 'last_name')), {('Jane', 'Smith'), ('Tom', 'Baker')}
+        )
+        self.assertEqual(set(notes.keywords.values_list('word', flat=True)), {'marsupials', 'quokka'})
+        self.assertIn('Smith', notes.author_names)
+        # "Smith, Jane" and "Jane Smith" are the same author
+        self.assertEqual(Author.objects.filter(last_name='Smith', first_name='Jane').count(), 1)
+        quokka = Keyword.objects.get(word='quokka')
+        self.assertEqual(quokka.frequency, 2)
+        self.assertEqual(quokka.resources.count(), 2)
+        found = get_search_backend().filter(LibraryResource.objects.all(), 'quokka')
+        self.assertEqual(set(found.values_list('title', flat=True)), {'Quokka field notes', 'Quokka ecology'})
+
+    def test_rerun_skips_existing(self):
+        CatalogImporter().run(self.records)
+        total = LibraryResource.objects.count()
+        stats = CatalogImporter().run(self.records)
+        self.assertEqual((stats.created, stats.existing), (0, 2))
+        self.assertEqual(LibraryResource.objects.count(), total)
+        self.assertEqual(Keyword.objects.get(word='quokka').frequency, 2)
+
+    def test_skips_unkeyed_invalid_and_duplicate_records(self):
+        records = [
+            {'title': 'No identifier', 'publication_year': 2000},
+            {'title': '', 'isbn': '9780000000035', 'publication_year': 2000},
+            {'title': 'Lost', 'isbn': '9780000000042', 'publication_year': 2000, 'availability': 'lost'},
+            {'title': 'Twice', 'isbn': '9780000000059', 'publication_year': 2000},
+            {'title': 'Twice again', 'isbn': '9780000000059', 'publication_year': 2000},
+        ]
+        importer = CatalogImporter(chunk_size=2)
+        stats = importer.run(records)
+        self.assertEqual(
+            (stats.created, stats.unkeyed, stats.invalid, stats.existing), (1, 1, 2, 1)
+        )
+        self.assertEqual(len(importer.errors), 2)
+        stats = CatalogImporter(allow_unkeyed=True).run(records[:1])
+        self.assertEqual(stats.created, 1)
+
+    def test_split_author_name(self):
+        self.assertEqual(split_author_name('Smith, Jane.'), ('Jane', 'Smith'))
+        self.assertEqual(split_author_name('Jane  Q. Smith'), ('Jane Q.', 'Smith'))
+        self.assertEqual(split_author_name('Plato'), ('', 'Plato'))
+
+    def test_read_csv(self):
+        path = self.write('catalog.csv', 'title,publication_year,isbn,authors\nNotes,2019,978,"Smith, Jane; Tom Baker"\n')
+        record, = read_csv(path)
+        self.assertEqual(record['title'], 'Notes')
+        stats = CatalogImporter().run([record])
+        self.assertEqual(stats.created, 1)
+        self.assertEqual(LibraryResource.objects.get(isbn='978').authors.count(), 2)
+
+    def test_read_marcxml(self):
+        record, = read_marcxml(self.write('catalog.xml', MARCXML))
+        self.assertEqual(record['title'], 'Quokka field notes a year on Rottnest')
+        self.assertEqual(record['authors'], ['Smith, Jane'])
+        self.assertEqual(record['subjects'], ['Zoology'])
+        self.assertEqual((record['isbn'], record['doi']), ('9780000000028', '10.1000/rottnest'))
+        self.assertEqual((record['publication_year'], record['language']), ('2019', 'English'))
+        self.assertEqual(record['resource_type'], 'book')
+
+    def test_import_catalog_command(self):
+        path = self.write('catalog.jsonl', ''.join(json.dumps(record) + '\n' for record in self.records))
+        out = io.StringIO()
+        call_command('import_catalog', path, stdout=out)
+        self.assertIn('✓ Imported 2 of 2 records', out.getvalue())
+        self.assertEqual(statistics.get_snapshot().total_resources, LibraryResource.objects.count())
+        out = io.StringIO()
+        call_command('import_catalog', path, stdout=out)
+        self.assertIn('✓ Imported 0 of 2 records', out.getvalue())
+
+
+class PopulateSampleDataTests(CatalogTestCase):
+    catalog_size = 5
+
+    def populate(self, *args):
+        out = io.StringIO()
+        call_command('populate_sample_data', *args, stdout=out)
+        return out.getvalue()
+
+    def test_synthetic_catalog(self):
+        before = LibraryResource.objects.count()
+        output = self.populate('--synthetic', '--seed', '2', '--count', '25', '--batch-size', '10')
+        created = LibraryResource.objects.count() - before
+        self.assertGreater(created, 0)
+        self.assertIn(f'✓ Created {created} of 25 synthetic resources', output)
+        self.assertEqual(output.count(' generated, '), 3)
+        self.assertNotIn('Next steps', output)
+        self.assertEqual(statistics.get_snapshot().total_resources, LibraryResource.objects.count())
+        for keyword in Keyword.objects.annotate(links=Count('resources')):
+            self.assertEqual(keyword.frequency, keyword.links, keyword.word)
+
+        output = self.populate('--synthetic', '--seed', '2', '--count', '25', '--batch-size', '10')
+        self.assertIn('✓ Created 0 of 25 synthetic resources', output)
+
+    def test_sample_catalog(self):
+        before = LibraryResource.objects.count()
+        output = self.populate('--count', '2')
+        self.assertEqual(LibraryResource.objects.count(), before + 2)
+        self.assertEqual(output.count('Next steps'), 1)
+        self.assertTrue(output.rstrip().endswith('3. Login and start exploring!'))
+
+
+class AffectedResourceTests(CatalogTestCase):
+    """Renames, deletes and clears look the linked resources up once for every consumer"""
+    catalog_size = 10
+
+    def setUp(self):
+        super().setUp()
+        related.build()
+        self.first, self.second = LibraryResource.objects.order_by('pk')[:2]
+        self.author = Author.objects.create(first_name='Ada', last_name='Quagmire')
+        self.keyword = Keyword.objects.create(word='quillwort')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.author.resources.add(self.first, self.second)
+            self.keyword.resources.add(self.first)
+
+    def lookups(self):
+        return mock.patch.object(signals, '_related_resource_ids', wraps=signals._related_resource_ids)
+
+    def matches(self, query):
+        return set(get_search_backend().filter(LibraryResource.objects.all(), query).values_list('pk', flat=True))
+
+    def test_rename(self):
+        author = Author.objects.get(pk=self.author.pk)
+        with self.lookups() as lookups, self.captureOnCommitCallbacks(execute=True):
+            author.email = 'ada@example.org'
+            author.save()
+            self.assertEqual(lookups.call_count, 0)
+            author.last_name = 'Quenby'
+            author.save()
+        self.assertEqual(lookups.call_count, 1)
+        self.assertEqual(self.matches('quenby'), {self.first.pk, self.second.pk})
+        self.assertEqual(self.matches('quagmire'), set())
+        self.first.refresh_from_db()
+        self.assertIn('Quenby', self.first.author_names)
+
+    def test_delete(self):
+        with self.lookups() as lookups, mock.patch.object(related, 'update') as update:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.author.delete()
+        self.assertEqual(lookups.call_count, 1)
+        update.assert_called_once_with({self.first.pk, self.second.pk})
+        self.assertEqual(self.matches('quagmire'), set())
+        self.first.refresh_from_db()
+        self.assertNotIn('Quagmire', self.first.author_names)
+
+    def test_clear(self):
+        with self.lookups() as lookups, self.captureOnCommitCallbacks(execute=True):
+            self.keyword.resources.clear()
+            self.author.resources.clear()
+        self.assertEqual(lookups.call_count, 2)
+        self.assertEqual(self.matches('quillwort'), set())
+        self.first.refresh_from_db()
+        self.assertNotIn('quillwort', self.first.top_keywords)
+        self.assertNotIn('Quagmire', self.first.author_names)
+
+
+@override_settings(LIBRARY_INSTRUMENTATION_SAMPLE_RATE=1.0)
+class InstrumentationTests(TestCase):
+    def setUp(self):
+        instrumentation.registry.reset()
+
+    def test_server_timing_and_histograms(self):
+        self.client.force_login(User.objects.create_user('staff', password='x', is_staff=True))
+        response = self.client.get('/statistics/')
+        self.assertRegex(
+            response['Server-Timing'],
+            r'^total;dur=[\d.]+, db;dur=[\d.]+;desc="\d+ queries, \d+ duplicate", template;dur=[\d.]+$',
+        )
+        views = instrumentation.registry.snapshot()
+        self.assertEqual(views['library:statistics']['time_ms']['count'], 1)
+        self.assertGreater(views['library:statistics']['queries']['sum'], 0)
+
+    @override_settings(LIBRARY_INSTRUMENTATION_SAMPLE_RATE=0)
+    def test_unsampled_requests_are_not_measured(self):
+        response = self.client.get('/statistics/')
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(instrumentation.registry.snapshot(), {})
+
+    def test_server_timing_is_for_staff_unless_enabled(self):
+        response = self.client.get('/statistics/')
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(instrumentation.registry.snapshot()['library:statistics']['time_ms']['count'], 1)
+        with override_settings(LIBRARY_SERVER_TIMING=True):
+            self.assertIn('Server-Timing', self.client.get('/statistics/'))
+
+
+class ExportTests(CatalogTestCase):
+    catalog_size = 40
+
+    def export(self, export_format, query=''):
+        response = self.client.get(f'/export/{export_format}/?{query}')
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    def test_csv_has_every_result_in_search_order(self):
+        with override_settings(LIBRARY_EXPORT_CHUNK_SIZE=7):
+            lines = self.export('csv', 'sort_by=title').splitlines()
+        self.assertEqual(lines[0].split(','), export.FIELDS)
+        resources = LibraryResource.objects.order_by('title')
+        self.assertEqual([int(line.split(',')[0]) for line in lines[1:]], [r.pk for r in resources])
+
+    def test_jsonl_includes_related_names(self):
+        resource = LibraryResource.objects.order_by('title').first()
+        first = json.loads(self.export('jsonl', 'sort_by=title').splitlines()[0])
+        self.assertEqual(first['id'], resource.pk)
+        self.assertEqual(first['authors'], [author.full_name for author in resource.authors.all()])
+        self.assertEqual(first['keywords'], [keyword.word for keyword in resource.keywords.all()])
+
+    def test_bibtex_entries(self):
+        text = self.export('bibtex')
+        self.assertEqual(text.count('\n@'), LibraryResource.objects.count() - 1)
+
+    def test_unknown_format(self):
+        self.assertEqual(self.client.get('/export/xml/').status_code, 404)
+
+    def test_invalid_search_is_rejected(self):
+        response = self.client.get('/export/csv/?year_range=nonsense')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('year_range', response.json()['errors'])
+
+    @override_settings(LIBRARY_EXPORT_MAX_ROWS=5)
+    def test_rows_are_capped(self):
+        self.assertEqual(len(self.export('jsonl', 'sort_by=title').splitlines()), 5)
+
+
+class SearchApiTests(CatalogTestCase):
+
+    def test_sparse_fieldsets(self):
+        response = self.client.get('/api/search/?sort_by=title&fields=id,authors,author_names&page_size=5')
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['count'], LibraryResource.objects.count())
+        self.assertEqual(len(data['results']), 5)
+        resource = LibraryResource.objects.order_by('title').first()
+        self.assertEqual(data['results'][0], {
+            'id': resource.pk,
+            'authors': [author.full_name for author in resource.authors.all()],
+            'author_names': resource.author_names,
+        })
+
+    def test_cached_page_matches(self):
+        url = '/api/search/?sort_by=title&fields=id,title,keywords&page=2&page_size=4'
+        self.assertEqual(self.client.get(url).json(), self.client.get(url).json())
+
+    def test_errors(self):
+        self.assertEqual(self.client.get('/api/search/?fields=id,secret').status_code, 400)
+        self.assertEqual(self.client.get('/api/search/?sort_by=nope').status_code, 400)
+        self.assertEqual(self.client.get('/api/search/?page=500').status_code, 404)
+
+
+class AsyncViewTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        suggester.build()
+
+    async def test_autocomplete(self):
+        keyword = await Keyword.objects.order_by('-frequency', 'word').afirst()
+        response = await self.async_client.get(f'/api/keywords/?term={keyword.word[:3]}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()[0]['value'], keyword.word)
+        self.assertEqual((await self.async_client.post('/api/keywords/?term=ab')).status_code, 405)
+
+    async def test_resource_lookup(self):
+        first, second = [pk async for pk in LibraryResource.objects.order_by('pk').values_list('pk', flat=True)[:2]]
+        url = f'/api/resources/?ids={second},999999,{first}&fields=id,authors'
+        data = (await self.async_client.get(url)).json()
+        self.assertEqual([record['id'] for record in data['results']], [second, first])
+        self.assertEqual(data['missing'], [999999])
+        resource = await LibraryResource.objects.aget(pk=second)
+        authors = [author.full_name async for author in resource.authors.all()]
+        self.assertEqual(data['results'][0]['authors'], authors)
+        self.assertEqual((await self.async_client.get(url)).json(), data)
+
+        for bad in ['?ids=x', '?ids=', f'?ids={first}&fields=secret']:
+            self.assertEqual((await self.async_client.get('/api/resources/' + bad)).status_code, 400)
+
+    def test_resource_lookup_cached_per_catalog_version(self):
+        resource = LibraryResource.objects.order_by('pk').first()
+        url = f'/api/resources/?ids={resource.pk}&fields=title'
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            self.client.get(url)
+        resource.title = 'Renamed'
+        with self.captureOnCommitCallbacks(execute=True):
+            resource.save()
+        self.assertEqual(self.client.get(url).json()['results'][0]['title'], 'Renamed')
+
+    def test_toggle_favorite(self):
+        resource = LibraryResource.objects.first()
+        UserFavorite.objects.filter(user=self.user, resource=resource).delete()
+        url = f'/favorite/{resource.pk}/'
+        self.assertEqual(self.client.post(url).status_code, 401)
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(url).status_code, 405)
+        self.assertTrue(self.client.post(url).json()['favorited'])
+        self.assertTrue(UserFavorite.objects.filter(user=self.user, resource=resource).exists())
+        self.assertFalse(self.client.post(url).json()['favorited'])
+        self.assertFalse(UserFavorite.objects.filter(user=self.user, resource=resource).exists())
+        self.assertEqual(self.client.post('/favorite/999999/').status_code, 404)
+
+    async def test_login_session_saved_on_event_loop_chain(self):
+        await sync_to_async(self.user.set_password)('secret-pass-1')
+        await self.user.asave()
+        response = await self.async_client.post(
+            '/login/', {'username': self.user.username, 'password': 'secret-pass-1'}
+        )
+        self.assertEqual(response.status_code, 302)
+        response = await self.async_client.get('/favorites/')
+        self.assertEqual(response.status_code, 200)
+
+    async def test_export_streams_asynchronously(self):
+        response = await self.async_client.get('/export/jsonl/?sort_by=title')
+        self.assertTrue(response.is_async)
+        lines = [line async for line in response.streaming_content]
+        self.assertEqual(len(lines), await LibraryResource.objects.acount())
+
+
+class FavoritesCacheTests(CatalogTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    def test_membership_is_cached_and_limited_to_the_given_ids(self):
+        resources = list(LibraryResource.objects.order_by('pk').values_list('pk', flat=True))
+        UserFavorite.objects.filter(user=self.user, resource_id=resources[0]).delete()
+        self.assertEqual(favorites.favorited(self.user, resources[:3]), set(resources[1:3]))
+        with self.assertNumQueries(0):
+            self.assertTrue(favorites.is_favorited(self.user, resources[1]))
+            self.assertFalse(favorites.is_favorited(self.user, resources[0]))
+
+    def test_toggle_invalidates_search_and_detail(self):
+        response = self.client.get('/?sort_by=title')
+        page_ids = [resource.pk for resource in response.context['resources']]
+        self.assertEqual(response.context['favorite_ids'], set(page_ids))
+
+        resource = LibraryResource.objects.get(pk=page_ids[0])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/favorite/{resource.pk}/')
+        self.assertNotIn(resource.pk, self.client.get('/?sort_by=title').context['favorite_ids'])
+        self.assertFalse(self.client.get(resource.get_absolute_url()).context['is_favorited'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/favorite/{resource.pk}/')
+        self.assertTrue(self.client.get(resource.get_absolute_url()).context['is_favorited'])
+
+
+class FavoritesBatchTests(CatalogTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.user = User.objects.create_user('batch')
+        cls.ids = list(LibraryResource.objects.order_by('pk').values_list('pk', flat=True))
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    def post(self, operations):
+        return self.client.post(
+            '/api/favorites/batch/', json.dumps({'operations': operations}), content_type='application/json'
+        )
+
+    def test_applies_operations_in_order_and_returns_final_state(self):
+        UserFavorite.objects.create(user=self.user, resource_id=self.ids[0], date_added=timezone.now())
+        self.assertEqual(favorites.resource_ids(self.user.pk), {self.ids[0]})
+        operations = [
+            {'action': 'add', 'resource': self.ids[1]},
+            {'action': 'add', 'resource': self.ids[2]},
+            {'action': 'remove', 'resource': self.ids[2]},
+            {'action': 'remove', 'resource': self.ids[0]},
+            {'action': 'add', 'resource': self.ids[3]},
+            {'action': 'add', 'resource': self.ids[3]},
+            {'action': 'add', 'resource': 999999},
+        ]
+        with self.captureOnCommitCallbacks(execute=True):
+            data = self.post(operations).json()
+        self.assertEqual(data['favorites'], [self.ids[1], self.ids[3]])
+        self.assertEqual(data['unknown'], [999999])
+        self.assertEqual(
+            set(UserFavorite.objects.filter(user=self.user).values_list('resource_id', flat=True)),
+            {self.ids[1], self.ids[3]},
+        )
+        with self.assertNumQueries(0):
+            self.assertEqual(favorites.resource_ids(self.user.pk), {self.ids[1], self.ids[3]})
+
+    def test_query_count_does_not_grow_with_the_batch(self):
+        def operations(ids):
+            return [{'action': 'add', 'resource': pk} for pk in ids] + [
+                {'action': 'remove', 'resource': pk} for pk in ids[::2]
+            ]
+
+        with CaptureQueriesContext(connection) as small:
+            self.post(operations(self.ids[:2]))
+        with CaptureQueriesContext(connection) as large:
+            self.post(operations(self.ids[2:]))
+        self.assertEqual(len(small), len(large))
+
+    def test_errors(self):
+        self.assertEqual(self.post([{'action': 'star', 'resource': self.ids[0]}]).status_code, 400)
+        self.assertEqual(self.post([{'action': 'add', 'resource': '1'}]).status_code, 400)
+        self.assertEqual(self.post([{'action': 'add'}]).status_code, 400)
+        self.assertEqual(
+            self.client.post('/api/favorites/batch/', 'nope', content_type='application/json').status_code, 400
+        )
+        self.client.logout()
+        self.assertEqual(self.post([]).status_code, 401)
+
+
+def routed_write():
+    """Ask the router for a write database, as a write query would"""
+    return LibraryResource.objects.select_for_update().db
+
+
+@override_settings(LIBRARY_REPLICAS=['replica'])
+class ReplicaRoutingTests(SimpleTestCase):
+    """Routing decisions only: ``QuerySet.db`` asks the router without querying"""
+
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def run_request(self, request, view):
+        seen = {}
+
+        def get_response(request):
+            seen['db'] = LibraryResource.objects.all().db
+            view(request)
+            seen['after'] = LibraryResource.objects.all().db
+            return HttpResponse()
+
+        response = replicas.ReplicaMiddleware(get_response)(request)
+        return response, seen
+
+    def test_reads_outside_requests_use_primary(self):
+        self.assertEqual(LibraryResource.objects.all().db, 'default')
+
+    def test_safe_request_reads_catalog_from_replica_until_it_writes(self):
+        def view(request):
+            self.assertEqual(User.objects.all().db, 'default')
+            routed_write()
+
+        response, seen = self.run_request(self.factory.get('/'), view)
+        self.assertEqual(seen, {'db': 'replica', 'after': 'default'})
+        self.assertNotIn(replicas.PIN_COOKIE, response.cookies)
+
+    def test_writes_pin_the_browser_to_primary(self):
+        response, seen = self.run_request(self.factory.post('/'), lambda request: routed_write())
+        self.assertEqual(seen['db'], 'default')
+        self.assertEqual(response.cookies[replicas.PIN_COOKIE]['max-age'], 10)
+
+        response, _ = self.run_request(self.factory.post('/'), lambda request: None)
+        self.assertNotIn(replicas.PIN_COOKIE, response.cookies)
+
+        request = self.factory.get('/')
+        request.COOKIES[replicas.PIN_COOKIE] = '1'
+        _, seen = self.run_request(request, lambda request: None)
+        self.assertEqual(seen['db'], 'default')
+
+    def test_results_read_from_replica_just_after_a_change_are_not_cached(self):
+        search_cache.bump_catalog_version()
+
+        def view(request):
+            self.assertFalse(search_cache.cacheable())
+
+        self.run_request(self.factory.get('/'), view)
+        self.assertTrue(search_cache.cacheable())
+        with override_settings(LIBRARY_REPLICA_PIN_SECONDS=0):
+            self.run_request(self.factory.get('/'), lambda request: self.assertTrue(search_cache.cacheable()))
+
+    def test_streamed_bodies_read_the_request_replica(self):
+        def body():
+            yield LibraryResource.objects.all().db
+
+        def get_response(request):
+            return StreamingHttpResponse(replicas.in_request(body()))
+
+        response = replicas.ReplicaMiddleware(get_response)(self.factory.get('/'))
+        self.assertEqual(list(response.streaming_content), [b'replica'])
+
+
+class SearchCardTests(CatalogTestCase):
+    catalog_size = 10
+
+    def test_cards_follow_links(self):
+        resource = LibraryResource.objects.filter(keyword_count__gt=0).first()
+        author = resource.authors.first()
+        with self.captureOnCommitCallbacks(execute=True):
+            author.last_name = 'Renamed'
+            author.save()
+            resource.keywords.add(Keyword.objects.create(word='zz-card-test'))
+        resource.refresh_from_db()
+        self.assertIn(f'{author.first_name} Renamed', resource.author_names)
+        self.assertEqual(resource.keyword_count, resource.keywords.count())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            resource.keywords.clear()
+        resource.refresh_from_db()
+        self.assertEqual((resource.top_keywords, resource.keyword_count), ([], 0))
+
+    def test_rebuild_matches_maintained_fields(self):
+        self.assertEqual(cards.rebuild(), 0)
+
+
+class CoFavoriteTests(CatalogTestCase):
+    catalog_size = 10
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        UserFavorite.objects.all().delete()
+        cls.resources = list(LibraryResource.objects.order_by('pk'))
+        cls.users = [User.objects.create_user(f'patron{n}') for n in range(4)]
+        r = cls.resources
+        for user, picks in zip(cls.users, [(r[0], r[1], r[2]), (r[0], r[1]), (r[0], r[3])]):
+            UserFavorite.objects.bulk_create([
+                UserFavorite(user=user, resource=resource, date_added=timezone.now()) for resource in picks
+            ])
+
+    def setUp(self):
+        super().setUp()
+        cofavorites.build()
+
+    def drain(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return cofavorites.process_queue()
+
+    def favorite(self, user, resource):
+        with self.captureOnCommitCallbacks(execute=True):
+            UserFavorite.objects.create(user=user, resource=resource, date_added=timezone.now())
+        self.drain()
+
+    def test_pairs_need_two_shared_patrons(self):
+        r = self.resources
+        self.assertEqual(cofavorites.also_favorited(r[0]), [r[1]])
+        self.assertEqual(cofavorites.also_favorited(r[1]), [r[0]])
+        # Only one patron favorited r0 and r2 (or r0 and r3) together
+        self.assertEqual(cofavorites.also_favorited(r[2]), [])
+        self.assertEqual(cofavorites.also_favorited(r[3]), [])
+
+    def test_new_favorites_update_incrementally_like_a_rebuild(self):
+        r = self.resources
+        self.favorite(self.users[2], r[2])
+        self.assertEqual(cofavorites.also_favorited(r[2]), [r[0]])
+        self.assertIn(r[2], cofavorites.also_favorited(r[0]))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            favorites.apply(self.users[3], [(favorites.ADD, r[1].pk), (favorites.ADD, r[2].pk)])
+        self.drain()
+        incremental = {resource.pk: cofavorites.also_favorited(resource) for resource in r}
+        cofavorites.build()
+        self.assertEqual(incremental, {resource.pk: cofavorites.also_favorited(resource) for resource in r})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            UserFavorite.objects.filter(user=self.users[1]).delete()
+        self.drain()
+        self.assertNotIn(r[1], cofavorites.also_favorited(r[0]))
+
+    def test_changes_are_queued_once_per_transaction(self):
+        r = self.resources
+        with mock.patch.object(cofavorites, 'update') as update:
+            with self.captureOnCommitCallbacks(execute=True):
+                # Cascades to the user's three favorites
+                self.users[0].delete()
+            update.assert_not_called()
+            self.assertEqual(
+                set(CoFavoriteUpdate.objects.values_list('resource_id', flat=True)), {r[0].pk, r[1].pk, r[2].pk}
+            )
+            self.assertEqual(self.drain(), 3)
+        self.assertEqual(update.call_count, 1)
+        self.assertEqual(set(update.call_args.args[0]), {r[0].pk, r[1].pk, r[2].pk})
+        self.assertFalse(CoFavoriteUpdate.objects.exists())
+
+    def test_toggle_only_queues(self):
+        self.client.force_login(self.users[2])
+        with mock.patch.object(cofavorites, 'update') as update, self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(f'/favorite/{self.resources[2].pk}/')
+        self.assertTrue(json.loads(response.content)['favorited'])
+        update.assert_not_called()
+        self.assertTrue(CoFavoriteUpdate.objects.filter(resource_id=self.resources[2].pk).exists())
+
+    def test_update_command(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            UserFavorite.objects.filter(user=self.users[2], resource=self.resources[3]).delete()
+        out = io.StringIO()
+        call_command('update_cofavorites', stdout=out)
+        self.assertIn('✓ Updated recommendations for 1 queued resources', out.getvalue())
+
+    def test_detail_and_profile_pages(self):
+        r = self.resources
+        url = r[0].get_absolute_url()
+        response = self.client.get(url)
+        self.assertEqual(response.context['also_favorited'], [r[1]])
+        etag = response['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        unrelated = r[5].get_absolute_url()
+        unrelated_etag = self.client.get(unrelated)['ETag']
+        self.favorite(self.users[2], r[2])
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        # Pages whose recommendations did not change stay valid
+        self.assertEqual(self.client.get(unrelated, HTTP_IF_NONE_MATCH=unrelated_etag).status_code, 304)
+
+        # Patron 2 favorited r0, r2 and r3; r1 is shared by r0's other patrons
+        self.client.force_login(self.users[2])
+        self.assertEqual(self.client.get('/profile/').context['recommendations'], [r[1]])
+
+
+class ConditionalGetTests(CatalogTestCase):
+    catalog_size = 10
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.resource = LibraryResource.objects.first()
+
+    def test_detail_not_modified_until_resource_changes(self):
+        url = f'/resource/{self.resource.pk}/'
+        first = self.client.get(url)
+        self.assertTrue(first['ETag'].startswith('W/'))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 304)
+        # Only the resource row is read (the rest is the view counter)
+        self.assertFalse([q for q in queries if 'library_keyword' in q['sql'] or 'related' in q['sql']])
+        self.assertEqual(
+            self.client.get(url, HTTP_IF_MODIFIED_SINCE=first['Last-Modified']).status_code, 304
+        )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.resource.title += ' (revised)'
+            self.resource.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag']).status_code, 200)
+
+    def test_search_depends_on_parameters_catalog_and_favorites(self):
+        first = self.client.get('/?query=research')
+        etag = first['ETag']
+        self.assertEqual(self.client.get('/?query=research', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.client.get('/?query=energy', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        user = User.objects.create_user('conditional')
+        self.client.force_login(user)
+        etag = self.client.get('/?query=research')['ETag']
+        self.assertNotIn('Last-Modified', self.client.get('/?query=research'))
+        with self.captureOnCommitCallbacks(execute=True):
+            UserFavorite.objects.create(user=user, resource=self.resource, date_added=timezone.now())
+        self.assertEqual(self.client.get('/?query=research', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class _AtMost:
+    """Like ``assertNumQueries`` but fails only above ``budget``"""
+
+    def __init__(self, test_case, budget, name):
+        self.test_case = test_case
+        self.budget = budget
+        self.name = name
+        self.context = CaptureQueriesContext(connection)
+
+    def __enter__(self):
+        return self.context.__enter__()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.context.__exit__(exc_type, exc_value, traceback)
+        if exc_type is None:
+            executed = len(self.context)
+            self.test_case.assertLessEqual(
+                executed, self.budget,
+                '%s ran %d queries, budget is %d:\n%s' % (
+                    self.name, executed, self.budget,
+                    '\n'.join(query['sql'] for query in self.context.captured_queries),
+                ),
+            )
@@ -13,16 +13,22 @@ urlpatterns = [
     
     # Main search
     path('', views.LibrarySearchView.as_view(), name='search'),
+    path('export/<str:export_format>/', views.export_search, name='export_search'),
     
     # Resource details
     path('resource/<int:pk>/', views.ResourceDetailView.as_view(), name='resource_detail'),
+    path('resource/<int:pk>/download/', views.download_resource, name='download_resource'),
     
     # User interactions
     path('favorite/<int:resource_id>/', views.toggle_favorite, name='toggle_favorite'),
+    path('api/favorites/batch/', views.favorites_batch, name='favorites_batch'),
     
     # AJAX endpoints
     path('api/keywords/', views.keyword_autocomplete, name='keyword_autocomplete'),
+    path('api/search/', views.search_api, name='search_api'),
+    path('api/resources/', views.resource_lookup, name='resource_lookup'),
     
     # Statistics
     path('statistics/', views.statistics_view, name='statistics'),
+    path('api/metrics/', views.request_metrics, name='request_metrics'),
 ]
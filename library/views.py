@@ -1,15 +1,50 @@
+import hashlib
+import json
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth import login, authenticate, logout
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib import messages
-from django.db.models import Q, Count
-from django.core.paginator import Paginator
-from django.http import JsonResponse
+from django.db import IntegrityError
+from django.db.models import Q, Count, prefetch_related_objects
+from django.core.paginator import Paginator, InvalidPage
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, Http404, HttpResponseNotAllowed
 from django.views.generic import ListView, DetailView
 from django.views.decorators.http import require_http_methods
 from django.urls import reverse
 from .models import LibraryResource, Subject, ResourceType, Keyword, SearchLog, UserFavorite, Author
 from .forms import LibrarySearchForm, UserRegistrationForm, UserLoginForm
+from . import cofavorites, conditional, export, favorites, instrumentation, projection, search_cache, statistics
+from .facets import facet_options
+from .related import related_resources
+from .pagination import CursorPaginator, InvalidCursor, wants_cursor, cursor_querystring, export_querystring
+from .search import SearchPlan, SearchPaginator, catalog_totals
+from .suggest import suggester, KEYWORD, KIND_LABELS
+
+
+def async_require_http_methods(request_method_list):
+    """``require_http_methods`` for async views (Django 4.2's is sync-only)"""
+    def decorator(view):
+        @wraps(view)
+        async def inner(request, *args, **kwargs):
+            if request.method not in request_method_list:
+                return HttpResponseNotAllowed(request_method_list)
+            return await view(request, *args, **kwargs)
+        return inner
+    return decorator
+
+
+async def auser(request):
+    """``request.user``, loaded without blocking the event loop"""
+    # Touching the lazy user runs the session and user queries
+    await sync_to_async(lambda: request.user.is_authenticated)()
+    return request.user
 
 
 def home(request):
@@ -234,6 +269,7 @@ def profile_view(request):
         'favorites': favorites,
         'recent_searches': recent_searches,
         'favorites_count': favorites.count(),
+        'recommendations': cofavorites.recommended_for(user),
     }
     return render(request, 'library/profile.html', context)
 
@@ -243,16 +279,27 @@ def favorites_view(request):
     """View user's favorite resources"""
     favorites = UserFavorite.objects.filter(user=request.user).select_related(
         'resource', 'resource__resource_type'
-    ).prefetch_related('resource__authors', 'resource__subjects')
+    )
     
     # Pagination
-    paginator = Paginator(favorites, 20)
-    page = request.GET.get('page')
-    favorites_page = paginator.get_page(page)
+    if wants_cursor(request):
+        try:
+            paginator = CursorPaginator(favorites, 20)
+            favorites_page = paginator.page(request.GET.get('cursor'))
+        except InvalidCursor as e:
+            raise Http404(str(e))
+        total_favorites = paginator.count
+    else:
+        paginator = Paginator(favorites, 20)
+        page = request.GET.get('page')
+        favorites_page = paginator.get_page(page)
+        total_favorites = paginator.count
     
     context = {
         'favorites': favorites_page,
-        'total_favorites': favorites.count(),
+        'total_favorites': total_favorites,
+        'cursor_pagination': wants_cursor(request),
+        'cursor_query': cursor_querystring(request),
     }
     return render(request, 'library/favorites.html', context)
 class LibrarySearchView(ListView):
@@ -261,123 +308,158 @@ class LibrarySearchView(ListView):
     context_object_name = 'resources'
     paginate_by = 20
     
+    def get(self, request, *args, **kwargs):
+        validators = conditional.search_validators(request)
+        response = validators.not_modified(request)
+        if response is None:
+            response = super().get(request, *args, **kwargs)
+        return validators.apply(response)
+    
     def get_queryset(self):
-        form = LibrarySearchForm(self.request.GET)
-        queryset = LibraryResource.objects.select_related('resource_type').prefetch_related(
-            'authors', 'subjects', 'keywords'
+        self.plan = SearchPlan(self.request.GET)
+        return self.plan.queryset
+    
+    def get_paginator(self, queryset, per_page, orphans=0, allow_empty_first_page=True, **kwargs):
+        return SearchPaginator(
+            self.plan, queryset, per_page, orphans=orphans,
+            allow_empty_first_page=allow_empty_first_page, **kwargs
         )
+    
+    def paginate_queryset(self, queryset, page_size):
+        """Serve the page from the search cache when possible"""
+        if wants_cursor(self.request):
+            paginator = CursorPaginator(
+                queryset, page_size, count=lambda: self.plan.count,
+                version=search_cache.get_catalog_version(),
+            )
+            try:
+                page_obj = paginator.page(self.request.GET.get('cursor'))
+            except InvalidCursor as e:
+                raise Http404(str(e))
+            # Counted on the first page and carried by the cursor after it,
+            # until the catalog changes
+            self.plan.set_count(paginator.count)
+            return paginator, page_obj, page_obj.object_list, page_obj.has_other_pages()
         
-        if form.is_valid():
-            query = form.cleaned_data.get('query', '').strip()
-            resource_type = form.cleaned_data.get('resource_type')
-            subject = form.cleaned_data.get('subject')
-            year_range = form.cleaned_data.get('year_range')
-            availability = form.cleaned_data.get('availability')
-            sort_by = form.cleaned_data.get('sort_by', 'relevance')
-            
-            # Keyword search
-            if query:
-                queryset = queryset.filter(
-                    Q(title__icontains=query) |
-                    Q(description__icontains=query) |
-                    Q(abstract__icontains=query) |
-                    Q(authors__first_name__icontains=query) |
-                    Q(authors__last_name__icontains=query) |
-                    Q(keywords__word__icontains=query)
-                ).distinct()
-                
-                # Log search
-                SearchLog.objects.create(
-                    query=query,
-                    user=self.request.user if self.request.user.is_authenticated else None,
-                    results_count=queryset.count()
-                )
-            
-            # Apply filters
-            if resource_type:
-                queryset = queryset.filter(resource_type=resource_type)
-            
-            if subject:
-                queryset = queryset.filter(subjects=subject)
-            
-            if year_range:
-                if year_range == 'before-2000':
-                    queryset = queryset.filter(publication_year__lt=2000)
-                else:
-                    start_year, end_year = map(int, year_range.split('-'))
-                    queryset = queryset.filter(
-                        publication_year__gte=start_year,
-                        publication_year__lte=end_year
-                    )
-            
-            if availability:
-                queryset = queryset.filter(availability=availability)
-            
-            # Apply sorting
-            
-            if sort_by and sort_by != 'relevance':
-                queryset = queryset.order_by(sort_by)
-            else:
-                queryset = queryset.order_by('-view_count', '-date_added')
+        cleaned_data = self.plan.cleaned_data
+        page_kwarg = self.page_kwarg
+        page = self.kwargs.get(page_kwarg) or self.request.GET.get(page_kwarg) or 1
         
-        return queryset.distinct()
+        cached = search_cache.get_page(cleaned_data, page)
+        if cached is None:
+            paginator, page_obj, object_list, is_paginated = super().paginate_queryset(
+                queryset, page_size
+            )
+            search_cache.set_page(
+                cleaned_data, page, [obj.pk for obj in page_obj.object_list], paginator.count
+            )
+            return paginator, page_obj, object_list, is_paginated
+        
+        resource_ids, count = cached
+        self.plan.set_count(count)
+        results = search_cache.CachedResults(count, 0, [])
+        paginator = self.get_paginator(
+            results, page_size, orphans=self.get_paginate_orphans(),
+            allow_empty_first_page=self.get_allow_empty(),
+        )
+        try:
+            page_number = paginator.num_pages if page == 'last' else paginator.validate_number(page)
+        except InvalidPage as e:
+            raise Http404(f'Invalid page ({page}): {e}')
+        
+        results.offset = (page_number - 1) * paginator.per_page
+        results.objects = self.plan.load(resource_ids)
+        page_obj = paginator.page(page_number)
+        return paginator, page_obj, page_obj.object_list, page_obj.has_other_pages()
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['form'] = LibrarySearchForm(self.request.GET)
-        context['total_resources'] = LibraryResource.objects.count()
-        context['available_resources'] = LibraryResource.objects.filter(
-            availability='available'
-        ).count()
-        context['digital_resources'] = LibraryResource.objects.filter(
-            availability='digital'
-        ).count()
+        self.plan.log(self.request.user)
+        
+        totals = catalog_totals()
+        context['form'] = self.plan.form
+        context['total_resources'] = totals['total']
+        context['available_resources'] = totals['available']
+        context['digital_resources'] = totals['digital']
         context['popular_keywords'] = Keyword.objects.order_by('-frequency')[:10]
-        context['results_count'] = self.get_queryset().count()
+        context['results_count'] = self.plan.count
+        context['results_count_is_estimate'] = self.plan.count_is_estimate
+        if self.request.GET:
+            context['facets'] = facet_options(self.plan, self.request.GET)
+        context['export_query'] = export_querystring(self.request)
+        if wants_cursor(self.request):
+            context['cursor_pagination'] = True
+            context['cursor_query'] = cursor_querystring(self.request)
+            # Relevance ranks have no key to seek by; those pages go by position
+            context['cursor_by_position'] = not context['paginator'].seekable
         
-        # Add user favorites if authenticated
+        # Favorites among the resources on this page
         if self.request.user.is_authenticated:
-            favorite_ids = UserFavorite.objects.filter(
-                user=self.request.user
-            ).values_list('resource_id', flat=True)
-            context['favorite_ids'] = list(favorite_ids)
+            context['favorite_ids'] = favorites.favorited(
+                self.request.user, [resource.pk for resource in context['object_list']]
+            )
         
         return context
 
 
 class ResourceDetailView(DetailView):
     model = LibraryResource
+    queryset = LibraryResource.objects.select_related('resource_type')
     template_name = 'library/resource_detail.html'
     context_object_name = 'resource'
     
-    def get_object(self, queryset=None):
-        obj = super().get_object(queryset)
-        obj.increment_view_count()
-        return obj
+    def get(self, request, *args, **kwargs):
+        self.object = self.get_object()
+        # Counted whether the page is rendered or revalidated
+        self.object.increment_view_count()
+        validators = conditional.resource_validators(request, self.object)
+        response = validators.not_modified(request)
+        if response is None:
+            prefetch_related_objects([self.object], 'authors', 'subjects', 'keywords')
+            response = self.render_to_response(self.get_context_data(object=self.object))
+        return validators.apply(response)
     
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         
-        # Related resources
-        context['related_resources'] = LibraryResource.objects.filter(
-            subjects__in=self.object.subjects.all()
-        ).exclude(pk=self.object.pk).distinct()[:5]
+        # Related resources, precomputed by library.related
+        context['related_resources'] = related_resources(self.object)
+        
+        # "Patrons who favorited this also favorited", precomputed by library.cofavorites
+        context['also_favorited'] = cofavorites.also_favorited(self.object)
         
         # Check if user has favorited
         if self.request.user.is_authenticated:
-            context['is_favorited'] = UserFavorite.objects.filter(
-                user=self.request.user,
-                resource=self.object
-            ).exists()
+            context['is_favorited'] = favorites.is_favorited(self.request.user, self.object.pk)
         
         return context
 
 
-@login_required
-@require_http_methods(["POST"])
-def toggle_favorite(request, resource_id):
-    # Check if user is logged in
-    if not request.user.is_authenticated:
+@require_http_methods(["GET"])
+def export_search(request, export_format):
+    """Stream the results of a search (same parameters as the search page), up to the export limit"""
+    if export_format not in export.FORMATS:
+        raise Http404(f'Unknown export format: {export_format}')
+    plan = SearchPlan(request.GET)
+    if not plan.is_valid:
+        return JsonResponse({'error': 'Invalid search', 'errors': plan.form.errors}, status=400)
+    return export.export_response(plan, export_format, asynchronous=isinstance(request, ASGIRequest))
+
+
+@require_http_methods(["GET"])
+def download_resource(request, pk):
+    """Count a download and send the user on to the resource"""
+    resource = get_object_or_404(LibraryResource.objects.only('pk', 'url', 'download_count'), pk=pk)
+    resource.increment_download_count()
+    if resource.url:
+        return redirect(resource.url)
+    return redirect(resource)
+
+
+@async_require_http_methods(["POST"])
+async def toggle_favorite(request, resource_id):
+    user = await auser(request)
+    if not user.is_authenticated:
         return JsonResponse({
             'favorited': False,
             'message': 'Please login to save favorites',
@@ -386,17 +468,17 @@ def toggle_favorite(request, resource_id):
         }, status=401)
     
     try:
-        resource = get_object_or_404(LibraryResource, pk=resource_id)
-        favorite, created = UserFavorite.objects.get_or_create(
-            user=request.user,
-            resource=resource
-        )
-        
-        if not created:
-            favorite.delete()
+        # Removing is a single DELETE; adding checks the resource exists first
+        removed, _ = await UserFavorite.objects.filter(user=user, resource_id=resource_id).adelete()
+        if removed:
             favorited = False
             message = "Removed from favorites"
         else:
+            resource = await LibraryResource.objects.only('pk').aget(pk=resource_id)
+            try:
+                await UserFavorite.objects.acreate(user=user, resource=resource)
+            except IntegrityError:
+                pass  # a concurrent double click added it first
             favorited = True
             message = "Added to favorites"
         
@@ -405,23 +487,193 @@ def toggle_favorite(request, resource_id):
             'message': message,
             'success': True
         })
+    except LibraryResource.DoesNotExist:
+        raise Http404('No resource matches the given query.')
     except Exception as e:
         return JsonResponse({
             'success': False,
             'message': f'Error: {str(e)}'
         }, status=500)
 
+FAVORITES_BATCH_LIMIT = 1000
+
+
+def batch_operations(body):
+    """``(action, resource id)`` pairs from a batch request body; raises ValueError"""
+    try:
+        operations = json.loads(body)['operations']
+    except (ValueError, KeyError, TypeError):
+        raise ValueError('Expected a JSON object with an "operations" list')
+    if not isinstance(operations, list) or len(operations) > FAVORITES_BATCH_LIMIT:
+        raise ValueError(f'"operations" must be a list of at most {FAVORITES_BATCH_LIMIT} items')
+    pairs = []
+    for index, operation in enumerate(operations):
+        try:
+            action, resource_id = operation['action'], operation['resource']
+        except (KeyError, TypeError):
+            raise ValueError(f'Operation {index} needs "action" and "resource"')
+        if action not in (favorites.ADD, favorites.REMOVE):
+            raise ValueError(f'Operation {index}: action must be "add" or "remove"')
+        if not isinstance(resource_id, int) or isinstance(resource_id, bool):
+            raise ValueError(f'Operation {index}: resource must be a resource id')
+        pairs.append((action, resource_id))
+    return pairs
+
+
+@require_http_methods(["POST"])
+def favorites_batch(request):
+    """
+    Apply many favorite changes at once, e.g. from an offline client.
+
+    The body is ``{"operations": [{"action": "add" | "remove", "resource":
+    <id>}, ...]}``, applied in order in one transaction with a fixed number
+    of queries (``favorites.apply``). The response lists every resource the
+    user has favorited afterwards, and any added ids that match no resource.
+    """
+    if not request.user.is_authenticated:
+        return JsonResponse({
+            'success': False,
+            'message': 'Please login to save favorites',
+            'redirect': True,
+            'redirect_url': f"{reverse('library:login')}?next={reverse('library:favorites')}"
+        }, status=401)
+    try:
+        operations = batch_operations(request.body)
+    except ValueError as e:
+        return JsonResponse({'success': False, 'message': str(e)}, status=400)
+    
+    favorite_ids, unknown = favorites.apply(request.user, operations)
+    return JsonResponse({
+        'success': True,
+        'favorites': sorted(favorite_ids),
+        'unknown': unknown,
+    })
+
+
+API_DEFAULT_FIELDS = ['id', 'title', 'author_names', 'resource_type', 'publication_year', 'availability']
+API_MAX_PAGE_SIZE = 100
+
+
+def api_fields(request):
+    """``(fields, None)`` from the ``fields`` parameter, or ``(None, error response)``"""
+    fields = [field for field in request.GET.get('fields', '').split(',') if field] or API_DEFAULT_FIELDS
+    unknown = [field for field in fields if field not in projection.FIELDS]
+    if unknown:
+        return None, JsonResponse({
+            'error': f'Unknown fields: {", ".join(unknown)}',
+            'fields': projection.FIELDS,
+        }, status=400)
+    return fields, None
+
+
 @require_http_methods(["GET"])
-def keyword_autocomplete(request):
+def search_api(request):
+    """
+    Search results as JSON: same parameters as the search page, plus
+    ``fields`` (comma-separated, see ``projection.FIELDS``), ``page`` and
+    ``page_size``. Rows are projected with ``values()``; no model instances
+    or templates.
+    """
+    fields, error = api_fields(request)
+    if error:
+        return error
+    
+    plan = SearchPlan(request.GET)
+    if not plan.is_valid:
+        return JsonResponse({'error': 'Invalid search', 'errors': plan.form.errors}, status=400)
+    try:
+        page_size = min(max(int(request.GET.get('page_size', 20)), 1), API_MAX_PAGE_SIZE)
+    except ValueError:
+        return JsonResponse({'error': 'page_size must be a number'}, status=400)
+    
+    page = request.GET.get('page') or 1
+    cache_page = f'{page}:{page_size}'
+    cached = search_cache.get_page(plan.cleaned_data, cache_page)
+    try:
+        if cached is None:
+            queryset = projection.values(plan.order(plan.filtered()).distinct(), fields)
+            paginator = SearchPaginator(plan, queryset, page_size)
+            page_obj = paginator.page(page)
+            rows = list(page_obj.object_list)
+            search_cache.set_page(
+                plan.cleaned_data, cache_page, [row['id'] for row in rows], paginator.count
+            )
+        else:
+            resource_ids, count = cached
+            plan.set_count(count)
+            paginator = SearchPaginator(plan, search_cache.CachedResults(count, 0, []), page_size)
+            page_obj = paginator.page(page)
+            by_id = {
+                row['id']: row
+                for row in projection.values(LibraryResource.objects.filter(pk__in=resource_ids), fields)
+            }
+            rows = [by_id[pk] for pk in resource_ids if pk in by_id]
+    except InvalidPage as e:
+        return JsonResponse({'error': f'Invalid page ({page}): {e}'}, status=404)
+    
+    plan.log(request.user)
+    return JsonResponse({
+        'count': paginator.count,
+        'count_is_estimate': plan.count_is_estimate,
+        'page': page_obj.number,
+        'num_pages': paginator.num_pages,
+        'page_size': page_size,
+        'results': projection.attach(rows, fields),
+    })
+
+
+@async_require_http_methods(["GET"])
+async def resource_lookup(request):
+    """
+    Resources by id as JSON: ``ids`` (comma-separated, at most
+    ``API_MAX_PAGE_SIZE``) and ``fields`` as for ``search_api``. Results are
+    cached per catalog version, so popularity counters may lag as they do on
+    cached search pages.
+    """
+    fields, error = api_fields(request)
+    if error:
+        return error
+    try:
+        resource_ids = list(dict.fromkeys(int(pk) for pk in request.GET.get('ids', '').split(',') if pk))
+    except ValueError:
+        return JsonResponse({'error': 'ids must be numbers'}, status=400)
+    if not 1 <= len(resource_ids) <= API_MAX_PAGE_SIZE:
+        return JsonResponse({'error': f'Give between 1 and {API_MAX_PAGE_SIZE} ids'}, status=400)
+    
+    digest = hashlib.md5(
+        f'{resource_ids}:{fields}'.encode(), usedforsecurity=False
+    ).hexdigest()
+    key = f'library:lookup:{await search_cache.aget_catalog_version()}:{digest}'
+    payload = await cache.aget(key)
+    if payload is None:
+        queryset = projection.values(LibraryResource.objects.filter(pk__in=resource_ids), fields)
+        by_id = {row['id']: row async for row in queryset}
+        payload = {
+            'results': await projection.aattach(
+                [by_id[pk] for pk in resource_ids if pk in by_id], fields
+            ),
+            'missing': [pk for pk in resource_ids if pk not in by_id],
+        }
+        if await search_cache.acacheable():
+            await cache.aset(key, payload, getattr(settings, 'LIBRARY_SEARCH_CACHE_TIMEOUT', 300))
+    return JsonResponse(payload)
+
+
+@async_require_http_methods(["GET"])
+async def keyword_autocomplete(request):
     """Autocomplete for keyword search"""
     term = request.GET.get('term', '').strip()
     
     if len(term) >= 2:
-        keywords = Keyword.objects.filter(
-            word__icontains=term
-        ).order_by('-frequency')[:10]
-        
-        suggestions = [{'value': kw.word, 'label': f"{kw.word} ({kw.frequency})"} for kw in keywords]
+        suggestions = [
+            {
+                'value': s.text,
+                'label': f"{s.text} ({s.weight})" if s.kind == KEYWORD
+                         else f"{s.text} ({KIND_LABELS[s.kind]})",
+                'category': s.kind,
+            }
+            for s in await suggester.asuggest(term)
+        ]
     else:
         suggestions = []
     
@@ -430,15 +682,26 @@ def keyword_autocomplete(request):
 
 def statistics_view(request):
     """Dashboard with library statistics"""
+    snapshot = statistics.get_snapshot()
     context = {
-        'total_resources': LibraryResource.objects.count(),
-        'available_resources': LibraryResource.objects.filter(availability='available').count(),
-        'digital_resources': LibraryResource.objects.filter(availability='digital').count(),
-        'total_authors': Author.objects.count(),
-        'total_subjects': Subject.objects.count(),
-        'popular_resources': LibraryResource.objects.order_by('-view_count')[:10],
-        'recent_searches': SearchLog.objects.order_by('-timestamp')[:10],
-        'top_keywords': Keyword.objects.order_by('-frequency')[:20],
+        'total_resources': snapshot.total_resources,
+        'available_resources': snapshot.available_resources,
+        'digital_resources': snapshot.digital_resources,
+        'total_authors': snapshot.total_authors,
+        'total_subjects': snapshot.total_subjects,
+        'popular_resources': snapshot.popular_resources,
+        'recent_searches': list(SearchLog.objects.order_by('-timestamp')[:10]),
+        'top_keywords': snapshot.top_keywords,
     }
     
-    return render(request, 'library/statistics.html', context)
\ No newline at end of file
+    return render(request, 'library/statistics.html', context)
+
+
+@staff_member_required
+@require_http_methods(["GET"])
+def request_metrics(request):
+    """Request histograms collected by this worker process"""
+    return JsonResponse({
+        'sample_rate': getattr(settings, 'LIBRARY_INSTRUMENTATION_SAMPLE_RATE', 0.0),
+        'views': instrumentation.registry.snapshot(),
+    })
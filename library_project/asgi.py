@@ -3,6 +3,41 @@ ASGI config for library_project project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+ASGI deployment
+---------------
+
+The site runs under either protocol from the same settings. Under ASGI the
+async views -- ``keyword_autocomplete``, ``toggle_favorite`` and
+``resource_lookup`` -- run on the event loop; each worker process holds any
+number of them in flight instead of one request per sync worker, which
+suits the burst of small requests autocomplete sends while someone types.
+Sync views keep working unchanged, each run in a worker thread.
+
+``MIDDLEWARE`` is Django's stock list plus WhiteNoise. Django runs their
+hooks (and all of WhiteNoise 6.x, which is sync-only) in worker threads
+under ASGI, so each request pays a few thread hops before it reaches an
+async view; the views' own database and cache I/O still runs without
+holding a thread for the whole request.
+
+To deploy with ASGI, install ``uvicorn`` (in requirements.txt) and replace
+the Procfile line with::
+
+    web: gunicorn library_project.asgi:application -k uvicorn.workers.UvicornWorker
+
+gunicorn still manages the worker processes (``WEB_CONCURRENCY``,
+``--timeout``); each worker runs a uvicorn event loop. Keep
+``CONN_MAX_AGE`` at 0 (the default here), as Django advises under ASGI:
+each request's ORM calls run in a thread of their own, so persistent
+connections would not be reused. Put a connection pooler (e.g. PgBouncer)
+in front of PostgreSQL instead.
+
+To compare the two modes, start one server of each on the same database
+and load them with the same traffic::
+
+    gunicorn library_project.wsgi:application -w 4 -b 127.0.0.1:8000
+    gunicorn library_project.asgi:application -w 4 -k uvicorn.workers.UvicornWorker -b 127.0.0.1:8001
+    python manage.py load_test http://127.0.0.1:8000 http://127.0.0.1:8001 --concurrency 10,100
+
 For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
 """
@@ -14,3 +49,13 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'library_project.settings')
 
 application = get_asgi_application()
+
+# Warn about (or, if required, refuse) several workers on per-process caches
+from library.checks import check_cache_at_startup  # noqa: E402
+
+check_cache_at_startup()
+
+# Build the in-memory autocomplete index before the first request needs it
+from library.suggest import suggester  # noqa: E402
+
+suggester.warm()
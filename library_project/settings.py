@@ -49,6 +49,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'library.instrumentation.InstrumentationMiddleware',
+    'library.replicas.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -62,7 +64,7 @@ ROOT_URLCONF = 'library_project.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'library.instrumentation.InstrumentedDjangoTemplates',
         'DIRS': [BASE_DIR / 'library' / 'templates'],  # Change this line
         'APP_DIRS': True,
         'OPTIONS': {
@@ -83,7 +85,7 @@ WSGI_APPLICATION = 'library_project.wsgi.application'
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
 import os
-from decouple import config
+from decouple import Csv, config
 import dj_database_url
 
 if os.environ.get('DATABASE_URL'):
@@ -101,6 +103,55 @@ else:
             'NAME': BASE_DIR / 'db.sqlite3',
         }
     }
+
+# Read replicas (library.replicas): comma-separated database URLs of copies
+# of the primary. Locally, a copy of the SQLite file can stand in for one:
+#   cp db.sqlite3 replica.sqlite3
+#   REPLICA_DATABASE_URLS=sqlite:///replica.sqlite3
+REPLICA_DATABASE_URLS = config('REPLICA_DATABASE_URLS', default='', cast=Csv())
+for number, url in enumerate(REPLICA_DATABASE_URLS, 1):
+    DATABASES[f'replica{number}'] = {
+        **dj_database_url.parse(url),
+        # Tests read the primary's test database through the replica aliases
+        'TEST': {'MIRROR': 'default'},
+    }
+LIBRARY_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+LIBRARY_REPLICA_PIN_SECONDS = config('LIBRARY_REPLICA_PIN_SECONDS', default=10, cast=int)
+DATABASE_ROUTERS = ['library.replicas.ReplicaRouter']
+
+# Cache
+# The search result cache and its catalog version live here; deployments
+# with more than one worker process need a shared cache such as Redis.
+# Without one, the library.E001 check warns and search results are not
+# cached; LIBRARY_REQUIRE_SHARED_CACHE makes startup fail instead.
+
+LIBRARY_WORKER_PROCESSES = config('WEB_CONCURRENCY', default=1, cast=int)
+LIBRARY_REQUIRE_SHARED_CACHE = config('LIBRARY_REQUIRE_SHARED_CACHE', default=False, cast=bool)
+
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ.get('REDIS_URL'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+LIBRARY_SEARCH_CACHE_TIMEOUT = config('LIBRARY_SEARCH_CACHE_TIMEOUT', default=300, cast=int)
+
+# Search exports (library.export): rows per download
+LIBRARY_EXPORT_MAX_ROWS = config('LIBRARY_EXPORT_MAX_ROWS', default=10000, cast=int)
+
+# Request instrumentation (library.instrumentation): share of requests
+# measured (off unless a deployment opts in, e.g. 0.01), and whether
+# Server-Timing headers go to everyone rather than only to staff
+LIBRARY_INSTRUMENTATION_SAMPLE_RATE = config('LIBRARY_INSTRUMENTATION_SAMPLE_RATE', default=0.0, cast=float)
+LIBRARY_SERVER_TIMING = config('LIBRARY_SERVER_TIMING', default=False, cast=bool)
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
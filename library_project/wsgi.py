@@ -14,3 +14,13 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'library_project.settings')
 
 application = get_wsgi_application()
+
+# Warn about (or, if required, refuse) several workers on per-process caches
+from library.checks import check_cache_at_startup  # noqa: E402
+
+check_cache_at_startup()
+
+# Build the in-memory autocomplete index before the first request needs it
+from library.suggest import suggester  # noqa: E402
+
+suggester.warm()